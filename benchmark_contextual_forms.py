@@ -0,0 +1,282 @@
+"""Benchmark the contextual_forms functions on the test corpus.
+
+Usage:
+
+$ python benchmark_contextual_forms.py
+$ python benchmark_contextual_forms.py path/to/input/text.txt
+
+"""
+
+import re
+import sys
+import timeit
+import unicodedata
+
+import contextual_forms
+from contextual_forms import contextualize, decontextualize, \
+     contextualize_text, decontextualize_text, \
+     contextualize_many, decontextualize_many, Shaper
+
+
+infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+
+
+def _baseline_block(block):
+    """The original block shaper, with a dictionary lookup (and
+    try/except) per character and two `re.sub` calls for the lam-alif
+    ligatures (a copy of the baseline `_contextualize_block`, kept
+    here only as a benchmark reference)."""
+    end_letters = contextual_forms.end_letters
+    other_letters = contextual_forms.other_letters
+    diacritics = contextual_forms.diacritics
+    # if the block contains only one letter (+ diacritics):
+    if len([c for c in block if (c in end_letters or \
+                                 (c in other_letters and c not in diacritics))]) == 1:
+        t = ""
+        for c in block:
+            try:
+                t += contextual_forms.iso_d[c]
+            except KeyError:
+                t += c
+        return t
+
+    final_diacritics = ""
+    while len(block)>0 and block[-1] in diacritics:
+        final_diacritics += block[-1]
+        block = block[:-1]
+
+    t = ""
+    first = True
+    for i, c in enumerate(block):
+        if first:
+            try:
+                t += contextual_forms.beg_d[c]
+                first = False
+            except KeyError:
+                t += c
+        elif i == len(block)-1:
+            t += contextual_forms.end_d[c]
+        else:
+            try:
+                t += contextual_forms.mid_d[c]
+            except KeyError:
+                t += c
+
+    # deal with lam-alif ligature:
+    t = re.sub("ﻠﺎ", "ﻼ", t)
+    t = re.sub("ﻟﺎ", "ﻻ", t)
+
+    return t + final_diacritics
+
+
+def _block_loop(text):
+    """The per-character block loop the contextualization engines replaced
+    (kept here only as a benchmark reference, with the baseline
+    block shaper; it does not fuse a hamza or madda into lam-alif
+    ligatures, so its output differs from that of the engines)."""
+    text = contextual_forms.normalize(text)
+    end_letters = contextual_forms.end_letters
+    other_letters = contextual_forms.other_letters
+    iso_d = contextual_forms.iso_d
+    shape = _baseline_block
+    new = ""
+    block = ""
+    for c in text:
+        if c in end_letters:
+            if block:
+                new += shape(block+c)
+                block = ""
+            else:
+                new += iso_d[c]
+        elif c in other_letters:
+            block += c
+        else:
+            if block:
+                new += shape(block)
+                block = ""
+            new += c
+    if block:
+        new += shape(block)
+    return new
+
+
+def _normalize_re(text):
+    """Normalization with one regex substitution per mapping
+    (kept here only as a benchmark reference)."""
+    for c1, c2 in contextual_forms.normalize_d.items():
+        text = re.sub(c1, c2, text)
+    return contextual_forms.normalize_composites(text, "NFKD")
+
+
+def _nfkc(text):
+    """Decontextualization by NFKC normalization of the whole text
+    (kept here only as a benchmark reference)."""
+    text = re.sub(contextual_forms.tails_regex, r"\1 ", text)
+    return unicodedata.normalize("NFKC", text)
+
+
+def _joining_dict(text):
+    """Look up the joining class of every character in the joining dict
+    (as the fsm engine does)."""
+    joining = contextual_forms.default_tables["joining"].get
+    return [joining(c, 0) for c in text]
+
+
+def _joining_array(text):
+    """Look up the joining class of every character in an array
+    indexed by code point (kept here only as a benchmark reference)."""
+    joining = contextual_forms.default_tables["joining"]
+    array = bytearray(max(ord(c) for c in joining) + 1)
+    for c, j in joining.items():
+        array[ord(c)] = j
+    size = len(array)
+    return [array[cp] if cp < size else 0 for cp in map(ord, text)]
+
+
+def bench(func, *args, number=3, **kwargs):
+    """Return the best run time (in seconds) of `number` calls of func."""
+    return min(timeit.repeat(lambda: func(*args, **kwargs),
+                             repeat=number, number=1))
+
+
+def bench_contextualize(text):
+    """Compare the contextualization modes with the block loop."""
+    print("contextualize_text ({} characters):".format(len(text)))
+    ref = contextualize_text(text, mode="fsm")
+    t = bench(_block_loop, text)
+    print("    {:<12} {:.3f} s".format("block loop", t))
+    modes = ["fsm", "regex"]
+    try:
+        import numpy
+        modes.append("numpy")
+    except ImportError:
+        print("    (NumPy is not installed: skipping the numpy mode)")
+    for mode in modes:
+        assert contextualize_text(text, mode=mode) == ref
+        t_mode = bench(contextualize_text, text, mode=mode)
+        print("    {:<12} {:.3f} s ({:.1f}x)".format(mode, t_mode, t/t_mode))
+
+
+def bench_block_cache(text):
+    """Measure the hit rate and speed of the block cache
+    of the regex mode for different cache sizes."""
+    print("block cache (regex mode):")
+    default_cache = contextual_forms.block_cache
+    for maxsize in [None, 2**16, 2**12, 2**10]:
+        cache = contextual_forms.make_block_cache(maxsize=maxsize)
+        contextual_forms.block_cache = cache
+        t_cold = bench(contextualize_text, text, mode="regex", number=1)
+        info = cache.cache_info()
+        t_warm = bench(contextualize_text, text, mode="regex")
+        print("    maxsize {:<8} {:.1%} hits ({} blocks), "
+              "cold {:.3f} s, warm {:.3f} s".format(
+                  str(maxsize), info.hits/(info.hits+info.misses),
+                  info.currsize, t_cold, t_warm))
+    contextual_forms.block_cache = default_cache
+
+
+def bench_normalize(text):
+    """Compare normalize with a regex substitution per mapping."""
+    print("normalize ({} characters):".format(len(text)))
+    assert contextual_forms.normalize(text) == _normalize_re(text)
+    t = bench(_normalize_re, text)
+    print("    {:<12} {:.3f} s".format("re.sub", t))
+    t_norm = bench(contextual_forms.normalize, text)
+    print("    {:<12} {:.3f} s ({:.1f}x)".format("normalize", t_norm, t/t_norm))
+
+
+def bench_joining(text):
+    """Compare joining class lookups in a dict and in an array
+    indexed by code point."""
+    print("joining classes ({} characters):".format(len(text)))
+    assert _joining_dict(text) == _joining_array(text)
+    t = bench(_joining_array, text)
+    print("    {:<12} {:.3f} s".format("array", t))
+    t_dict = bench(_joining_dict, text)
+    print("    {:<12} {:.3f} s ({:.1f}x)".format("dict", t_dict, t/t_dict))
+
+
+def bench_decontextualize(text):
+    """Compare the translate table with NFKC normalization."""
+    print("decontextualize_text ({} characters):".format(len(text)))
+    assert decontextualize_text(text) == _nfkc(text)
+    t = bench(_nfkc, text)
+    print("    {:<12} {:.3f} s".format("NFKC", t))
+    t_table = bench(decontextualize_text, text)
+    print("    {:<12} {:.3f} s ({:.1f}x)".format("translate", t_table, t/t_table))
+
+
+def bench_token_cache(text, words_per_line=3):
+    """Compare decontextualization with and without the token cache,
+    for a whole text and for short lines."""
+    print("token cache:")
+    words = text.split()
+    lines = [" ".join(words[i:i+words_per_line])
+             for i in range(0, len(words), words_per_line)]
+    default_cache = contextual_forms.token_cache
+    for name, func in [
+        ("text", lambda cache: decontextualize_text(text, cache=cache)),
+        ("{} lines".format(len(lines)),
+         lambda cache: [decontextualize_text(line, cache=cache)
+                        for line in lines])]:
+        t = bench(func, False)
+        cache = contextual_forms.make_token_cache()
+        contextual_forms.token_cache = cache
+        t_cold = bench(func, True, number=1)
+        info = cache.cache_info()
+        t_warm = bench(func, True)
+        print("    {:<12} no cache {:.3f} s, {:.1%} hits, "
+              "cold {:.3f} s, warm {:.3f} s".format(
+                  name, t, info.hits/(info.hits+info.misses), t_cold, t_warm))
+    contextual_forms.token_cache = default_cache
+
+
+def bench_many(text, words_per_line=3):
+    """Compare converting short lines one by one with
+    the batch functions."""
+    words = text.split()
+    lines = [" ".join(words[i:i+words_per_line])
+             for i in range(0, len(words), words_per_line)]
+    print("{} lines of {} words:".format(len(lines), words_per_line))
+    ctx = contextualize_many(lines)
+    for func, many, inp in [(contextualize, contextualize_many, lines),
+                            (decontextualize, decontextualize_many, ctx)]:
+        t = bench(lambda: [func(line) for line in inp])
+        print("    {:<22} {:.3f} s".format(func.__name__, t))
+        t_many = bench(many, inp)
+        print("    {:<22} {:.3f} s ({:.1f}x)".format(many.__name__,
+                                                   t_many, t/t_many))
+
+
+def bench_shaper(text, words_per_line=3):
+    """Compare contextualizing short lines with a custom profile
+    by contextualize_text and by a Shaper."""
+    words = text.split()
+    lines = [" ".join(words[i:i+words_per_line])
+             for i in range(0, len(words[:3000]), words_per_line)]
+    iso = dict(contextual_forms.iso_d)
+    shaper = Shaper(iso_d=iso)
+    print("custom profile, {} lines of {} words:".format(len(lines),
+                                                        words_per_line))
+    assert [shaper.shape(line) for line in lines] == \
+           [contextualize_text(line, iso_d=iso) for line in lines]
+    t = bench(lambda: [contextualize_text(line, iso_d=iso) for line in lines])
+    print("    {:<22} {:.3f} s".format("contextualize_text", t))
+    t_shaper = bench(lambda: [shaper.shape(line) for line in lines])
+    print("    {:<22} {:.3f} s ({:.1f}x)".format("Shaper.shape",
+                                               t_shaper, t/t_shaper))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        infp = sys.argv[1]
+    with open(infp, mode="r", encoding="utf-8") as file:
+        text = file.read()
+    bench_normalize(text)
+    bench_joining(contextual_forms.normalize(text))
+    bench_contextualize(text)
+    bench_block_cache(text)
+    bench_decontextualize(contextualize_text(text))
+    bench_token_cache(contextualize_text(text))
+    bench_many(text)
+    bench_shaper(text)
@@ -30,16 +30,21 @@ This module contains 2 main functions:
 
 """
 
+import collections
+import contextlib
+import functools
+import glob
 import json
 import os
 import re
+import time
+import unicodedata
+import zlib
 
 
 import sys
 import getopt
 
-from openiti.helper.ara import normalize_composites
-
 ########################################################
 #          CREATE CONTEXTUAL SHAPES DICTIONARIES       #
 ########################################################
@@ -562,37 +567,847 @@ diacritics_s = "".join([x for x in diacritics])
 other_letters_s = "".join([x for x in decontext_d \
                            if (decontext_d[x] not in diacritics \
                                and decontext_d[x] != "ء")])
-tails_regex = "([{}][{}]*)(?=[{}])".format(tails_s, diacritics_s, other_letters_s)
+tails_regex = re.compile("([{}][{}]*)(?=[{}])".format(tails_s, diacritics_s,
+                                                      other_letters_s))
+
+
+############################################
+#          COMPILE SHAPING TABLES          #
+############################################
+
+# joining classes used by the contextualization engine:
+NON_JOINING = 0    # not part of a letter block
+MARK = 1           # diacritic (or tatweel) inside a letter block
+DUAL_JOINING = 2   # letter that connects to the next letter
+RIGHT_JOINING = 3  # letter that ends a letter block
+
+# lam-alif ligatures (lam form + final alif form: ligature):
+lam_alif_d = {
+  "ﻟﺎ": "ﻻ",  # ARABIC LETTER LAM INITIAL FORM + ALEF FINAL FORM : ARABIC LIGATURE LAM WITH ALEF ISOLATED FORM
+  "ﻠﺎ": "ﻼ",  # ARABIC LETTER LAM MEDIAL FORM + ALEF FINAL FORM : ARABIC LIGATURE LAM WITH ALEF FINAL FORM
+  # hamza and madda after the alif are fused into the ligature:
+  "ﻻ\u0653": "ﻵ",  # ARABIC LIGATURE LAM WITH ALEF ISOLATED FORM + ARABIC MADDAH ABOVE : ARABIC LIGATURE LAM WITH ALEF WITH MADDA ABOVE ISOLATED FORM
+  "ﻼ\u0653": "ﻶ",  # ARABIC LIGATURE LAM WITH ALEF FINAL FORM + ARABIC MADDAH ABOVE : ARABIC LIGATURE LAM WITH ALEF WITH MADDA ABOVE FINAL FORM
+  "ﻻ\u0654": "ﻷ",  # ARABIC LIGATURE LAM WITH ALEF ISOLATED FORM + ARABIC HAMZA ABOVE : ARABIC LIGATURE LAM WITH ALEF WITH HAMZA ABOVE ISOLATED FORM
+  "ﻼ\u0654": "ﻸ",  # ARABIC LIGATURE LAM WITH ALEF FINAL FORM + ARABIC HAMZA ABOVE : ARABIC LIGATURE LAM WITH ALEF WITH HAMZA ABOVE FINAL FORM
+  "ﻻ\u0655": "ﻹ",  # ARABIC LIGATURE LAM WITH ALEF ISOLATED FORM + ARABIC HAMZA BELOW : ARABIC LIGATURE LAM WITH ALEF WITH HAMZA BELOW ISOLATED FORM
+  "ﻼ\u0655": "ﻺ",  # ARABIC LIGATURE LAM WITH ALEF FINAL FORM + ARABIC HAMZA BELOW : ARABIC LIGATURE LAM WITH ALEF WITH HAMZA BELOW FINAL FORM
+}
+
+
+def compile_tables(iso_d=iso_d, end_d=end_d, mid_d=mid_d, beg_d=beg_d,
+                   end_letters=end_letters,
+                   other_letters=other_letters,
+                   diacritics=diacritics,
+                   lam_alif_d=lam_alif_d):
+    """Compile the letter dictionaries and categories into the lookup
+    tables used by the contextualization engine.
+
+    Every character gets a joining class (see NON_JOINING, MARK,
+    DUAL_JOINING, RIGHT_JOINING); characters not in the table
+    are NON_JOINING. The isolated and medial forms (used for whole
+    runs of letters) are also compiled into `str.translate` tables.
+    Finally, the tables contain a compiled regex that matches (and
+    captures) a complete letter block (a run of other letters, ending
+    on an end letter if the block is followed by one; the diacritics after a lam-alif ligature with a fused hamza or madda
+    are part of the block, see `_contextualize_block`), and a regex
+    that matches the rare texts in which the order of those diacritics
+    depends on the letter after them (which `_contextualize_regex`
+    leaves to the fsm engine).
+
+    Args:
+        iso_d (dict): dictionary containing the isolated letter form
+        end_d (dict): dictionary containing the final letter form
+        mid_d (dict): dictionary containing the medial letter form
+        beg_d (dict): dictionary containing the initial letter form
+        end_letters (list): a list of Arabic letters that end a letter block
+        other_letters (list): a list of Arabic letters that don't end
+            a letter block
+        diacritics (list): a list of Arabic diacritics
+        lam_alif_d (dict): dictionary containing the lam-alif ligatures
+            (keys: lam form + alif form, or ligature + diacritic;
+            values: ligature)
+
+    Returns:
+        dict
+    """
+    joining = dict()
+    for c in other_letters:
+        joining[c] = MARK if c in diacritics else DUAL_JOINING
+    for c in end_letters:
+        joining[c] = RIGHT_JOINING
+    other_s = "".join(sorted(re.escape(c) for c, j in joining.items()
+                             if j != RIGHT_JOINING))
+    end_s = "".join(sorted(re.escape(c) for c, j in joining.items()
+                           if j == RIGHT_JOINING))
+    marks = "".join(sorted(c for c, j in joining.items() if j == MARK))
+    # letter pairs that form a lam-alif ligature, and the diacritics
+    # that can be fused into that ligature if they follow the alif
+    # (possibly after other diacritics):
+    fused = dict()
+    for k, lig in lam_alif_d.items():
+        if k[1] in marks:
+            continue
+        fuse = {c for c in marks if lig + c in lam_alif_d}
+        for lam in other_letters:
+            if k[0] not in (beg_d.get(lam), mid_d.get(lam)):
+                continue
+            for alif in end_letters:
+                if end_d.get(alif) == k[1]:
+                    pair = lam + alif
+                    fused[pair] = fused.get(pair, fuse) & fuse
+    pairs = [(re.escape(pair), "".join(c for c in marks
+                                       if c not in fused[pair]),
+              "".join(sorted(fused[pair])))
+             for pair in sorted(fused) if fused[pair]]
+    # the diacritics after a fused ligature are part of its letter block:
+    fused_s = "|".join("(?<={})[{}]*[{}][{}]*".format(pair, other, fuse, marks)
+                       for pair, other, fuse in pairs)
+    if fused_s:
+        fused_s = "(?:{})?".format(fused_s)
+    block_regex = re.compile("([{0}]*[{1}]{2}|[{0}]+)".format(other_s, end_s,
+                                                             fused_s))
+    # a letter block ends on those diacritics in reverse order,
+    # but if a letter follows them, they should keep their order;
+    # this only makes a difference if there are at least
+    # two diacritics besides the fused one:
+    letters_s = "".join(sorted(re.escape(c) for c, j in joining.items()
+                               if j != MARK))
+    fallback_s = "|".join("{}(?=[{}]*[{}])[{}]{{3,}}(?=[{}])".format(
+        pair, other, fuse, marks, letters_s) for pair, other, fuse in pairs)
+    fallback_regex = re.compile(fallback_s) if fallback_s else None
+    return {"joining": joining,
+            "iso": dict(iso_d), "end": dict(end_d),
+            "mid": dict(mid_d), "beg": dict(beg_d),
+            "lam_alif": dict(lam_alif_d),
+            "block_regex": block_regex,
+            "fallback_regex": fallback_regex,
+            "marks": marks,
+            "iso_table": str.maketrans(iso_d),
+            "mid_table": str.maketrans(mid_d)}
+
+default_tables = compile_tables()
+_default_sources = (iso_d, end_d, mid_d, beg_d,
+                    end_letters, other_letters, diacritics)
+
+def _tables_for(*sources):
+    """Return the compiled default tables if the default dictionaries
+    and letter categories are used; compile new tables otherwise."""
+    if all(a is b for a, b in zip(sources, _default_sources)):
+        return default_tables
+    return compile_tables(*sources)
+
+
+##################################################
+#          COMPILE DECONTEXTUALIZATION TABLE     #
+##################################################
+
+# canonical compositions of an Arabic letter and a following diacritic:
+compose_d = {
+  "\u0627\u0653": "آ",  # ARABIC LETTER ALEF + ARABIC MADDAH ABOVE : ARABIC LETTER ALEF WITH MADDA ABOVE
+  "\u0627\u0654": "أ",  # ARABIC LETTER ALEF + ARABIC HAMZA ABOVE : ARABIC LETTER ALEF WITH HAMZA ABOVE
+  "\u0627\u0655": "إ",  # ARABIC LETTER ALEF + ARABIC HAMZA BELOW : ARABIC LETTER ALEF WITH HAMZA BELOW
+  "\u0648\u0654": "ؤ",  # ARABIC LETTER WAW + ARABIC HAMZA ABOVE : ARABIC LETTER WAW WITH HAMZA ABOVE
+  "\u064a\u0654": "ئ",  # ARABIC LETTER YEH + ARABIC HAMZA ABOVE : ARABIC LETTER YEH WITH HAMZA ABOVE
+  "\u06c1\u0654": "ۂ",  # ARABIC LETTER HEH GOAL + ARABIC HAMZA ABOVE : ARABIC LETTER HEH GOAL WITH HAMZA ABOVE
+  "\u06d2\u0654": "ۓ",  # ARABIC LETTER YEH BARREE + ARABIC HAMZA ABOVE : ARABIC LETTER YEH BARREE WITH HAMZA ABOVE
+  "\u06d5\u0654": "ۀ",  # ARABIC LETTER AE + ARABIC HAMZA ABOVE : ARABIC LETTER HEH WITH YEH ABOVE
+}
+
+# Unicode ranges covered by the decontextualization table
+# (basic Latin to Arabic, general punctuation and the Arabic
+# presentation forms blocks):
+decontext_ranges = [(0x0000, 0x0700), (0x2000, 0x2070),
+                    (0xFB50, 0xFE00), (0xFE70, 0xFF00)]
+
+
+def _char_class(code_points):
+    """Build a regex character class string from a list of code points."""
+    ranges = []
+    for cp in sorted(set(code_points)):
+        if ranges and ranges[-1][1] == cp-1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return "".join(re.escape(chr(a)) if a == b
+                   else re.escape(chr(a)) + "-" + re.escape(chr(b))
+                   for a, b in ranges)
+
+
+def _decontext_mappings(decontext_d=decontext_d, ranges=decontext_ranges):
+    """Compute the non-identity mappings of the decontextualization table
+    and the source strings of its fallback regexes
+    (see `compile_decontext_table`)."""
+    mappings = dict()
+    safe = []
+    composed = []
+    for start, end in ranges:
+        for cp in range(start, end):
+            c = chr(cp)
+            n = unicodedata.normalize("NFKC", c)
+            if unicodedata.combining(n[0]):
+                continue
+            safe.append(cp)
+            if n != c:
+                mappings[cp] = n
+            elif unicodedata.normalize("NFD", c) != c:
+                composed.append(cp)
+    for c, n in decontext_d.items():
+        mappings[ord(c)] = n
+    marks = [cp for cp in range(0x0600, 0x0700)
+             if unicodedata.combining(chr(cp))]
+    # characters not in the table, and diacritics that may be reordered
+    # or composed with the preceding character, need NFKC normalization:
+    unknown_regex = "[^{}{}]".format(_char_class(safe), _char_class(marks))
+    reorder_regex = "[{0}{1}][{0}]".format(_char_class(marks),
+                                           _char_class(composed))
+    return mappings, unknown_regex, reorder_regex
+
+
+def _build_decontext_table(mappings, unknown_regex, reorder_regex,
+                           ranges=decontext_ranges):
+    """Build the decontextualization table from its non-identity mappings
+    and the source strings of its fallback regexes."""
+    table = list(range(ranges[-1][1]))
+    for cp, n in mappings.items():
+        table[cp] = n
+    return {"table": table,
+            "unknown_regex": re.compile(unknown_regex),
+            "reorder_regex": re.compile(reorder_regex),
+            "compose": dict(compose_d)}
+
+
+def compile_decontext_table(decontext_d=decontext_d,
+                            ranges=decontext_ranges):
+    """Compile the tables used by the `str.translate` fast path
+    of `decontextualize_text`.
+
+    Every character in `ranges` is mapped to its NFKC form,
+    unless that form starts with a diacritic; those characters
+    (and all characters outside of `ranges`) are left to
+    the NFKC normalization fallback. The mappings in `decontext_d`
+    take precedence over the NFKC forms.
+
+    Args:
+        decontext_d (dict): dictionary containing the general form
+            of contextual letter forms
+            (keys: contextual form, values: general letter form)
+        ranges (list): list of (start, end) code point ranges
+            to be covered by the table
+
+    Returns:
+        dict
+    """
+    return _build_decontext_table(*_decontext_mappings(decontext_d, ranges),
+                                  ranges=ranges)
+
+
+def _decontext_checksum(decontext_d=decontext_d, ranges=decontext_ranges):
+    """Return a checksum of the dictionaries the decontextualization
+    table is computed from (the Unicode database version is checked
+    separately, see `build_tables_module`).
+
+    (zlib is used rather than hashlib, which is slow to import.)"""
+    src = repr((decontext_d, ranges))
+    return zlib.crc32(src.encode("utf-8"))
+
+
+TABLES_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "contextual_forms_tables.py")
+
+
+def build_tables_module(fp=TABLES_MODULE):
+    """Write the precomputed decontextualization table to a Python module,
+    from which it is loaded at import time (computing it from
+    the Unicode database takes most of the import time of this module).
+
+    The table is computed from the Unicode database of the running
+    Python, but it is the same for most Unicode versions; the module
+    lists the Unicode versions for which the table was verified,
+    and it is ignored by other Python versions and if it is not
+    up to date with `decontext_d`. If the module already contains
+    the same table, the Unicode version of the running Python
+    is added to the list, so run this with every supported
+    Python version after changing `decontext_d`:
+
+    $ python3.8 contextual_forms.py --build-tables
+    $ python3.13 contextual_forms.py --build-tables
+
+    Args:
+        fp (str): path to the output module
+
+    Returns:
+        None
+    """
+    mappings, unknown_regex, reorder_regex = _decontext_mappings()
+    versions = {unicodedata.unidata_version}
+    if os.path.isfile(fp):
+        import runpy
+        try:
+            old = runpy.run_path(fp)
+        except Exception:
+            old = dict()
+        if old.get("CHECKSUM") == _decontext_checksum() \
+           and old.get("MAPPINGS") == mappings \
+           and old.get("UNKNOWN_REGEX") == unknown_regex \
+           and old.get("REORDER_REGEX") == reorder_regex:
+            versions.update(old.get("UNIDATA_VERSIONS", []))
+    versions = sorted(versions,
+                      key=lambda v: tuple(int(x) for x in v.split(".")))
+    lines = ['"""Precomputed decontextualization table for contextual_forms.',
+             '',
+             'Generated by `contextual_forms.build_tables_module()`;',
+             'do not edit this file by hand.',
+             '"""',
+             '',
+             'CHECKSUM = {}'.format(_decontext_checksum()),
+             '',
+             '# Unicode versions for which the table was verified:',
+             'UNIDATA_VERSIONS = {}'.format(versions),
+             '',
+             '# code point of a character: its NFKC / general form',
+             'MAPPINGS = {']
+    for cp, n in sorted(mappings.items()):
+        name = unicodedata.name(chr(cp), "")
+        lines.append("  0x{:04X}: {},  # {}".format(cp, ascii(n), name))
+    lines.append('}')
+    lines.append('')
+    lines.append('UNKNOWN_REGEX = {}'.format(ascii(unknown_regex)))
+    lines.append('REORDER_REGEX = {}'.format(ascii(reorder_regex)))
+    with open(fp, mode="w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def _load_decontext_table():
+    """Load the default decontextualization table from the generated
+    tables module if it is up to date and verified for the Unicode
+    version of this Python; compile it otherwise."""
+    try:
+        import contextual_forms_tables as generated
+    except ImportError:
+        return compile_decontext_table()
+    if getattr(generated, "CHECKSUM", None) != _decontext_checksum() \
+       or unicodedata.unidata_version not in getattr(
+           generated, "UNIDATA_VERSIONS", []):
+        return compile_decontext_table()
+    return _build_decontext_table(generated.MAPPINGS,
+                                  generated.UNKNOWN_REGEX,
+                                  generated.REORDER_REGEX)
+
+default_decontext_table = _load_decontext_table()
 
 
 ############################
 #         FUNCTIONS        #
 ############################
 
-def normalize(text, method="NFKD"):
-    r = [("ہ", "ه"),  # \u06c1 ARABIC LETTER HEH GOAL > \u0647 ARABIC LETTER HEH
-         ("ە", "ه"),  # \u06d5 ARABIC LETTER AE > \u0647 ARABIC LETTER HEH
-         ("ھ", "ه"),  # \u06d5 \u06be ARABIC LETTER HEH DOACHASHMEE > \u0647 ARABIC LETTER HEH
-#         ("ک", "ك"),  # \u06a9	ARABIC LETTER KEHEH > \u0643 ARABIC LETTER KAF
-#         ("ی", "ي"),  # \u06cc ARABIC LETTER FARSI YEH > \u064a ARABIC LETTER YEH
-         ("ٴ", "ٔ"),    # \u0674 ARABIC LETTER HIGH HAMZA > \u0654 ARABIC HAMZA ABOVE         
-         ("۔", "."),  # \u06d4 ARABIC FULL STOP > . FULL STOP
-         ("∗", "*"),  # \u2217 ASTERISK OPERATOR > ASTERISK
-         ("ݣ", "ڭ"),  # \u0763 ARABIC LETTER KEHEH WITH THREE DOTS ABOVE > \u06AD ARABIC LETTER NG
-         #("ـ", ""),  # \u0640 ARABIC TATWEEL > "" (remove)
-         ]
-    for c1, c2 in r:
-        text = re.sub(c1, c2, text)
+def normalize_composites(text, method="NFKC"):
+    """Normalize composite characters, ligatures and contextual forms
+    using unicode normalization methods.
+
+    Composite characters (e.g., آ "U+0622 : ARABIC LETTER ALEF WITH
+    MADDA ABOVE") are joined by NFC and NFKC and split by NFD and NFKD;
+    ligatures (e.g., ﷲ "U+FDF2 : ARABIC LIGATURE ALLAH ISOLATED FORM")
+    and contextual forms (e.g., ﺑ "U+FE91 : ARABIC LETTER BEH INITIAL FORM")
+    are replaced by their general letters only by NFKC and NFKD.
+
+    (Same behaviour as `openiti.helper.ara.normalize_composites`,
+    defined here so that importing this module does not load
+    the openiti package.)
+
+    Args:
+        text (str): the string to be normalized
+        method (str): the unicode method to be used for normalization
+            (see https://docs.python.org/3/library/unicodedata.html).
+            Defaults to NFKC.
+
+    Returns:
+        str
+    """
+    return unicodedata.normalize(method, text)
+
+
+# characters that are replaced before the contextualization
+# (keys: character, values: replacement):
+normalize_d = {
+  "ہ": "ه",  # \u06c1 ARABIC LETTER HEH GOAL > \u0647 ARABIC LETTER HEH
+  "ە": "ه",  # \u06d5 ARABIC LETTER AE > \u0647 ARABIC LETTER HEH
+  "ھ": "ه",  # \u06d5 \u06be ARABIC LETTER HEH DOACHASHMEE > \u0647 ARABIC LETTER HEH
+#  "ک": "ك",  # \u06a9	ARABIC LETTER KEHEH > \u0643 ARABIC LETTER KAF
+#  "ی": "ي",  # \u06cc ARABIC LETTER FARSI YEH > \u064a ARABIC LETTER YEH
+  "ٴ": "ٔ",    # \u0674 ARABIC LETTER HIGH HAMZA > \u0654 ARABIC HAMZA ABOVE
+  "۔": ".",  # \u06d4 ARABIC FULL STOP > . FULL STOP
+  "∗": "*",  # \u2217 ASTERISK OPERATOR > ASTERISK
+  "ݣ": "ڭ",  # \u0763 ARABIC LETTER KEHEH WITH THREE DOTS ABOVE > \u06AD ARABIC LETTER NG
+#  "ـ": "",  # \u0640 ARABIC TATWEEL > "" (remove)
+}
+
+
+def normalize(text, method="NFKD", mappings=normalize_d):
+    """Replace characters in a string that have no contextual forms
+    (or should be represented by another character), and normalize
+    composite characters and ligatures.
+
+    The replacements are made with `str.replace` (one C-level scan
+    per mapping, which is much faster than a regex or `str.translate`
+    pass for a small number of mappings), in the order of the dictionary.
+
+    Text that contains none of the characters in `mappings` and is
+    already normalized is returned as it is, without being copied:
+    `str.replace` returns the string itself if there is nothing to replace,
+    and `unicodedata.normalize` does a quick check before normalizing
+    (an additional `unicodedata.is_normalized` check would only repeat it).
+
+    Args:
+        text (str): the string to be normalized
+        method (str): the unicode method to be used for normalization
+            (see `normalize_composites`). Defaults to "NFKD".
+        mappings (dict): dictionary containing the replacements
+            (keys: string to be replaced, values: replacement).
+            Use e.g. `dict(normalize_d, **{"ک": "ك"})` to extend
+            the default mappings.
+
+    Returns:
+        str
+    """
+    for c1, c2 in mappings.items():
+        text = text.replace(c1, c2)
     return normalize_composites(text, method)
 
 
-def _contextualize_block(block, iso_d=iso_d, end_d=end_d,
-                         mid_d=mid_d, beg_d=beg_d,
-                         end_letters=end_letters,
-                         other_letters=other_letters,
-                         diacritics=diacritics):
+def _contextualize_block(block, tables=default_tables):
     """Turn Arabic letters in a letter block into contextualized glyph forms.
 
+    The block is shaped with a few `str.translate` calls
+    on slices of the block (initial letter, medial letters, final letter).
+
+    Args:
+        block (str): the letter block in which letters need
+            to be contextualized.
+        tables (dict): lookup tables compiled by `compile_tables`
+
+    Returns:
+        str
+    """
+    marks = tables["marks"]
+    # if the block contains only one letter (+ diacritics):
+    if len(block.strip(marks)) == 1:
+        return block.translate(tables["iso_table"])
+
+    # diacritics at the end of the block are added after the last letter:
+    body = block.rstrip(marks)
+    final_diacritics = block[len(body):][::-1]
+    if not body:
+        return final_diacritics
+
+    # letters before the first letter that has an initial form are kept:
+    beg_d = tables["beg"]
+    for i, c in enumerate(body):
+        if c in beg_d:
+            break
+    else:
+        return body + final_diacritics
+    last = len(body) - 1
+    if i == last:
+        return body[:i] + beg_d[c] + final_diacritics
+    c = body[last]
+    t = body[:i] + beg_d[body[i]] \
+        + body[i+1:last].translate(tables["mid_table"]) \
+        + tables["end"].get(c, c)
+
+    # deal with lam-alif ligature; the first hamza or madda
+    # in the diacritics after the alif (which the block regex
+    # adds to the block) is fused into the ligature:
+    lig = tables["lam_alif"].get(t[-2:])
+    if lig:
+        t = t[:-2] + lig
+        for i, c in enumerate(final_diacritics[::-1]):
+            fused = tables["lam_alif"].get(lig + c)
+            if fused:
+                i = len(final_diacritics) - 1 - i
+                return t[:-1] + fused + final_diacritics[:i] \
+                       + final_diacritics[i+1:]
+
+    return t + final_diacritics
+            
+
+
+def _contextualize_fsm(text, tables=default_tables):
+    """Turn Arabic letters in a string into contextualized glyph forms
+    in a single pass over the string.
+
+    The form of a letter depends on whether another letter follows it
+    in the same letter block, so the engine keeps the last letter
+    of the current block (and the diacritics following it) pending
+    until the next character shows whether the block continues.
+
+    Args:
+        text (str): the string in which letters need to be contextualized.
+        tables (dict): lookup tables compiled by `compile_tables`
+
+    Returns:
+        str
+    """
+    # (looking up the joining class of a character in a dict is faster
+    # than indexing an array by its code point, because the hash
+    # of a string is cached; see `bench_joining` in the benchmark script)
+    joining = tables["joining"].get
+    iso_get = tables["iso"].get
+    end_get = tables["end"].get
+    mid_get = tables["mid"].get
+    beg_get = tables["beg"].get
+    lam_alif_get = tables["lam_alif"].get
+
+    out = []
+    append = out.append
+    n = 0           # number of letters in the current block so far
+    first = True    # no letter in the block has taken its initial form yet
+    pending = ""    # last letter of the current block
+    marks = []      # diacritics after the pending letter (or leading the block)
+    fuse = -1       # length of out right after a lam-alif ligature
+
+    for c in text:
+        j = joining(c, NON_JOINING)
+        if j == MARK:
+            # the first hamza or madda after a lam-alif ligature
+            # is fused into the ligature (the other diacritics
+            # are added as if it was not there):
+            if not n and len(out) == fuse:
+                lig = lam_alif_get(out[-1] + c)
+                if lig:
+                    out[-1] = lig
+                    fuse = -1
+                    continue
+            marks.append(c)
+            continue
+        if j != NON_JOINING:
+            # c is a letter: the pending letter (if any) is not the last one
+            if n:
+                if first:
+                    form = beg_get(pending)
+                    if form:
+                        first = False
+                        append(form)
+                    else:
+                        append(pending)
+                else:
+                    append(mid_get(pending, pending))
+            if marks:
+                out.extend(marks)
+                marks = []
+            pending = c
+            n += 1
+            if j == DUAL_JOINING:
+                continue
+        # end of the letter block: right-joining letter or non-Arabic character
+        if n == 1:
+            append(iso_get(pending, pending))
+            out.extend(marks)
+        elif n:
+            form = beg_get(pending, pending) if first \
+                   else end_get(pending, pending)
+            lig = lam_alif_get(out[-1] + form)
+            if lig:
+                out[-1] = lig
+                if not marks:
+                    fuse = len(out)
+            else:
+                append(form)
+            out.extend(reversed(marks))
+        elif marks:
+            out.extend(reversed(marks))
+        n = 0
+        first = True
+        if marks:
+            marks = []
+        if j == NON_JOINING:
+            append(c)
+
+    # add the letters from the last block:
+    if n == 1:
+        append(iso_get(pending, pending))
+        out.extend(marks)
+    elif n:
+        form = beg_get(pending, pending) if first \
+               else end_get(pending, pending)
+        lig = lam_alif_get(out[-1] + form)
+        if lig:
+            out[-1] = lig
+        else:
+            append(form)
+        out.extend(reversed(marks))
+    else:
+        out.extend(reversed(marks))
+    return "".join(out)
+
+
+# maximum number of letter blocks in the block cache:
+BLOCK_CACHE_SIZE = 2**16
+
+
+def make_block_cache(tables=default_tables, maxsize=BLOCK_CACHE_SIZE):
+    """Create a function that shapes a letter block with the given
+    tables (see `_contextualize_block`), memoized by an LRU cache.
+
+    Arabic text repeats the same letter blocks all the time
+    (e.g., ال, بن, محمد), so most blocks are shaped with a single
+    cache lookup. The hit/miss statistics of the cache are returned
+    by the `cache_info()` method of the function, and `cache_clear()`
+    empties the cache.
+
+    The "regex" engine uses the module's `block_cache` for the default
+    tables; replace it to change the size of the cache, e.g.:
+
+    >>> contextual_forms.block_cache = make_block_cache(maxsize=2**20)
+
+    Args:
+        tables (dict): lookup tables compiled by `compile_tables`
+        maxsize (int): maximum number of blocks in the cache
+            (None: no limit). Defaults to BLOCK_CACHE_SIZE.
+
+    Returns:
+        function
+    """
+    @functools.lru_cache(maxsize=maxsize)
+    def shape_block(block):
+        return _contextualize_block(block, tables)
+    return shape_block
+
+block_cache = make_block_cache()
+
+
+def _contextualize_regex(text, tables=default_tables, shape_block=None):
+    """Turn Arabic letters in a string into contextualized glyph forms,
+    using a single regex scan to split the string into letter blocks.
+
+    Every letter block is shaped by a block cache (see `make_block_cache`);
+    unless a block cache is given, custom tables get a new cache
+    for every call. The rare texts in which the order of the diacritics
+    after a lam-alif ligature with a fused hamza or madda depends
+    on the next letter block (see `compile_tables`) are
+    contextualized by the "fsm" engine.
+
+    Args:
+        text (str): the string in which letters need to be contextualized.
+        tables (dict): lookup tables compiled by `compile_tables`
+        shape_block (function): block cache created by `make_block_cache`
+            for the tables. Defaults to None.
+
+    Returns:
+        str
+    """
+    if shape_block is not None:
+        pass
+    elif tables is default_tables:
+        shape_block = block_cache
+    else:
+        shape_block = make_block_cache(tables)
+    fallback = tables["fallback_regex"]
+    if fallback and fallback.search(text):
+        return _contextualize_fsm(text, tables)
+    # the letter blocks are at the odd indices of the split list:
+    parts = tables["block_regex"].split(text)
+    parts[1::2] = map(shape_block, parts[1::2])
+    return "".join(parts)
+
+
+def _import_numpy():
+    """Import NumPy, which is only needed by the "numpy" engine."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The 'numpy' contextualization mode requires NumPy "
+                          "(pip install numpy)")
+    return numpy
+
+
+def _numpy_tables(tables=default_tables):
+    """Compile the lookup tables into NumPy arrays indexed by code point
+    (cached in the tables dictionary).
+
+    Returns None if a letter form or lam-alif ligature is not
+    a single character (these cannot be gathered from an array).
+    """
+    if "numpy" in tables:
+        return tables["numpy"]
+    np = _import_numpy()
+    forms = [tables[k] for k in ("iso", "end", "mid", "beg")]
+    lam_alif = tables["lam_alif"]
+    if any(len(v) != 1 for d in forms for v in d.values()) \
+       or any(len(k) != 2 or len(v) != 1 for k, v in lam_alif.items()):
+        tables["numpy"] = None
+        return None
+    size = max(ord(c) for c in tables["joining"]) + 1
+    joining = np.zeros(size, dtype=np.uint8)
+    for c, j in tables["joining"].items():
+        joining[ord(c)] = j
+    arrays = {"joining": joining,
+              "has_beg": np.zeros(size, dtype=bool),
+              "lam_alif": [(ord(k[0]), ord(k[1]), ord(v))
+                           for k, v in lam_alif.items()
+                           if k[1] not in tables["marks"]],
+              "lam_alif_marks": collections.defaultdict(list)}
+    for k, v in lam_alif.items():
+        if k[1] in tables["marks"]:
+            arrays["lam_alif_marks"][ord(k[0])].append((ord(k[1]), ord(v)))
+    for k, d in zip(("iso", "end", "mid", "beg"), forms):
+        a = np.arange(size, dtype=np.uint32)
+        for c, f in d.items():
+            if ord(c) < size:
+                a[ord(c)] = ord(f)
+        arrays[k] = a
+    for c in tables["beg"]:
+        if ord(c) < size:
+            arrays["has_beg"][ord(c)] = True
+    tables["numpy"] = arrays
+    return arrays
+
+
+def _contextualize_numpy(text, tables=default_tables):
+    """Turn Arabic letters in a string into contextualized glyph forms,
+    using NumPy array operations instead of a loop over the characters.
+
+    The code points of the text are converted into an array;
+    the joining class of every character, its position in its letter
+    block and its contextual form are then computed with lookup table
+    gathers and shifted masks. The result is identical to that
+    of the "fsm" engine; it is only faster for large texts
+    (join short lines before contextualizing them).
+
+    Args:
+        text (str): the string in which letters need to be contextualized.
+        tables (dict): lookup tables compiled by `compile_tables`
+
+    Returns:
+        str
+    """
+    arrays = _numpy_tables(tables)
+    if arrays is None or not text:
+        return _contextualize_fsm(text, tables)
+    np = _import_numpy()
+    cps = np.frombuffer(text.encode("utf-32-le", "surrogatepass"),
+                        dtype=np.uint32)
+    size = len(arrays["joining"])
+    inside = cps < size
+    idx = np.where(inside, cps, 0)
+    cls = np.where(inside, arrays["joining"][idx], NON_JOINING)
+
+    # a letter joins the previous letter if the previous character
+    # that is not a diacritic is a dual-joining letter:
+    non_marks = np.flatnonzero(cls != MARK)
+    s = cls[non_marks]
+    is_letter = s >= DUAL_JOINING
+    joins_prev = np.zeros(len(s), dtype=bool)
+    joins_prev[1:] = (s[:-1] == DUAL_JOINING) & is_letter[1:]
+    joins_next = np.zeros(len(s), dtype=bool)
+    joins_next[:-1] = joins_prev[1:]
+    pos = non_marks[is_letter]
+    joins_prev = joins_prev[is_letter]
+    joins_next = joins_next[is_letter]
+    letters = cps[pos]
+
+    # the first letter of a block that has an initial form takes it;
+    # letters before it keep their general form:
+    has_beg = arrays["has_beg"][letters]
+    before = np.cumsum(has_beg) - has_beg
+    block_start = np.flatnonzero(~joins_prev)
+    block = np.cumsum(~joins_prev) - 1
+    first = (before - before[block_start][block]) == 0
+    forms = np.where(~joins_prev & ~joins_next, arrays["iso"][letters],
+            np.where(first, arrays["beg"][letters],
+            np.where(joins_next, arrays["mid"][letters],
+                     arrays["end"][letters])))
+    out = cps.copy()
+    out[pos] = forms
+
+    # lam-alif ligatures (only if no diacritic separates the letters);
+    # the first hamza or madda in the diacritics after the alif
+    # is fused into the ligature (and dropped after the diacritics
+    # have been reordered):
+    cls_mark = cls == MARK
+    followed = np.append(cls_mark, False)
+    keep = np.ones(len(cps), dtype=bool)
+    last = np.flatnonzero(joins_prev[1:] & ~joins_next[1:]) + 1
+    last = last[pos[last] - pos[last-1] == 1]
+    for lam, alif, lig in arrays["lam_alif"]:
+        hit = last[(forms[last-1] == lam) & (forms[last] == alif)]
+        lam_pos, alif_pos = pos[hit-1], pos[hit]
+        out[lam_pos] = lig
+        keep[alif_pos] = False
+        fuse = arrays["lam_alif_marks"].get(lig)
+        if not fuse:
+            continue
+        # look for the first fusable diacritic in the diacritics
+        # after the alif:
+        sel = followed[alif_pos + 1]
+        lam_pos, c = lam_pos[sel], alif_pos[sel] + 1
+        while len(c):
+            found = np.zeros(len(c), dtype=bool)
+            for mark, fused in fuse:
+                is_fused = cps[c] == mark
+                out[lam_pos[is_fused]] = fused
+                found |= is_fused
+            keep[c[found]] = False
+            sel = ~found & followed[c + 1]
+            lam_pos, c = lam_pos[sel], c[sel] + 1
+
+    # reverse runs of diacritics at the end of a letter block,
+    # unless the block consists of a single letter:
+    is_mark = np.concatenate(([False], cls_mark, [False]))
+    edges = np.diff(is_mark.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts):
+        next_cls = np.append(cls, NON_JOINING)[ends]
+        prev = np.maximum(starts - 1, 0)
+        single = np.ones(len(cls), dtype=bool)
+        single[pos] = ~joins_prev
+        after_single = (starts > 0) & (cls[prev] == DUAL_JOINING) \
+                       & single[prev]
+        rev = (next_cls < DUAL_JOINING) & ~after_single & (ends-starts > 1)
+        starts, ends = starts[rev], ends[rev]
+        if len(starts):
+            lengths = ends - starts
+            run_starts = np.repeat(starts, lengths)
+            run_ends = np.repeat(ends, lengths)
+            offsets = np.arange(lengths.sum()) \
+                      - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            out[run_starts + offsets] = out[run_ends - 1 - offsets]
+            keep[run_starts + offsets] = keep[run_ends - 1 - offsets]
+    out = out[keep]
+    return out.astype(np.uint32).tobytes().decode("utf-32-le", "surrogatepass")
+
+
+def _contextualize(text, tables=default_tables, normalize_func=normalize,
+                   normalize_method="NFKD", mode="fsm", shape_block=None):
+    """Normalize a string and contextualize it with compiled tables
+    (see `contextualize_text`)."""
+    if normalize_func:
+        try:
+            text = normalize_func(text, method=normalize_method)
+        except:
+            text = normalize_func(text)
+    # convert letters in Arabic letter blocks to their contextual form:
+    if mode == "regex":
+        return _contextualize_regex(text, tables, shape_block)
+    elif mode == "numpy":
+        return _contextualize_numpy(text, tables)
+    elif mode == "fsm":
+        return _contextualize_fsm(text, tables)
+    raise ValueError("Unknown contextualization mode: {}".format(mode))
+
+
+def contextualize_text(text, iso_d=iso_d, end_d=end_d,
+                       mid_d=mid_d, beg_d=beg_d,
+                       end_letters=end_letters,
+                       other_letters=other_letters,
+                       diacritics=diacritics,
+                       normalize_func=normalize,
+                       normalize_method="NFKD",
+                       mode="fsm",
+                       workers=None):
+    """Turn Arabic letters in a string into contextualized glyph forms.
+
     Args:
         text (str): the string in which letters need to be contextualized.
         iso_d (dict): dictionary containing the isolated letter form
@@ -607,66 +1422,131 @@ def _contextualize_block(block, iso_d=iso_d, end_d=end_d,
         other_letters (list): a list of Arabic letters that don't end
             a letter block
         diacritics (list): a list of Arabic diacritics
+        normalize_func (funtion): a function to be used to normalize the text
+            prior to the contextualization. Defaults to `normalize_composites`
+        normalize_method (str): name of a normalization method that
+            needs to be passed to `normalize_func`. Defaults to "NFKD", 
+            which will split all combined letters and all ligatures.
+        mode (str): the contextualization engine to be used:
+            "fsm" (default) shapes the text in a single pass;
+            "regex" finds the letter blocks with a regex
+            and shapes them block by block, using a cache of shaped
+            blocks (fastest for most texts, see `make_block_cache`);
+            "numpy" shapes the text with NumPy array operations
+            (requires NumPy; fastest for large texts).
+        workers (int): if larger than 1, the text is split into chunks
+            at line breaks (or spaces), which are contextualized
+            in parallel by this number of worker processes.
+            Defaults to None (no parallel processing).
 
     Returns:
         str
     """
-    #print(block, len([c for c in block if (c in end_letters or \
-    #                                       (c in other_letters and c not in diacritics))]))
-    # if the block contains only one letter (+ diacritics):
-    if len([c for c in block if (c in end_letters or \
-                                 (c in other_letters and c not in diacritics))]) == 1:
-        t = ""
-        for c in block:
-            try:
-                t += iso_d[c]
-            except:
-                t += c
-        return t
-    
-    final_diacritics = ""
-    #while block[-1] in diacritics:
-    while len(block)>0 and block[-1] in diacritics:
-        final_diacritics += block[-1]
-        block = block[:-1]
-
-    t = ""
-    first = True
-    for i, c in enumerate(block):
-        if first:
-            try:
-                t += beg_d[c]
-                first = False
-            except:
-                t += c
-        elif i == len(block)-1:
-            t += end_d[c]
-        else:
-            try:
-                t += mid_d[c]
-            except:
-                t += c
-    #print(t + final_diacritics)
-
-    # deal with lam-alif ligature:
-    t = re.sub("ﻠﺎ", "ﻼ", t)
-    t = re.sub("ﻟﺎ", "ﻻ", t)
-    
-    return t + final_diacritics
-            
+    tables = _tables_for(iso_d, end_d, mid_d, beg_d,
+                         end_letters, other_letters, diacritics)
+    if workers and workers > 1:
+        size = len(text) // (workers*4) + 1
+        chunks = _rechunk(text[i:i+size] for i in range(0, len(text), size))
+        func = functools.partial(_contextualize, tables=tables,
+                                 normalize_func=normalize_func,
+                                 normalize_method=normalize_method,
+                                 mode=mode)
+        # imported here to keep the module (and CLI) startup fast:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return "".join(executor.map(func, chunks))
+    return _contextualize(text, tables, normalize_func=normalize_func,
+                          normalize_method=normalize_method, mode=mode)
+
+
+def contextualize_iter(lines, iso_d=iso_d, end_d=end_d,
+                       mid_d=mid_d, beg_d=beg_d,
+                       end_letters=end_letters,
+                       other_letters=other_letters,
+                       diacritics=diacritics,
+                       normalize_func=normalize,
+                       normalize_method="NFKD",
+                       mode="fsm"):
+    """Turn Arabic letters in an iterable of strings (e.g., the lines
+    of a file) into contextualized glyph forms, one string at a time.
 
+    Every string is contextualized separately, so strings should not
+    end in the middle of a letter block.
 
-def contextualize_text(text, iso_d=iso_d, end_d=end_d,
+    Args:
+        lines (iterable): iterable of strings in which letters
+            need to be contextualized.
+        iso_d (dict): dictionary containing the isolated letter form
+            (keys: general letter form, values: isolated letter form)
+        end_d (dict): dictionary containing the final letter form
+            (keys: general letter form, values: final letter form)
+        mid_d (dict): dictionary containing the medial letter form
+            (keys: general letter form, values: medial letter form)
+        beg_d (dict): dictionary containing the initial letter form
+            (keys: general letter form, values: initial letter form)
+        end_letters (list): a list of Arabic letters that end a letter block
+        other_letters (list): a list of Arabic letters that don't end
+            a letter block
+        diacritics (list): a list of Arabic diacritics
+        normalize_func (funtion): a function to be used to normalize the text
+            prior to the contextualization. Defaults to `normalize_composites`
+        normalize_method (str): name of a normalization method that
+            needs to be passed to `normalize_func`. Defaults to "NFKD", 
+            which will split all combined letters and all ligatures.
+        mode (str): the contextualization engine to be used
+            (see `contextualize_text`)
+
+    Yields:
+        str
+    """
+    tables = _tables_for(iso_d, end_d, mid_d, beg_d,
+                         end_letters, other_letters, diacritics)
+    for line in lines:
+        yield _contextualize(line, tables, normalize_func=normalize_func,
+                             normalize_method=normalize_method, mode=mode)
+
+
+# separators used to join the strings passed to `contextualize_many`
+# and `decontextualize_many` (the first one that does not occur
+# in the strings is used; they are not changed by the normalization
+# or (de)contextualization, and never become part of a letter block,
+# a composed character or a tail letter match):
+many_separators = ["\n", "\x1e", "\x00"]
+
+
+def _join_many(strings):
+    """Join a list of strings with the first separator that does not
+    occur in any of them.
+
+    Returns:
+        tuple (text, separator); (None, None) if all separators occur
+    """
+    for sep in many_separators:
+        text = sep.join(strings)
+        if text.count(sep) == len(strings) - 1:
+            return text, sep
+    return None, None
+
+
+def contextualize_many(strings, iso_d=iso_d, end_d=end_d,
                        mid_d=mid_d, beg_d=beg_d,
                        end_letters=end_letters,
                        other_letters=other_letters,
                        diacritics=diacritics,
                        normalize_func=normalize,
-                       normalize_method="NFKD"):
-    """Turn Arabic letters in a string into contextualized glyph forms.
+                       normalize_method="NFKD",
+                       mode="fsm",
+                       workers=None):
+    """Turn Arabic letters in a list of strings (e.g., OCR lines)
+    into contextualized glyph forms.
+
+    The strings are joined with a separator and contextualized
+    in one pass, so that the per-call overhead is paid only once;
+    the result is the same as contextualizing every string separately.
 
     Args:
-        text (str): the string in which letters need to be contextualized.
+        strings (iterable): the strings in which letters need
+            to be contextualized.
         iso_d (dict): dictionary containing the isolated letter form
             (keys: general letter form, values: isolated letter form)
         end_d (dict): dictionary containing the final letter form
@@ -684,41 +1564,50 @@ def contextualize_text(text, iso_d=iso_d, end_d=end_d,
         normalize_method (str): name of a normalization method that
             needs to be passed to `normalize_func`. Defaults to "NFKD", 
             which will split all combined letters and all ligatures.
+        mode (str): the contextualization engine to be used
+            (see `contextualize_text`)
+        workers (int): number of worker processes
+            (see `contextualize_text`)
 
     Returns:
-        str
+        list of str
     """
-    if normalize_func:
-        try:
-            text = normalize_func(text, method=normalize_method)
-        except:
-            text = normalize_func(text)
-    # convert letters in Arabic letter blocks to their contextual form:
-    new = ""
-    block = ""
-    for c in text:
-        if c in end_letters: # end of letter block; add to block and convert
-            #print(c, "is end letter")
-            if block:
-                new += _contextualize_block(block+c, iso_d, end_d, mid_d, beg_d)
-                block = ""
-            else:
-                new += iso_d[c]
-        elif c in other_letters: # add letter to current letter block
-            #print(c, "is other letter")
-            block += c
-        else: # not an Arabic letter: convert current block and add c to new
-            if block: 
-                new += _contextualize_block(block, iso_d, end_d, mid_d, beg_d)
-                block = ""
-                new += c
-            else:
-                new += c
-    # add the letters from the last block:
-    if block:
-        new += _contextualize_block(block, iso_d, end_d, mid_d, beg_d)
-    return new
-            
+    strings = list(strings)
+    args = dict(iso_d=iso_d, end_d=end_d, mid_d=mid_d, beg_d=beg_d,
+                end_letters=end_letters, other_letters=other_letters,
+                diacritics=diacritics, normalize_func=normalize_func,
+                normalize_method=normalize_method, mode=mode)
+    text, sep = _join_many(strings)
+    if sep is not None:
+        new = contextualize_text(text, workers=workers, **args).split(sep)
+        if len(new) == len(strings):
+            return new
+    # (a separator was changed by a custom normalization function,
+    # or all separators occur in the strings:)
+    return list(contextualize_iter(strings, **args))
+
+
+def _is_file(inp):
+    """Check whether `inp` is a file object, a path object
+    or the path to an existing file.
+
+    Strings that contain a line break or are longer than any path
+    are not checked against the file system.
+    """
+    if hasattr(inp, "read") or isinstance(inp, os.PathLike):
+        return True
+    return len(inp) < 4096 and "\n" not in inp and os.path.isfile(inp)
+
+
+@contextlib.contextmanager
+def _open(fp, mode="r"):
+    """Open a file path (str or path object) as a utf-8 text file;
+    file objects are used as they are (and are not closed)."""
+    if hasattr(fp, "read") or hasattr(fp, "write"):
+        yield fp
+    else:
+        with open(fp, mode=mode, encoding="utf-8") as file:
+            yield file
 
 
 def contextualize(inp, outfp=None, iso_d=iso_d, end_d=end_d,
@@ -727,12 +1616,14 @@ def contextualize(inp, outfp=None, iso_d=iso_d, end_d=end_d,
                   other_letters=other_letters,
                   diacritics=diacritics,
                   normalize_func=normalize,
-                  normalize_method="NFKD"):
+                  normalize_method="NFKD",
+                  echo=False,
+                  line_cache=None):
     """Turn Arabic letters in a string or text file into contextualized glyph forms.
 
     Args:
-        inp (str): the string (or path to a text file)
-            in which letters need to be contextualized.
+        inp (str): the string (or path to a text file, path object
+            or text file object) in which letters need to be contextualized.
         outfp (str): path to the file in which the converted text will be saved
         iso_d (dict): dictionary containing the isolated letter form
             (keys: general letter form, values: isolated letter form)
@@ -751,16 +1642,87 @@ def contextualize(inp, outfp=None, iso_d=iso_d, end_d=end_d,
         normalize_method (str): name of a normalization method that
             needs to be passed to `normalize_func`. Defaults to "NFKD", 
             which will split all combined letters and all ligatures.
+        echo (bool): if True (and no outfp is given), print the
+            converted text. Defaults to False.
+        line_cache (LineCache): a persistent line cache (or path to
+            its database); only lines that are not in the cache are
+            contextualized (see `LineCache`). Not used with a custom
+            `normalize_func`. Defaults to None.
 
     Returns:
         str
     """
 
-    if os.path.isfile(inp):
-        with open(inp, mode="r", encoding="utf-8") as file:
+    if _is_file(inp):
+        with _open(inp) as file:
             text = file.read()
     else:
         text = inp
+    args = dict(iso_d=iso_d, end_d=end_d, mid_d=mid_d, beg_d=beg_d,
+                end_letters=end_letters, other_letters=other_letters,
+                diacritics=diacritics, normalize_func=normalize_func,
+                normalize_method=normalize_method)
+    if line_cache is not None and normalize_func in (normalize, None):
+        fp = contextualize_fingerprint(iso_d, end_d, mid_d, beg_d,
+                                       end_letters, other_letters,
+                                       diacritics, normalize_method)
+        if normalize_func is None:
+            fp += "-not-normalized"
+        new = _convert_cached(text, line_cache,
+                              functools.partial(contextualize_many, **args),
+                              "contextualize", fp)
+    else:
+        new = contextualize_text(text, **args)
+
+    if outfp:
+        with _open(outfp, mode="w") as file:
+            file.write(new)
+    elif echo:
+        print(new)
+    return new
+
+
+def contextualize_file(fp, outfp=None, iso_d=iso_d, end_d=end_d,
+                       mid_d=mid_d, beg_d=beg_d,
+                       end_letters=end_letters,
+                       other_letters=other_letters,
+                       diacritics=diacritics,
+                       normalize_func=normalize,
+                       normalize_method="NFKD"):
+    """Turn Arabic letters in a text file into contextualized glyph forms.
+
+    Unlike `contextualize`, this function never treats its input
+    as a string to be converted (use `contextualize_text` for strings).
+
+    Args:
+        fp (str): path to the text file (str or path object),
+            or a text file object,
+            in which letters need to be contextualized.
+        outfp (str): path to the file (str or path object),
+            or a text file object, in which the converted text will be saved
+        iso_d (dict): dictionary containing the isolated letter form
+            (keys: general letter form, values: isolated letter form)
+        end_d (dict): dictionary containing the final letter form
+            (keys: general letter form, values: final letter form)
+        mid_d (dict): dictionary containing the medial letter form
+            (keys: general letter form, values: medial letter form)
+        beg_d (dict): dictionary containing the initial letter form
+            (keys: general letter form, values: initial letter form)
+        end_letters (list): a list of Arabic letters that end a letter block
+        other_letters (list): a list of Arabic letters that don't end
+            a letter block
+        diacritics (list): a list of Arabic diacritics
+        normalize_func (funtion): a function to be used to normalize the text
+            prior to the contextualization. Defaults to `normalize_composites`
+        normalize_method (str): name of a normalization method that
+            needs to be passed to `normalize_func`. Defaults to "NFKD", 
+            which will split all combined letters and all ligatures.
+
+    Returns:
+        str
+    """
+    with _open(fp) as file:
+        text = file.read()
     new = contextualize_text(text, iso_d=iso_d, end_d=end_d,
                              mid_d=mid_d, beg_d=beg_d,
                              end_letters=end_letters,
@@ -768,41 +1730,1084 @@ def contextualize(inp, outfp=None, iso_d=iso_d, end_d=end_d,
                              diacritics=diacritics,
                              normalize_func=normalize_func,
                              normalize_method=normalize_method)
-
     if outfp:
-        with open(outfp, mode="w", encoding="utf-8") as file:
+        with _open(outfp, mode="w") as file:
             file.write(new)
-    else:
-        print(new)
     return new
 
-def decontextualize(inp, outfp=None, tails_regex=tails_regex):
+# number of characters read from a file at a time when streaming:
+CHUNK_SIZE = 2**20
+
+
+def _rechunk(chunks):
+    """Cut an iterable of strings into pieces that end on a line break
+    (or a space, for very long lines), so that no letter block
+    (or word) is split between pieces.
+
+    The unfinished last word of every chunk is carried over
+    to the next chunk.
+
+    Args:
+        chunks (iterable): iterable of strings
+
+    Yields:
+        str
+    """
+    rest = ""
+    for chunk in chunks:
+        chunk = rest + chunk
+        i = chunk.rfind("\n")
+        if i == -1:
+            i = chunk.rfind(" ")
+        if i == -1:  # no safe boundary yet: read on
+            rest = chunk
+            continue
+        rest = chunk[i+1:]
+        yield chunk[:i+1]
+    if rest:
+        yield rest
+
+
+def _read_chunks(file, chunk_size=CHUNK_SIZE):
+    """Read a text file in chunks that end on a line break (or a space,
+    for very long lines), so that no letter block is split between chunks.
+
+    Args:
+        file (file object): text file opened for reading
+        chunk_size (int): number of characters to be read at a time
+
+    Yields:
+        str
+    """
+    return _rechunk(iter(lambda: file.read(chunk_size), ""))
+
+
+def contextualize_stream(infp, outfp, chunk_size=CHUNK_SIZE,
+                         iso_d=iso_d, end_d=end_d,
+                         mid_d=mid_d, beg_d=beg_d,
+                         end_letters=end_letters,
+                         other_letters=other_letters,
+                         diacritics=diacritics,
+                         normalize_func=normalize,
+                         normalize_method="NFKD"):
+    """Turn Arabic letters in a text file into contextualized glyph forms,
+    reading and writing the file in chunks.
+
+    Memory use depends on the chunk size, not on the size of the file.
+
+    Args:
+        infp (str): path to the text file (str or path object),
+            or a text file object,
+            in which letters need to be contextualized.
+        outfp (str): path to the file (str or path object),
+            or a text file object, in which the converted text will be saved
+        chunk_size (int): number of characters to be read at a time
+        iso_d (dict): dictionary containing the isolated letter form
+            (keys: general letter form, values: isolated letter form)
+        end_d (dict): dictionary containing the final letter form
+            (keys: general letter form, values: final letter form)
+        mid_d (dict): dictionary containing the medial letter form
+            (keys: general letter form, values: medial letter form)
+        beg_d (dict): dictionary containing the initial letter form
+            (keys: general letter form, values: initial letter form)
+        end_letters (list): a list of Arabic letters that end a letter block
+        other_letters (list): a list of Arabic letters that don't end
+            a letter block
+        diacritics (list): a list of Arabic diacritics
+        normalize_func (funtion): a function to be used to normalize the text
+            prior to the contextualization. Defaults to `normalize_composites`
+        normalize_method (str): name of a normalization method that
+            needs to be passed to `normalize_func`. Defaults to "NFKD", 
+            which will split all combined letters and all ligatures.
+
+    Returns:
+        None
+    """
+    with _open(infp) as infile, _open(outfp, mode="w") as outfile:
+        for chunk in _read_chunks(infile, chunk_size):
+            new = contextualize_text(chunk, iso_d=iso_d, end_d=end_d,
+                                     mid_d=mid_d, beg_d=beg_d,
+                                     end_letters=end_letters,
+                                     other_letters=other_letters,
+                                     diacritics=diacritics,
+                                     normalize_func=normalize_func,
+                                     normalize_method=normalize_method)
+            outfile.write(new)
+
+
+def decontextualize_text(text, tails_regex=tails_regex,
+                         decontext_table=default_decontext_table,
+                         cache=False):
+    """Turn contextualized Arabic letter forms in a string into general
+    letter forms, making sure that final letter shapes are not connected
+    to the next word.
+
+    The contextual forms are replaced using a `str.translate` table;
+    only lines that contain characters outside of that table
+    (or diacritics that need reordering) are normalized using NFKC.
+    The result is the same as NFKC normalization of the whole text.
+
+    Args:
+        text (str): the string in which letters need to be decontextualized.
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+        decontext_table (dict): tables compiled by `compile_decontext_table`
+        cache (bool): if True, the text is split at spaces and every token
+            is decontextualized by a token cache (see `make_token_cache`).
+            Defaults to False.
+
+    Returns:
+        str
+    """
+    if cache:
+        if tails_regex is _default_decontext_sources[0] \
+           and decontext_table is _default_decontext_sources[1]:
+            decontextualize_token = token_cache
+        else:
+            decontextualize_token = make_token_cache(tails_regex=tails_regex,
+                                                     decontext_table=decontext_table)
+        return " ".join(map(decontextualize_token, text.split(" ")))
+    new = re.sub(tails_regex, r"\1 ", text)
+    new = new.translate(decontext_table["table"])
+    unknown = decontext_table["unknown_regex"].search
+    reorder = decontext_table["reorder_regex"].search
+    if unknown(new) or reorder(new):
+        new = "".join([normalize_composites(line, method="NFKC")
+                       if (unknown(line) or reorder(line)) else line
+                       for line in new.splitlines(keepends=True)])
+    for k, v in decontext_table["compose"].items():
+        if k in new:
+            new = new.replace(k, v)
+    return new
+
+
+# maximum number of tokens in the token cache:
+TOKEN_CACHE_SIZE = 2**16
+
+
+def make_token_cache(maxsize=TOKEN_CACHE_SIZE, tails_regex=tails_regex,
+                     decontext_table=default_decontext_table):
+    """Create a function that decontextualizes a token (a string
+    without spaces), memoized by an LRU cache.
+
+    OCR output contains the same contextualized words all the time,
+    so most tokens are decontextualized with a single cache lookup.
+    Since every cache miss costs a separate `decontextualize_text` call,
+    the cache only pays off once it is filled, e.g. in a long-running
+    process that decontextualizes many short texts.
+    Splitting a text at spaces does not change the result,
+    since a space never joins the characters on either side of it.
+    The hit/miss statistics of the cache are returned by the
+    `cache_info()` method of the function, and `cache_clear()`
+    empties the cache.
+
+    `decontextualize_text(..., cache=True)` uses the module's
+    `token_cache` for the default tables; replace it to change
+    the size of the cache, e.g.:
+
+    >>> contextual_forms.token_cache = make_token_cache(maxsize=2**20)
+
+    Args:
+        maxsize (int): maximum number of tokens in the cache; the least
+            recently used token is evicted when the cache is full
+            (None: no limit). Defaults to TOKEN_CACHE_SIZE.
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+        decontext_table (dict): tables compiled by `compile_decontext_table`
+
+    Returns:
+        function
+    """
+    @functools.lru_cache(maxsize=maxsize)
+    def decontextualize_token(token):
+        return decontextualize_text(token, tails_regex=tails_regex,
+                                    decontext_table=decontext_table)
+    return decontextualize_token
+
+token_cache = make_token_cache()
+_default_decontext_sources = (tails_regex, default_decontext_table)
+
+
+def decontextualize_iter(lines, tails_regex=tails_regex, cache=False):
+    """Turn contextualized Arabic letter forms in an iterable of strings
+    (e.g., the lines of a file) into general letter forms,
+    one string at a time.
+
+    Every string is decontextualized separately
+    (use `decontextualize_chunks` for strings that can end
+    in the middle of a word).
+
+    Args:
+        lines (iterable): iterable of strings in which letters need
+            to be decontextualized.
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+        cache (bool): if True, use the token cache
+            (see `decontextualize_text`). Defaults to False.
+
+    Yields:
+        str
+    """
+    for line in lines:
+        yield decontextualize_text(line, tails_regex=tails_regex, cache=cache)
+
+
+def decontextualize_many(strings, tails_regex=tails_regex, cache=False):
+    """Turn contextualized Arabic letter forms in a list of strings
+    (e.g., OCR lines) into general letter forms.
+
+    The strings are joined with a separator and decontextualized
+    in one pass (see `contextualize_many`); the result is the same
+    as decontextualizing every string separately.
+
+    Args:
+        strings (iterable): the strings in which letters need
+            to be decontextualized.
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+        cache (bool): if True, use the token cache
+            (see `decontextualize_text`). Defaults to False.
+
+    Returns:
+        list of str
+    """
+    strings = list(strings)
+    text, sep = _join_many(strings)
+    if sep is not None:
+        new = decontextualize_text(text, tails_regex=tails_regex,
+                                   cache=cache).split(sep)
+        if len(new) == len(strings):
+            return new
+    return list(decontextualize_iter(strings, tails_regex=tails_regex,
+                                     cache=cache))
+
+
+def decontextualize_chunks(chunks, tails_regex=tails_regex):
+    """Turn contextualized Arabic letter forms in an iterable of strings
+    into general letter forms.
+
+    The strings can be cut anywhere: the unfinished last word of every
+    string (e.g., a final letter form and its diacritics, which may need
+    a space depending on the next character) is carried over
+    to the next string, so that the result is the same as that of
+    `decontextualize_text` on the concatenated strings.
+
+    Args:
+        chunks (iterable): iterable of strings in which letters need
+            to be decontextualized.
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+
+    Yields:
+        str
+    """
+    for chunk in _rechunk(chunks):
+        yield decontextualize_text(chunk, tails_regex=tails_regex)
+
+
+def decontextualize_stream(infp, outfp, chunk_size=CHUNK_SIZE,
+                           tails_regex=tails_regex):
+    """Turn contextualized Arabic letter forms in a text file into general
+    letter forms, reading and writing the file in chunks.
+
+    Memory use depends on the chunk size, not on the size of the file.
+
+    Args:
+        infp (str): path to the text file (str or path object),
+            or a text file object,
+            in which letters need to be decontextualized.
+        outfp (str): path to the output file (str or path object),
+            or a text file object, in which the converted text will be saved
+        chunk_size (int): number of characters to be read at a time
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+
+    Returns:
+        None
+    """
+    with _open(infp) as infile, _open(outfp, mode="w") as outfile:
+        chunks = iter(lambda: infile.read(chunk_size), "")
+        for new in decontextualize_chunks(chunks, tails_regex=tails_regex):
+            outfile.write(new)
+
+
+def decontextualize(inp, outfp=None, tails_regex=tails_regex, echo=False,
+                    cache=False, line_cache=None):
     """Turn contextualized Arabic letter forms into general letter forms,\
     making sure that final letter shapes are not connected to the next word.
 
     Args:
-        inp (str): the string (or path to a text file)
-            in which letters need to be decontextualized.
+        inp (str): the string (or path to a text file, path object
+            or text file object) in which letters need to be decontextualized.
         outfp (str): path to the output file in which letters will be decontextualized.
-        tails_regex (str): regular expressions that describes the situation
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
              where a final form code point is followed by another letter.
+        echo (bool): if True (and no outfp is given), print the
+            converted text. Defaults to False.
+        cache (bool): if True, use the token cache
+            (see `decontextualize_text`). Defaults to False.
+        line_cache (LineCache): a persistent line cache (or path to
+            its database); only lines that are not in the cache are
+            decontextualized (see `LineCache`). Defaults to None.
     Returns:
         str
     """
-    if os.path.isfile(inp):
-        with open(inp, mode="r", encoding="utf-8") as file:
+    if _is_file(inp):
+        with _open(inp) as file:
             text = file.read()
     else:
         text = inp
-    new = re.sub(tails_regex, r"\1 ", text)
-    new = normalize_composites(new, method="NFKC")
+    if line_cache is not None:
+        convert_many = functools.partial(decontextualize_many,
+                                         tails_regex=tails_regex, cache=cache)
+        new = _convert_cached(text, line_cache, convert_many,
+                              "decontextualize",
+                              decontextualize_fingerprint(tails_regex))
+    else:
+        new = decontextualize_text(text, tails_regex=tails_regex, cache=cache)
     if outfp:
-        with open(outfp, mode="w", encoding="utf-8") as file:
+        with _open(outfp, mode="w") as file:
             file.write(new)
-    else:
+    elif echo:
         print(new)
     return new
-    
+
+
+def decontextualize_file(fp, outfp=None, tails_regex=tails_regex):
+    """Turn contextualized Arabic letter forms in a text file
+    into general letter forms.
+
+    Unlike `decontextualize`, this function never treats its input
+    as a string to be converted (use `decontextualize_text` for strings).
+
+    Args:
+        fp (str): path to the text file (str or path object),
+            or a text file object,
+            in which letters need to be decontextualized.
+        outfp (str): path to the output file (str or path object),
+            or a text file object, in which the converted text will be saved
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+
+    Returns:
+        str
+    """
+    with _open(fp) as file:
+        text = file.read()
+    new = decontextualize_text(text, tails_regex=tails_regex)
+    if outfp:
+        with _open(outfp, mode="w") as file:
+            file.write(new)
+    return new
+
+
+
+############################################
+#                  SHAPER                  #
+############################################
+
+class Shaper:
+    """Contextualize and decontextualize strings with a shaping profile
+    that is compiled only once.
+
+    The default profile contains the standard Arabic letters and the
+    Persian, Urdu and Maghribi letters in the module's dictionaries
+    (e.g., پ, ٹ, ڭ, ک); pass other dictionaries to create
+    a custom profile. The compiled tables should not be modified.
+
+    A Shaper is cheap to pickle (e.g., to send it to worker processes):
+    only the dictionaries that differ from the module's defaults
+    are pickled, and the tables are compiled again when it is unpickled.
+
+    Example:
+        >>> shaper = Shaper(mode="regex")
+        >>> shaper.shape("ب")
+        'ﺏ'
+        >>> shaper.unshape("ﺏ")
+        'ب'
+
+    Args:
+        iso_d (dict): dictionary containing the isolated letter form
+            (keys: general letter form, values: isolated letter form)
+        end_d (dict): dictionary containing the final letter form
+            (keys: general letter form, values: final letter form)
+        mid_d (dict): dictionary containing the medial letter form
+            (keys: general letter form, values: medial letter form)
+        beg_d (dict): dictionary containing the initial letter form
+            (keys: general letter form, values: initial letter form)
+        end_letters (list): a list of Arabic letters that end a letter block
+        other_letters (list): a list of Arabic letters that don't end
+            a letter block
+        diacritics (list): a list of Arabic diacritics
+        decontext_d (dict): dictionary containing the general form
+            of contextual letter forms
+            (keys: contextual form, values: general letter form)
+        tails_regex (str or re.Pattern): regular expression that
+             describes the situation
+             where a final form code point is followed by another letter.
+        normalize_func (funtion): a function to be used to normalize the text
+            prior to the contextualization. Defaults to `normalize`
+        normalize_method (str): name of a normalization method that
+            needs to be passed to `normalize_func`. Defaults to "NFKD".
+        mode (str): the contextualization engine to be used
+            (see `contextualize_text`). Defaults to "fsm".
+        cache (bool): if True, `unshape` uses a token cache
+            (see `make_token_cache`). Defaults to False.
+    """
+
+    _defaults = dict(iso_d=iso_d, end_d=end_d, mid_d=mid_d, beg_d=beg_d,
+                     end_letters=end_letters, other_letters=other_letters,
+                     diacritics=diacritics, decontext_d=decontext_d,
+                     tails_regex=tails_regex, normalize_func=normalize,
+                     normalize_method="NFKD", mode="fsm", cache=False)
+
+    def __init__(self, **profile):
+        unknown = set(profile) - set(self._defaults)
+        if unknown:
+            raise TypeError("Unknown Shaper arguments: {}".format(
+                ", ".join(sorted(unknown))))
+        self._compile(profile)
+
+    def _compile(self, profile, decontext_table=None):
+        """Compile the tables of a profile (and use the decontextualization
+        table `decontext_table` if it was compiled already)."""
+        self.profile = dict(self._defaults, **profile)
+        p = self.profile
+        if p["mode"] not in ("fsm", "regex", "numpy"):
+            raise ValueError("Unknown contextualization mode: {}".format(
+                p["mode"]))
+        self.tables = _tables_for(p["iso_d"], p["end_d"], p["mid_d"],
+                                  p["beg_d"], p["end_letters"],
+                                  p["other_letters"], p["diacritics"])
+        if decontext_table is not None:
+            self.decontext_table = decontext_table
+        elif p["decontext_d"] is decontext_d:
+            self.decontext_table = default_decontext_table
+        else:
+            self.decontext_table = compile_decontext_table(p["decontext_d"])
+        self.tails_regex = re.compile(p["tails_regex"])
+        self._shape_block = None
+        if p["mode"] == "regex":
+            if self.tables is default_tables:
+                self._shape_block = block_cache
+            else:
+                self._shape_block = make_block_cache(self.tables)
+        self._unshape_token = None
+        if p["cache"]:
+            self._unshape_token = make_token_cache(
+                tails_regex=self.tails_regex,
+                decontext_table=self.decontext_table)
+
+    def shape(self, text):
+        """Turn Arabic letters in a string into contextualized glyph forms
+        (see `contextualize_text`)."""
+        p = self.profile
+        return _contextualize(text, self.tables,
+                              normalize_func=p["normalize_func"],
+                              normalize_method=p["normalize_method"],
+                              mode=p["mode"], shape_block=self._shape_block)
+
+    def unshape(self, text):
+        """Turn contextualized Arabic letter forms in a string
+        into general letter forms (see `decontextualize_text`)."""
+        if self._unshape_token is not None:
+            return " ".join(map(self._unshape_token, text.split(" ")))
+        return decontextualize_text(text, tails_regex=self.tails_regex,
+                                    decontext_table=self.decontext_table)
+
+    def shape_many(self, strings):
+        """Contextualize a list of strings in one pass
+        (see `contextualize_many`)."""
+        return self._many(self.shape, strings)
+
+    def unshape_many(self, strings):
+        """Decontextualize a list of strings in one pass
+        (see `decontextualize_many`)."""
+        return self._many(self.unshape, strings)
+
+    def _many(self, func, strings):
+        strings = list(strings)
+        text, sep = _join_many(strings)
+        if sep is not None:
+            new = func(text).split(sep)
+            if len(new) == len(strings):
+                return new
+        return [func(s) for s in strings]
+
+    def __getstate__(self):
+        # only pickle the arguments that differ from the defaults:
+        return {k: v for k, v in self.profile.items()
+                if v is not self._defaults[k]}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return "Shaper({})".format(", ".join(sorted(self.__getstate__())))
+
+
+# profile keys that can be set in a JSON profile file
+# (normalize_func can be switched off with "normalize": false):
+profile_keys = ["iso_d", "end_d", "mid_d", "beg_d", "end_letters",
+                "other_letters", "diacritics", "decontext_d", "tails_regex",
+                "normalize", "normalize_method", "mode"]
+
+
+def load_profile(fp, cache_folder=None, **kwargs):
+    """Load a custom shaping profile from a JSON file into a `Shaper`.
+
+    The JSON file contains an object with any of the keys in
+    `profile_keys`; the dictionaries and letter lists that are
+    not in the file are taken from the module's defaults. E.g.:
+
+        {"iso_d": {"ب": "ﺏ"}, "end_d": {"ب": "ﺐ"},
+         "mid_d": {"ب": "ﺒ"}, "beg_d": {"ب": "ﺑ"},
+         "other_letters": ["ب"], "end_letters": [], "diacritics": []}
+
+    Compiling the decontextualization table of a custom `decontext_d`
+    is the slowest part of loading a profile. If a `cache_folder` is
+    given, the compiled table is stored in that folder in a JSON file
+    named after the hash of the `decontext_d` dictionary, so that other
+    processes that load the same profile can skip the compilation.
+
+    Args:
+        fp (str): path to the JSON profile file
+        cache_folder (str): path to the folder for the compiled tables.
+            Defaults to None (no disk cache).
+        kwargs: other Shaper arguments (e.g., `mode`), which override
+            the values in the profile file
+
+    Returns:
+        Shaper
+    """
+    unknown = set(kwargs) - set(Shaper._defaults)
+    if unknown:
+        raise TypeError("Unknown Shaper arguments: {}".format(
+            ", ".join(sorted(unknown))))
+    with open(fp, mode="r", encoding="utf-8") as file:
+        profile = json.load(file)
+    if not isinstance(profile, dict):
+        raise ValueError("{} does not contain a JSON object".format(fp))
+    unknown = set(profile) - set(profile_keys)
+    if unknown:
+        raise ValueError("Unknown keys in profile {}: {}".format(
+            fp, ", ".join(sorted(unknown))))
+    if "normalize" in profile:
+        profile["normalize_func"] = normalize if profile.pop("normalize") \
+                                    else None
+    profile.update(kwargs)
+    if profile.get("decontext_d", decontext_d) is decontext_d \
+            or cache_folder is None:
+        return Shaper(**profile)
+
+    # load the compiled decontextualization table from the disk cache,
+    # or compile it and store it in the cache
+    # (the key is computed from the `decontext_d` that is actually used,
+    # which may come from the kwargs rather than from the file):
+    key = fingerprint(profile["decontext_d"], decontext_ranges,
+                      CACHE_VERSION, unicodedata.unidata_version)
+    cache_fp = os.path.join(cache_folder, key + ".json")
+    try:
+        with open(cache_fp, mode="r", encoding="utf-8") as file:
+            compiled = json.load(file)
+        mappings = {int(cp): n for cp, n in compiled["mappings"].items()}
+        unknown_regex = compiled["unknown_regex"]
+        reorder_regex = compiled["reorder_regex"]
+    except (OSError, ValueError, KeyError):
+        mappings, unknown_regex, reorder_regex = \
+                  _decontext_mappings(profile["decontext_d"])
+        os.makedirs(cache_folder, exist_ok=True)
+        # (write to a temporary file of this process, so that processes
+        # that compile the same profile at the same time don't clash:)
+        import tempfile
+        with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8",
+                                         dir=cache_folder, suffix=".tmp",
+                                         delete=False) as file:
+            json.dump({"mappings": mappings, "unknown_regex": unknown_regex,
+                       "reorder_regex": reorder_regex}, file)
+        os.replace(file.name, cache_fp)
+    shaper = Shaper.__new__(Shaper)
+    shaper._compile(profile, _build_decontext_table(mappings, unknown_regex,
+                                                    reorder_regex))
+    return shaper
+
+
+############################################
+#        PERSISTENT CONVERSION CACHE       #
+############################################
+
+# increase this number if a change in the code changes
+# the (de)contextualized text, to invalidate persistent line caches:
+CACHE_VERSION = 2
+
+# default maximum number of lines in a persistent line cache:
+LINE_CACHE_SIZE = 10**7
+
+LineCacheInfo = collections.namedtuple("LineCacheInfo",
+                                       "hits misses maxsize currsize")
+
+
+def fingerprint(*objects):
+    """Return a hash of the tables (dictionaries, sets, lists, strings,
+    compiled regexes) used for a conversion.
+
+    Sets are sorted first, so that the hash does not depend
+    on the (randomized) order of their items.
+
+    Args:
+        objects: the tables to be hashed
+
+    Returns:
+        str
+    """
+    import hashlib
+    h = hashlib.sha1()
+    for obj in objects:
+        if isinstance(obj, (set, frozenset)):
+            obj = sorted(obj)
+        elif isinstance(obj, re.Pattern):
+            obj = obj.pattern
+        h.update(repr(obj).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def contextualize_fingerprint(iso_d=iso_d, end_d=end_d,
+                              mid_d=mid_d, beg_d=beg_d,
+                              end_letters=end_letters,
+                              other_letters=other_letters,
+                              diacritics=diacritics,
+                              normalize_method="NFKD"):
+    """Return the fingerprint of everything the result
+    of `contextualize_text` depends on (with the default
+    normalization function)."""
+    return fingerprint(CACHE_VERSION, unicodedata.unidata_version,
+                       iso_d, end_d, mid_d, beg_d,
+                       end_letters, other_letters, diacritics,
+                       lam_alif_d, normalize_d, normalize_method)
+
+
+def decontextualize_fingerprint(tails_regex=tails_regex):
+    """Return the fingerprint of everything the result
+    of `decontextualize_text` depends on."""
+    return fingerprint(CACHE_VERSION, unicodedata.unidata_version,
+                       decontext_d, decontext_ranges, compose_d, tails_regex)
+
+
+class LineCache:
+    """A persistent cache of (de)contextualized lines,
+    stored in an SQLite database.
+
+    Rebuilding a large corpus mostly converts the same lines
+    as the previous run; with a line cache, only the lines that are
+    not in the cache are converted. Lines are looked up by a hash
+    of their content and the fingerprint of the tables they were
+    converted with (see `contextualize_fingerprint`);
+    lines converted with other tables (or an older CACHE_VERSION)
+    are deleted from the cache the first time it is used with
+    the new tables. If the cache contains more than `max_lines` lines,
+    the least recently used lines are deleted (down to 90% of `max_lines`).
+
+    Example:
+        >>> with LineCache("cache.sqlite") as cache:
+        ...     new = contextualize(text, line_cache=cache)
+        ...     print(cache.cache_info())
+
+    Args:
+        fp (str): path to the SQLite database
+            (created if it does not exist)
+        max_lines (int): maximum number of lines in the cache
+            (None: no limit). Defaults to LINE_CACHE_SIZE.
+    """
+
+    def __init__(self, fp, max_lines=LINE_CACHE_SIZE):
+        import sqlite3
+        self.db = sqlite3.connect(fp, timeout=60)
+        # caches created before the fingerprint was part of the key
+        # (schema version 0) are discarded:
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < 1:
+            self.db.execute("DROP TABLE IF EXISTS lines")
+            self.db.execute("PRAGMA user_version = 1")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS lines (
+                             kind TEXT, key BLOB, fingerprint TEXT,
+                             value TEXT, used INTEGER,
+                             PRIMARY KEY (kind, fingerprint, key))""")
+        self.max_lines = max_lines
+        self.hits = 0
+        self.misses = 0
+        used = self.db.execute("SELECT MAX(used) FROM lines").fetchone()[0]
+        # lines used in this session are marked with a higher number:
+        self.stamp = (used or 0) + 1
+        self._count()
+        self._checked = set()
+
+    def _count(self):
+        """Count the lines in the cache (which can also be changed
+        by other processes)."""
+        self.size = self.db.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+
+    def _execute(self, query, keys, *args):
+        """Run a query for a list of keys, in batches
+        (SQLite limits the number of parameters of a query)."""
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i+900]
+            q = query.format(",".join("?" * len(batch)))
+            yield self.db.execute(q, list(args) + batch)
+
+    def convert(self, lines, convert_many, kind, fingerprint):
+        """Convert a list of lines, using the cache.
+
+        Args:
+            lines (list): the strings to be converted
+            convert_many (function): function that converts a list
+                of strings (e.g., `contextualize_many`)
+            kind (str): name of the conversion (e.g., "contextualize")
+            fingerprint (str): fingerprint of the tables
+                used by `convert_many`
+
+        Returns:
+            list of str
+        """
+        import hashlib
+        if (kind, fingerprint) not in self._checked:
+            self.db.execute("""DELETE FROM lines WHERE kind = ?
+                               AND fingerprint != ?""", (kind, fingerprint))
+            self._count()
+            self._checked.add((kind, fingerprint))
+        keys = [hashlib.blake2b(line.encode("utf-8", "surrogatepass"),
+                                digest_size=16).digest()
+                for line in lines]
+        found = dict()
+        for rows in self._execute("""SELECT key, value FROM lines
+                                     WHERE kind = ? AND fingerprint = ?
+                                     AND key IN ({})""",
+                                  list(set(keys)), kind, fingerprint):
+            found.update(rows)
+        for rows in self._execute("""UPDATE lines SET used = ?
+                                     WHERE kind = ? AND fingerprint = ?
+                                     AND key IN ({})""",
+                                  list(found), self.stamp, kind, fingerprint):
+            pass
+        missing = dict()
+        for key, line in zip(keys, lines):
+            if key not in found:
+                missing[key] = line
+        self.hits += len(lines) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            new = dict(zip(missing, convert_many(list(missing.values()))))
+            self.db.executemany("""INSERT OR REPLACE INTO lines
+                                   VALUES (?, ?, ?, ?, ?)""",
+                                [(kind, key, fingerprint, value, self.stamp)
+                                 for key, value in new.items()])
+            self.size += len(new)
+            found.update(new)
+        if self.max_lines is not None and self.size > self.max_lines:
+            self._count()
+        if self.max_lines is not None and self.size > self.max_lines:
+            # delete the least recently used lines, leaving some room
+            # so that this (slow, unindexed) query is not run too often:
+            n = self.size - int(self.max_lines * 0.9)
+            self.db.execute("""DELETE FROM lines WHERE rowid IN
+                               (SELECT rowid FROM lines
+                                ORDER BY used LIMIT ?)""", (n,))
+            self.size -= n
+        self.db.commit()
+        return [found[key] for key in keys]
+
+    def cache_info(self):
+        """Return the hit/miss statistics (of this session)
+        and the size of the cache."""
+        return LineCacheInfo(self.hits, self.misses,
+                             self.max_lines, self.size)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _convert_cached(text, line_cache, convert_many, kind, fingerprint):
+    """Convert the lines of a text using a line cache
+    (or the path to the database of a line cache)."""
+    if not isinstance(line_cache, LineCache):
+        with LineCache(line_cache) as cache:
+            return _convert_cached(text, cache, convert_many,
+                                   kind, fingerprint)
+    lines = line_cache.convert(text.split("\n"), convert_many,
+                               kind, fingerprint)
+    return "\n".join(lines)
+
+
+############################################
+#           BATCH FILE CONVERSION          #
+############################################
+
+def _list_files(inp, exclude=None):
+    """List all files in a folder (and its subfolders),
+    or all files that match a glob pattern.
+
+    Hidden files and folders (e.g., .git) in a folder are skipped.
+
+    Args:
+        inp (str): path to a folder, or a glob pattern
+        exclude (str): path to a folder whose files should not be listed
+
+    Returns:
+        list
+    """
+    if os.path.isdir(inp):
+        fps = []
+        for root, dirs, files in os.walk(inp):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            fps += [os.path.join(root, fn) for fn in files
+                    if not fn.startswith(".")]
+    else:
+        fps = [fp for fp in glob.glob(inp, recursive=True)
+               if os.path.isfile(fp)]
+    if exclude:
+        exclude = os.path.join(os.path.abspath(exclude), "")
+        fps = [fp for fp in fps
+               if not os.path.abspath(fp).startswith(exclude)]
+    return sorted(fps)
+
+
+def _file_hash(fp, chunk_size=CHUNK_SIZE):
+    """Return the SHA-1 hash of the contents of a file."""
+    import hashlib
+    h = hashlib.sha1()
+    with open(fp, mode="rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_stat(fp):
+    """Return the size and modification time of a file."""
+    stat = os.stat(fp)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _manifest_entry(infp, outfp, fingerprint):
+    """Create the manifest entry of a converted file."""
+    return {"output": os.path.abspath(outfp),
+            "fingerprint": fingerprint,
+            "source_hash": _file_hash(infp),
+            "source_stat": _file_stat(infp),
+            "output_hash": _file_hash(outfp),
+            "output_stat": _file_stat(outfp)}
+
+
+def _is_up_to_date(entry, infp, outfp, fingerprint):
+    """Check whether a manifest entry shows that the output file
+    of a file is up to date.
+
+    The files are only hashed if their size or modification time
+    changed since the entry was made (in which case the entry
+    is updated if the hash did not change).
+    """
+    if not entry or entry["fingerprint"] != fingerprint \
+       or entry["output"] != os.path.abspath(outfp) \
+       or not os.path.isfile(outfp):
+        return False
+    for fp, k in [(infp, "source"), (outfp, "output")]:
+        stat = _file_stat(fp)
+        if stat != entry[k + "_stat"]:
+            if _file_hash(fp) != entry[k + "_hash"]:
+                return False
+            entry[k + "_stat"] = stat
+    return True
+
+
+def _read_manifest(fp):
+    """Read a manifest file (an empty manifest if the file does not exist)."""
+    if not os.path.isfile(fp):
+        return dict()
+    with open(fp, mode="r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _write_manifest(fp, manifest):
+    """Write a manifest file (replacing the old file only
+    once the new file is complete)."""
+    folder = os.path.dirname(fp)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(fp + ".tmp", mode="w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(fp + ".tmp", fp)
+
+
+def _convert_file(infp, outfp, decontext=False, line_cache=None,
+                  fingerprint=None):
+    """(De)contextualize a file (worker function for `convert_files`).
+
+    Returns:
+        tuple (infp, size of the input file in bytes, seconds,
+        manifest entry (None if no fingerprint is given))
+    """
+    start = time.time()
+    outfolder = os.path.dirname(outfp)
+    if outfolder:
+        os.makedirs(outfolder, exist_ok=True)
+    if line_cache:
+        if decontext:
+            decontextualize(infp, outfp, line_cache=line_cache)
+        else:
+            contextualize(infp, outfp, line_cache=line_cache)
+    elif decontext:
+        decontextualize_stream(infp, outfp)
+    else:
+        contextualize_stream(infp, outfp)
+    entry = None
+    if fingerprint:
+        entry = _manifest_entry(infp, outfp, fingerprint)
+    return infp, os.path.getsize(infp), time.time() - start, entry
+
+
+def convert_files(inp, outfolder, decontext=False, workers=None,
+                  force=False, line_cache=None, manifest=None):
+    """Contextualize (or decontextualize) all files in a folder,
+    or all files that match a glob pattern, using multiple processes.
+
+    The converted files are saved in `outfolder`, in the same
+    subfolder structure as the input files. Files whose output file
+    is newer than the input file are skipped. Files that cannot be
+    converted (e.g., binary files) are reported and skipped;
+    their (incomplete) output file is deleted.
+
+    If a manifest file is used, a file is only converted if its
+    content, the content of its output file or the conversion tables
+    (see `contextualize_fingerprint`) changed since it was last
+    converted. The manifest records the hash of the input and output
+    file, and the fingerprint of the tables, for every converted file;
+    files are only hashed again if their size or modification time
+    changed.
+
+    Args:
+        inp (str): path to a folder, or a glob pattern
+        outfolder (str): path to the folder where the converted
+            files will be saved
+        decontext (bool): if True, decontextualize the files
+        workers (int): number of worker processes. Defaults to None
+            (the number of processors on the machine)
+        force (bool): if True, also convert files whose output
+            is up to date
+        line_cache (str): path to the database of a persistent
+            line cache (see `LineCache`), shared by all worker processes.
+            Defaults to None (no line cache).
+        manifest (str): path to a manifest file (JSON; created if it
+            does not exist). Defaults to None (no manifest: files
+            are compared by their modification time)
+
+    Returns:
+        list (paths to the converted files)
+    """
+    fps = _list_files(inp, exclude=outfolder)
+    # don't convert the manifest and line cache files:
+    skip = [os.path.abspath(fp) + ext for fp in [manifest, line_cache] if fp
+            for ext in ["", ".tmp", "-journal"]]
+    fps = [fp for fp in fps if os.path.abspath(fp) not in skip]
+    if not fps:
+        return []
+    fingerprint = None
+    entries = dict()
+    if manifest:
+        if decontext:
+            fingerprint = decontextualize_fingerprint()
+        else:
+            fingerprint = contextualize_fingerprint()
+        entries = _read_manifest(manifest)
+    if os.path.isdir(inp):
+        root = inp
+    else:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(fp))
+                                   for fp in fps])
+    jobs = dict()
+    for infp in fps:
+        outfp = os.path.join(outfolder,
+                             os.path.relpath(os.path.abspath(infp),
+                                             os.path.abspath(root)))
+        if force:
+            up_to_date = False
+        elif manifest:
+            up_to_date = _is_up_to_date(entries.get(os.path.abspath(infp)),
+                                        infp, outfp, fingerprint)
+        else:
+            up_to_date = os.path.isfile(outfp) \
+                         and os.path.getmtime(outfp) >= os.path.getmtime(infp)
+        if up_to_date:
+            print("{}: up to date".format(infp))
+            continue
+        jobs[infp] = outfp
+
+    start = time.time()
+    total = 0
+    failed = []
+    def report(infp, size, seconds, entry):
+        nonlocal total
+        print("{}: {:.1f} MB in {:.2f} s ({:.1f} MB/s)".format(
+            infp, size/1e6, seconds, size/1e6/max(seconds, 1e-6)))
+        total += size
+        if entry:
+            entries[os.path.abspath(infp)] = entry
+    def report_error(infp, e):
+        print("{}: ERROR: {}: {}".format(infp, type(e).__name__, e))
+        failed.append(infp)
+        entries.pop(os.path.abspath(infp), None)
+        if os.path.isfile(jobs[infp]):
+            os.remove(jobs[infp])
+    try:
+        if workers == 1:
+            for infp, outfp in jobs.items():
+                try:
+                    result = _convert_file(infp, outfp, decontext,
+                                           line_cache, fingerprint)
+                except Exception as e:
+                    report_error(infp, e)
+                else:
+                    report(*result)
+        else:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_convert_file, infp, outfp,
+                                           decontext, line_cache,
+                                           fingerprint): infp
+                           for infp, outfp in jobs.items()}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        report_error(futures[future], e)
+                    else:
+                        report(*result)
+    finally:
+        # (also save the files that were converted before an error:)
+        if manifest:
+            _write_manifest(manifest, {fp: entry
+                                       for fp, entry in entries.items()
+                                       if os.path.isfile(fp)})
+    if jobs:
+        seconds = time.time() - start
+        print("{} files, {:.1f} MB in {:.2f} s ({:.1f} MB/s)".format(
+            len(jobs) - len(failed), total/1e6, seconds,
+            total/1e6/max(seconds, 1e-6)))
+    if failed:
+        print("{} files could not be converted".format(len(failed)))
+    return [outfp for infp, outfp in jobs.items() if infp not in failed]
 
 
 
@@ -829,7 +2834,19 @@ Command line arguments for ocr_pipeline.py:
 -h, --help : print help info
 -i, --input : string or path to a file in which characters need to be (de)contextualized
 -o, --output_file : path to the output file
+    (or output folder, if the input is a folder or glob pattern)
 -d, --decontextualize : decontextualize letters
+-w, --workers : number of worker processes used to convert
+    a folder of files (default: number of processors)
+-f, --force : convert all files in a folder,
+    including those whose output is up to date
+-c, --cache : path to a line cache database (created if it does not exist):
+    only lines that are not in the cache are converted
+-m, --manifest : path to a manifest file (created if it does not exist):
+    only convert the files in a folder whose content (or output file)
+    changed since they were last converted with the same tables
+--build-tables : regenerate the precomputed tables module
+    (contextual_forms_tables.py) after changing the dictionaries
 
 Usage:
 
@@ -843,13 +2860,32 @@ Turn all contextual letter forms in a string or file into their general forms:
 $ python contextual_forms.py -d -i "ألف باء"
 $ python contextual_forms.py -d -i path/to/input/text.txt
 
-Save the output to a file:
+Save the output to a file
+(input files are converted in chunks, so that memory use
+does not depend on the size of the file):
 
 $ python contextual_forms.py -i "ألف باء" -o path/to/output/file.txt
 $ python contextual_forms.py -i path/to/input/text.txt -o path/to/output/file.txt
 $ python contextual_forms.py -d -i "ألف باء" -o path/to/output/file.txt
 $ python contextual_forms.py -d -i path/to/input/text.txt -o path/to/output/file.txt
 
+Convert all files in a folder (or all files that match a glob pattern),
+using 4 worker processes; files whose output is newer than the input
+are skipped:
+
+$ python contextual_forms.py -i path/to/input/folder -o path/to/output/folder -w 4
+$ python contextual_forms.py -i "path/to/input/folder/*.txt" -o path/to/output/folder
+
+Use a persistent cache of converted lines, so that lines that
+were converted in a previous run are not converted again:
+
+$ python contextual_forms.py -i path/to/input/folder -o path/to/output/folder -c cache.sqlite
+
+Only convert the files whose content changed since the last run
+(instead of comparing modification times):
+
+$ python contextual_forms.py -i path/to/input/folder -o path/to/output/folder -m manifest.json
+
 """
 
 
@@ -858,9 +2894,14 @@ if __name__ == "__main__":
     inp = ""
     outfp = None
     decontext = False
+    workers = None
+    force = False
+    line_cache = None
+    manifest = None
     argv = sys.argv[1:]
-    opt_str = "hdi:o:"
-    opt_list = ["help", "decontextualize", "input=", "output_file="]
+    opt_str = "hdi:o:w:fc:m:"
+    opt_list = ["help", "decontextualize", "input=", "output_file=",
+                "workers=", "force", "cache=", "manifest=", "build-tables"]
     try:
         opts, args = getopt.getopt(argv, opt_str, opt_list)
     except Exception as e:
@@ -879,12 +2920,32 @@ if __name__ == "__main__":
             inp = arg
         elif opt in ["-o", "--output_file"]:
             outfp = arg
+        elif opt in ["-w", "--workers"]:
+            workers = int(arg)
+        elif opt in ["-f", "--force"]:
+            force = True
+        elif opt in ["-c", "--cache"]:
+            line_cache = arg
+        elif opt in ["-m", "--manifest"]:
+            manifest = arg
+        elif opt == "--build-tables":
+            build_tables_module()
+            sys.exit(0)
 
     if not inp:
         print("No input provided. Please use the -i parameter.")
         print(info)
         sys.exit(2)
-    if decontext:
-        decontextualize(inp, outfp=outfp)
+    if outfp and (os.path.isdir(inp) or
+                  (any(c in inp for c in "*?[") and glob.glob(inp))):
+        convert_files(inp, outfp, decontext=decontext, workers=workers,
+                      force=force, line_cache=line_cache, manifest=manifest)
+    elif outfp and os.path.isfile(inp) and not line_cache:
+        if decontext:
+            decontextualize_stream(inp, outfp)
+        else:
+            contextualize_stream(inp, outfp)
+    elif decontext:
+        decontextualize(inp, outfp=outfp, echo=True, line_cache=line_cache)
     else:
-        contextualize(inp, outfp=outfp)
+        contextualize(inp, outfp=outfp, echo=True, line_cache=line_cache)
@@ -0,0 +1,852 @@
+"""Precomputed decontextualization table for contextual_forms.
+
+Generated by `contextual_forms.build_tables_module()`;
+do not edit this file by hand.
+"""
+
+CHECKSUM = 4006553563
+
+# Unicode versions for which the table was verified:
+UNIDATA_VERSIONS = ['11.0.0', '12.1.0', '13.0.0', '14.0.0', '15.0.0', '15.1.0']
+
+# code point of a character: its NFKC / general form
+MAPPINGS = {
+  0x00A0: ' ',  # NO-BREAK SPACE
+  0x00A8: ' \u0308',  # DIAERESIS
+  0x00AA: 'a',  # FEMININE ORDINAL INDICATOR
+  0x00AF: ' \u0304',  # MACRON
+  0x00B2: '2',  # SUPERSCRIPT TWO
+  0x00B3: '3',  # SUPERSCRIPT THREE
+  0x00B4: ' \u0301',  # ACUTE ACCENT
+  0x00B5: '\u03bc',  # MICRO SIGN
+  0x00B8: ' \u0327',  # CEDILLA
+  0x00B9: '1',  # SUPERSCRIPT ONE
+  0x00BA: 'o',  # MASCULINE ORDINAL INDICATOR
+  0x00BC: '1\u20444',  # VULGAR FRACTION ONE QUARTER
+  0x00BD: '1\u20442',  # VULGAR FRACTION ONE HALF
+  0x00BE: '3\u20444',  # VULGAR FRACTION THREE QUARTERS
+  0x0132: 'IJ',  # LATIN CAPITAL LIGATURE IJ
+  0x0133: 'ij',  # LATIN SMALL LIGATURE IJ
+  0x013F: 'L\xb7',  # LATIN CAPITAL LETTER L WITH MIDDLE DOT
+  0x0140: 'l\xb7',  # LATIN SMALL LETTER L WITH MIDDLE DOT
+  0x0149: '\u02bcn',  # LATIN SMALL LETTER N PRECEDED BY APOSTROPHE
+  0x017F: 's',  # LATIN SMALL LETTER LONG S
+  0x01C4: 'D\u017d',  # LATIN CAPITAL LETTER DZ WITH CARON
+  0x01C5: 'D\u017e',  # LATIN CAPITAL LETTER D WITH SMALL LETTER Z WITH CARON
+  0x01C6: 'd\u017e',  # LATIN SMALL LETTER DZ WITH CARON
+  0x01C7: 'LJ',  # LATIN CAPITAL LETTER LJ
+  0x01C8: 'Lj',  # LATIN CAPITAL LETTER L WITH SMALL LETTER J
+  0x01C9: 'lj',  # LATIN SMALL LETTER LJ
+  0x01CA: 'NJ',  # LATIN CAPITAL LETTER NJ
+  0x01CB: 'Nj',  # LATIN CAPITAL LETTER N WITH SMALL LETTER J
+  0x01CC: 'nj',  # LATIN SMALL LETTER NJ
+  0x01F1: 'DZ',  # LATIN CAPITAL LETTER DZ
+  0x01F2: 'Dz',  # LATIN CAPITAL LETTER D WITH SMALL LETTER Z
+  0x01F3: 'dz',  # LATIN SMALL LETTER DZ
+  0x02B0: 'h',  # MODIFIER LETTER SMALL H
+  0x02B1: '\u0266',  # MODIFIER LETTER SMALL H WITH HOOK
+  0x02B2: 'j',  # MODIFIER LETTER SMALL J
+  0x02B3: 'r',  # MODIFIER LETTER SMALL R
+  0x02B4: '\u0279',  # MODIFIER LETTER SMALL TURNED R
+  0x02B5: '\u027b',  # MODIFIER LETTER SMALL TURNED R WITH HOOK
+  0x02B6: '\u0281',  # MODIFIER LETTER SMALL CAPITAL INVERTED R
+  0x02B7: 'w',  # MODIFIER LETTER SMALL W
+  0x02B8: 'y',  # MODIFIER LETTER SMALL Y
+  0x02D8: ' \u0306',  # BREVE
+  0x02D9: ' \u0307',  # DOT ABOVE
+  0x02DA: ' \u030a',  # RING ABOVE
+  0x02DB: ' \u0328',  # OGONEK
+  0x02DC: ' \u0303',  # SMALL TILDE
+  0x02DD: ' \u030b',  # DOUBLE ACUTE ACCENT
+  0x02E0: '\u0263',  # MODIFIER LETTER SMALL GAMMA
+  0x02E1: 'l',  # MODIFIER LETTER SMALL L
+  0x02E2: 's',  # MODIFIER LETTER SMALL S
+  0x02E3: 'x',  # MODIFIER LETTER SMALL X
+  0x02E4: '\u0295',  # MODIFIER LETTER SMALL REVERSED GLOTTAL STOP
+  0x0374: '\u02b9',  # GREEK NUMERAL SIGN
+  0x037A: ' \u0345',  # GREEK YPOGEGRAMMENI
+  0x037E: ';',  # GREEK QUESTION MARK
+  0x0384: ' \u0301',  # GREEK TONOS
+  0x0385: ' \u0308\u0301',  # GREEK DIALYTIKA TONOS
+  0x0387: '\xb7',  # GREEK ANO TELEIA
+  0x03D0: '\u03b2',  # GREEK BETA SYMBOL
+  0x03D1: '\u03b8',  # GREEK THETA SYMBOL
+  0x03D2: '\u03a5',  # GREEK UPSILON WITH HOOK SYMBOL
+  0x03D3: '\u038e',  # GREEK UPSILON WITH ACUTE AND HOOK SYMBOL
+  0x03D4: '\u03ab',  # GREEK UPSILON WITH DIAERESIS AND HOOK SYMBOL
+  0x03D5: '\u03c6',  # GREEK PHI SYMBOL
+  0x03D6: '\u03c0',  # GREEK PI SYMBOL
+  0x03F0: '\u03ba',  # GREEK KAPPA SYMBOL
+  0x03F1: '\u03c1',  # GREEK RHO SYMBOL
+  0x03F2: '\u03c2',  # GREEK LUNATE SIGMA SYMBOL
+  0x03F4: '\u0398',  # GREEK CAPITAL THETA SYMBOL
+  0x03F5: '\u03b5',  # GREEK LUNATE EPSILON SYMBOL
+  0x03F9: '\u03a3',  # GREEK CAPITAL LUNATE SIGMA SYMBOL
+  0x0587: '\u0565\u0582',  # ARMENIAN SMALL LIGATURE ECH YIWN
+  0x0675: '\u0627\u0674',  # ARABIC LETTER HIGH HAMZA ALEF
+  0x0676: '\u0648\u0674',  # ARABIC LETTER HIGH HAMZA WAW
+  0x0677: '\u06c7\u0674',  # ARABIC LETTER U WITH HAMZA ABOVE
+  0x0678: '\u064a\u0674',  # ARABIC LETTER HIGH HAMZA YEH
+  0x2000: ' ',  # EN QUAD
+  0x2001: ' ',  # EM QUAD
+  0x2002: ' ',  # EN SPACE
+  0x2003: ' ',  # EM SPACE
+  0x2004: ' ',  # THREE-PER-EM SPACE
+  0x2005: ' ',  # FOUR-PER-EM SPACE
+  0x2006: ' ',  # SIX-PER-EM SPACE
+  0x2007: ' ',  # FIGURE SPACE
+  0x2008: ' ',  # PUNCTUATION SPACE
+  0x2009: ' ',  # THIN SPACE
+  0x200A: ' ',  # HAIR SPACE
+  0x2011: '\u2010',  # NON-BREAKING HYPHEN
+  0x2017: ' \u0333',  # DOUBLE LOW LINE
+  0x2024: '.',  # ONE DOT LEADER
+  0x2025: '..',  # TWO DOT LEADER
+  0x2026: '...',  # HORIZONTAL ELLIPSIS
+  0x202F: ' ',  # NARROW NO-BREAK SPACE
+  0x2033: '\u2032\u2032',  # DOUBLE PRIME
+  0x2034: '\u2032\u2032\u2032',  # TRIPLE PRIME
+  0x2036: '\u2035\u2035',  # REVERSED DOUBLE PRIME
+  0x2037: '\u2035\u2035\u2035',  # REVERSED TRIPLE PRIME
+  0x203C: '!!',  # DOUBLE EXCLAMATION MARK
+  0x203E: ' \u0305',  # OVERLINE
+  0x2047: '??',  # DOUBLE QUESTION MARK
+  0x2048: '?!',  # QUESTION EXCLAMATION MARK
+  0x2049: '!?',  # EXCLAMATION QUESTION MARK
+  0x2057: '\u2032\u2032\u2032\u2032',  # QUADRUPLE PRIME
+  0x205F: ' ',  # MEDIUM MATHEMATICAL SPACE
+  0xFB50: '\u0671',  # ARABIC LETTER ALEF WASLA ISOLATED FORM
+  0xFB51: '\u0671',  # ARABIC LETTER ALEF WASLA FINAL FORM
+  0xFB52: '\u067b',  # ARABIC LETTER BEEH ISOLATED FORM
+  0xFB53: '\u067b',  # ARABIC LETTER BEEH FINAL FORM
+  0xFB54: '\u067b',  # ARABIC LETTER BEEH INITIAL FORM
+  0xFB55: '\u067b',  # ARABIC LETTER BEEH MEDIAL FORM
+  0xFB56: '\u067e',  # ARABIC LETTER PEH ISOLATED FORM
+  0xFB57: '\u067e',  # ARABIC LETTER PEH FINAL FORM
+  0xFB58: '\u067e',  # ARABIC LETTER PEH INITIAL FORM
+  0xFB59: '\u067e',  # ARABIC LETTER PEH MEDIAL FORM
+  0xFB5A: '\u0680',  # ARABIC LETTER BEHEH ISOLATED FORM
+  0xFB5B: '\u0680',  # ARABIC LETTER BEHEH FINAL FORM
+  0xFB5C: '\u0680',  # ARABIC LETTER BEHEH INITIAL FORM
+  0xFB5D: '\u0680',  # ARABIC LETTER BEHEH MEDIAL FORM
+  0xFB5E: '\u067a',  # ARABIC LETTER TTEHEH ISOLATED FORM
+  0xFB5F: '\u067a',  # ARABIC LETTER TTEHEH FINAL FORM
+  0xFB60: '\u067a',  # ARABIC LETTER TTEHEH INITIAL FORM
+  0xFB61: '\u067a',  # ARABIC LETTER TTEHEH MEDIAL FORM
+  0xFB62: '\u067f',  # ARABIC LETTER TEHEH ISOLATED FORM
+  0xFB63: '\u067f',  # ARABIC LETTER TEHEH FINAL FORM
+  0xFB64: '\u067f',  # ARABIC LETTER TEHEH INITIAL FORM
+  0xFB65: '\u067f',  # ARABIC LETTER TEHEH MEDIAL FORM
+  0xFB66: '\u0679',  # ARABIC LETTER TTEH ISOLATED FORM
+  0xFB67: '\u0679',  # ARABIC LETTER TTEH FINAL FORM
+  0xFB68: '\u0679',  # ARABIC LETTER TTEH INITIAL FORM
+  0xFB69: '\u0679',  # ARABIC LETTER TTEH MEDIAL FORM
+  0xFB6A: '\u06a4',  # ARABIC LETTER VEH ISOLATED FORM
+  0xFB6B: '\u06a4',  # ARABIC LETTER VEH FINAL FORM
+  0xFB6C: '\u06a4',  # ARABIC LETTER VEH INITIAL FORM
+  0xFB6D: '\u06a4',  # ARABIC LETTER VEH MEDIAL FORM
+  0xFB6E: '\u06a6',  # ARABIC LETTER PEHEH ISOLATED FORM
+  0xFB6F: '\u06a6',  # ARABIC LETTER PEHEH FINAL FORM
+  0xFB70: '\u06a6',  # ARABIC LETTER PEHEH INITIAL FORM
+  0xFB71: '\u06a6',  # ARABIC LETTER PEHEH MEDIAL FORM
+  0xFB72: '\u0684',  # ARABIC LETTER DYEH ISOLATED FORM
+  0xFB73: '\u0684',  # ARABIC LETTER DYEH FINAL FORM
+  0xFB74: '\u0684',  # ARABIC LETTER DYEH INITIAL FORM
+  0xFB75: '\u0684',  # ARABIC LETTER DYEH MEDIAL FORM
+  0xFB76: '\u0683',  # ARABIC LETTER NYEH ISOLATED FORM
+  0xFB77: '\u0683',  # ARABIC LETTER NYEH FINAL FORM
+  0xFB78: '\u0683',  # ARABIC LETTER NYEH INITIAL FORM
+  0xFB79: '\u0683',  # ARABIC LETTER NYEH MEDIAL FORM
+  0xFB7A: '\u0686',  # ARABIC LETTER TCHEH ISOLATED FORM
+  0xFB7B: '\u0686',  # ARABIC LETTER TCHEH FINAL FORM
+  0xFB7C: '\u0686',  # ARABIC LETTER TCHEH INITIAL FORM
+  0xFB7D: '\u0686',  # ARABIC LETTER TCHEH MEDIAL FORM
+  0xFB7E: '\u0687',  # ARABIC LETTER TCHEHEH ISOLATED FORM
+  0xFB7F: '\u0687',  # ARABIC LETTER TCHEHEH FINAL FORM
+  0xFB80: '\u0687',  # ARABIC LETTER TCHEHEH INITIAL FORM
+  0xFB81: '\u0687',  # ARABIC LETTER TCHEHEH MEDIAL FORM
+  0xFB82: '\u068d',  # ARABIC LETTER DDAHAL ISOLATED FORM
+  0xFB83: '\u068d',  # ARABIC LETTER DDAHAL FINAL FORM
+  0xFB84: '\u068c',  # ARABIC LETTER DAHAL ISOLATED FORM
+  0xFB85: '\u068c',  # ARABIC LETTER DAHAL FINAL FORM
+  0xFB86: '\u068e',  # ARABIC LETTER DUL ISOLATED FORM
+  0xFB87: '\u068e',  # ARABIC LETTER DUL FINAL FORM
+  0xFB88: '\u0688',  # ARABIC LETTER DDAL ISOLATED FORM
+  0xFB89: '\u0688',  # ARABIC LETTER DDAL FINAL FORM
+  0xFB8A: '\u0698',  # ARABIC LETTER JEH ISOLATED FORM
+  0xFB8B: '\u0698',  # ARABIC LETTER JEH FINAL FORM
+  0xFB8C: '\u0691',  # ARABIC LETTER RREH ISOLATED FORM
+  0xFB8D: '\u0691',  # ARABIC LETTER RREH FINAL FORM
+  0xFB8E: '\u06a9',  # ARABIC LETTER KEHEH ISOLATED FORM
+  0xFB8F: '\u06a9',  # ARABIC LETTER KEHEH FINAL FORM
+  0xFB90: '\u06a9',  # ARABIC LETTER KEHEH INITIAL FORM
+  0xFB91: '\u06a9',  # ARABIC LETTER KEHEH MEDIAL FORM
+  0xFB92: '\u06af',  # ARABIC LETTER GAF ISOLATED FORM
+  0xFB93: '\u06af',  # ARABIC LETTER GAF FINAL FORM
+  0xFB94: '\u06af',  # ARABIC LETTER GAF INITIAL FORM
+  0xFB95: '\u06af',  # ARABIC LETTER GAF MEDIAL FORM
+  0xFB96: '\u06b3',  # ARABIC LETTER GUEH ISOLATED FORM
+  0xFB97: '\u06b3',  # ARABIC LETTER GUEH FINAL FORM
+  0xFB98: '\u06b3',  # ARABIC LETTER GUEH INITIAL FORM
+  0xFB99: '\u06b3',  # ARABIC LETTER GUEH MEDIAL FORM
+  0xFB9A: '\u06b1',  # ARABIC LETTER NGOEH ISOLATED FORM
+  0xFB9B: '\u06b1',  # ARABIC LETTER NGOEH FINAL FORM
+  0xFB9C: '\u06b1',  # ARABIC LETTER NGOEH INITIAL FORM
+  0xFB9D: '\u06b1',  # ARABIC LETTER NGOEH MEDIAL FORM
+  0xFB9E: '\u06ba',  # ARABIC LETTER NOON GHUNNA ISOLATED FORM
+  0xFB9F: '\u06ba',  # ARABIC LETTER NOON GHUNNA FINAL FORM
+  0xFBA0: '\u06bb',  # ARABIC LETTER RNOON ISOLATED FORM
+  0xFBA1: '\u06bb',  # ARABIC LETTER RNOON FINAL FORM
+  0xFBA2: '\u06bb',  # ARABIC LETTER RNOON INITIAL FORM
+  0xFBA3: '\u06bb',  # ARABIC LETTER RNOON MEDIAL FORM
+  0xFBA4: '\u06c0',  # ARABIC LETTER HEH WITH YEH ABOVE ISOLATED FORM
+  0xFBA5: '\u06c0',  # ARABIC LETTER HEH WITH YEH ABOVE FINAL FORM
+  0xFBA6: '\u06c1',  # ARABIC LETTER HEH GOAL ISOLATED FORM
+  0xFBA7: '\u06c1',  # ARABIC LETTER HEH GOAL FINAL FORM
+  0xFBA8: '\u06c1',  # ARABIC LETTER HEH GOAL INITIAL FORM
+  0xFBA9: '\u06c1',  # ARABIC LETTER HEH GOAL MEDIAL FORM
+  0xFBAA: '\u06be',  # ARABIC LETTER HEH DOACHASHMEE ISOLATED FORM
+  0xFBAB: '\u06be',  # ARABIC LETTER HEH DOACHASHMEE FINAL FORM
+  0xFBAC: '\u06be',  # ARABIC LETTER HEH DOACHASHMEE INITIAL FORM
+  0xFBAD: '\u06be',  # ARABIC LETTER HEH DOACHASHMEE MEDIAL FORM
+  0xFBAE: '\u06d2',  # ARABIC LETTER YEH BARREE ISOLATED FORM
+  0xFBAF: '\u06d2',  # ARABIC LETTER YEH BARREE FINAL FORM
+  0xFBB0: '\u06d3',  # ARABIC LETTER YEH BARREE WITH HAMZA ABOVE ISOLATED FORM
+  0xFBB1: '\u06d3',  # ARABIC LETTER YEH BARREE WITH HAMZA ABOVE FINAL FORM
+  0xFBD3: '\u06ad',  # ARABIC LETTER NG ISOLATED FORM
+  0xFBD4: '\u06ad',  # ARABIC LETTER NG FINAL FORM
+  0xFBD5: '\u06ad',  # ARABIC LETTER NG INITIAL FORM
+  0xFBD6: '\u06ad',  # ARABIC LETTER NG MEDIAL FORM
+  0xFBD7: '\u06c7',  # ARABIC LETTER U ISOLATED FORM
+  0xFBD8: '\u06c7',  # ARABIC LETTER U FINAL FORM
+  0xFBD9: '\u06c6',  # ARABIC LETTER OE ISOLATED FORM
+  0xFBDA: '\u06c6',  # ARABIC LETTER OE FINAL FORM
+  0xFBDB: '\u06c8',  # ARABIC LETTER YU ISOLATED FORM
+  0xFBDC: '\u06c8',  # ARABIC LETTER YU FINAL FORM
+  0xFBDD: '\u06c7\u0674',  # ARABIC LETTER U WITH HAMZA ABOVE ISOLATED FORM
+  0xFBDE: '\u06cb',  # ARABIC LETTER VE ISOLATED FORM
+  0xFBDF: '\u06cb',  # ARABIC LETTER VE FINAL FORM
+  0xFBE0: '\u06c5',  # ARABIC LETTER KIRGHIZ OE ISOLATED FORM
+  0xFBE1: '\u06c5',  # ARABIC LETTER KIRGHIZ OE FINAL FORM
+  0xFBE2: '\u06c9',  # ARABIC LETTER KIRGHIZ YU ISOLATED FORM
+  0xFBE3: '\u06c9',  # ARABIC LETTER KIRGHIZ YU FINAL FORM
+  0xFBE4: '\u06d0',  # ARABIC LETTER E ISOLATED FORM
+  0xFBE5: '\u06d0',  # ARABIC LETTER E FINAL FORM
+  0xFBE6: '\u06d0',  # ARABIC LETTER E INITIAL FORM
+  0xFBE7: '\u06d0',  # ARABIC LETTER E MEDIAL FORM
+  0xFBE8: '\u0649',  # ARABIC LETTER UIGHUR KAZAKH KIRGHIZ ALEF MAKSURA INITIAL FORM
+  0xFBE9: '\u0649',  # ARABIC LETTER UIGHUR KAZAKH KIRGHIZ ALEF MAKSURA MEDIAL FORM
+  0xFBEA: '\u0626\u0627',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH ALEF ISOLATED FORM
+  0xFBEB: '\u0626\u0627',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH ALEF FINAL FORM
+  0xFBEC: '\u0626\u06d5',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH AE ISOLATED FORM
+  0xFBED: '\u0626\u06d5',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH AE FINAL FORM
+  0xFBEE: '\u0626\u0648',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH WAW ISOLATED FORM
+  0xFBEF: '\u0626\u0648',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH WAW FINAL FORM
+  0xFBF0: '\u0626\u06c7',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH U ISOLATED FORM
+  0xFBF1: '\u0626\u06c7',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH U FINAL FORM
+  0xFBF2: '\u0626\u06c6',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH OE ISOLATED FORM
+  0xFBF3: '\u0626\u06c6',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH OE FINAL FORM
+  0xFBF4: '\u0626\u06c8',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH YU ISOLATED FORM
+  0xFBF5: '\u0626\u06c8',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH YU FINAL FORM
+  0xFBF6: '\u0626\u06d0',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH E ISOLATED FORM
+  0xFBF7: '\u0626\u06d0',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH E FINAL FORM
+  0xFBF8: '\u0626\u06d0',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH E INITIAL FORM
+  0xFBF9: '\u0626\u0649',  # ARABIC LIGATURE UIGHUR KIRGHIZ YEH WITH HAMZA ABOVE WITH ALEF MAKSURA ISOLATED FORM
+  0xFBFA: '\u0626\u0649',  # ARABIC LIGATURE UIGHUR KIRGHIZ YEH WITH HAMZA ABOVE WITH ALEF MAKSURA FINAL FORM
+  0xFBFB: '\u0626\u0649',  # ARABIC LIGATURE UIGHUR KIRGHIZ YEH WITH HAMZA ABOVE WITH ALEF MAKSURA INITIAL FORM
+  0xFBFC: '\u06cc',  # ARABIC LETTER FARSI YEH ISOLATED FORM
+  0xFBFD: '\u06cc',  # ARABIC LETTER FARSI YEH FINAL FORM
+  0xFBFE: '\u06cc',  # ARABIC LETTER FARSI YEH INITIAL FORM
+  0xFBFF: '\u06cc',  # ARABIC LETTER FARSI YEH MEDIAL FORM
+  0xFC00: '\u0626\u062c',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH JEEM ISOLATED FORM
+  0xFC01: '\u0626\u062d',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH HAH ISOLATED FORM
+  0xFC02: '\u0626\u0645',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH MEEM ISOLATED FORM
+  0xFC03: '\u0626\u0649',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH ALEF MAKSURA ISOLATED FORM
+  0xFC04: '\u0626\u064a',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH YEH ISOLATED FORM
+  0xFC05: '\u0628\u062c',  # ARABIC LIGATURE BEH WITH JEEM ISOLATED FORM
+  0xFC06: '\u0628\u062d',  # ARABIC LIGATURE BEH WITH HAH ISOLATED FORM
+  0xFC07: '\u0628\u062e',  # ARABIC LIGATURE BEH WITH KHAH ISOLATED FORM
+  0xFC08: '\u0628\u0645',  # ARABIC LIGATURE BEH WITH MEEM ISOLATED FORM
+  0xFC09: '\u0628\u0649',  # ARABIC LIGATURE BEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC0A: '\u0628\u064a',  # ARABIC LIGATURE BEH WITH YEH ISOLATED FORM
+  0xFC0B: '\u062a\u062c',  # ARABIC LIGATURE TEH WITH JEEM ISOLATED FORM
+  0xFC0C: '\u062a\u062d',  # ARABIC LIGATURE TEH WITH HAH ISOLATED FORM
+  0xFC0D: '\u062a\u062e',  # ARABIC LIGATURE TEH WITH KHAH ISOLATED FORM
+  0xFC0E: '\u062a\u0645',  # ARABIC LIGATURE TEH WITH MEEM ISOLATED FORM
+  0xFC0F: '\u062a\u0649',  # ARABIC LIGATURE TEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC10: '\u062a\u064a',  # ARABIC LIGATURE TEH WITH YEH ISOLATED FORM
+  0xFC11: '\u062b\u062c',  # ARABIC LIGATURE THEH WITH JEEM ISOLATED FORM
+  0xFC12: '\u062b\u0645',  # ARABIC LIGATURE THEH WITH MEEM ISOLATED FORM
+  0xFC13: '\u062b\u0649',  # ARABIC LIGATURE THEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC14: '\u062b\u064a',  # ARABIC LIGATURE THEH WITH YEH ISOLATED FORM
+  0xFC15: '\u062c\u062d',  # ARABIC LIGATURE JEEM WITH HAH ISOLATED FORM
+  0xFC16: '\u062c\u0645',  # ARABIC LIGATURE JEEM WITH MEEM ISOLATED FORM
+  0xFC17: '\u062d\u062c',  # ARABIC LIGATURE HAH WITH JEEM ISOLATED FORM
+  0xFC18: '\u062d\u0645',  # ARABIC LIGATURE HAH WITH MEEM ISOLATED FORM
+  0xFC19: '\u062e\u062c',  # ARABIC LIGATURE KHAH WITH JEEM ISOLATED FORM
+  0xFC1A: '\u062e\u062d',  # ARABIC LIGATURE KHAH WITH HAH ISOLATED FORM
+  0xFC1B: '\u062e\u0645',  # ARABIC LIGATURE KHAH WITH MEEM ISOLATED FORM
+  0xFC1C: '\u0633\u062c',  # ARABIC LIGATURE SEEN WITH JEEM ISOLATED FORM
+  0xFC1D: '\u0633\u062d',  # ARABIC LIGATURE SEEN WITH HAH ISOLATED FORM
+  0xFC1E: '\u0633\u062e',  # ARABIC LIGATURE SEEN WITH KHAH ISOLATED FORM
+  0xFC1F: '\u0633\u0645',  # ARABIC LIGATURE SEEN WITH MEEM ISOLATED FORM
+  0xFC20: '\u0635\u062d',  # ARABIC LIGATURE SAD WITH HAH ISOLATED FORM
+  0xFC21: '\u0635\u0645',  # ARABIC LIGATURE SAD WITH MEEM ISOLATED FORM
+  0xFC22: '\u0636\u062c',  # ARABIC LIGATURE DAD WITH JEEM ISOLATED FORM
+  0xFC23: '\u0636\u062d',  # ARABIC LIGATURE DAD WITH HAH ISOLATED FORM
+  0xFC24: '\u0636\u062e',  # ARABIC LIGATURE DAD WITH KHAH ISOLATED FORM
+  0xFC25: '\u0636\u0645',  # ARABIC LIGATURE DAD WITH MEEM ISOLATED FORM
+  0xFC26: '\u0637\u062d',  # ARABIC LIGATURE TAH WITH HAH ISOLATED FORM
+  0xFC27: '\u0637\u0645',  # ARABIC LIGATURE TAH WITH MEEM ISOLATED FORM
+  0xFC28: '\u0638\u0645',  # ARABIC LIGATURE ZAH WITH MEEM ISOLATED FORM
+  0xFC29: '\u0639\u062c',  # ARABIC LIGATURE AIN WITH JEEM ISOLATED FORM
+  0xFC2A: '\u0639\u0645',  # ARABIC LIGATURE AIN WITH MEEM ISOLATED FORM
+  0xFC2B: '\u063a\u062c',  # ARABIC LIGATURE GHAIN WITH JEEM ISOLATED FORM
+  0xFC2C: '\u063a\u0645',  # ARABIC LIGATURE GHAIN WITH MEEM ISOLATED FORM
+  0xFC2D: '\u0641\u062c',  # ARABIC LIGATURE FEH WITH JEEM ISOLATED FORM
+  0xFC2E: '\u0641\u062d',  # ARABIC LIGATURE FEH WITH HAH ISOLATED FORM
+  0xFC2F: '\u0641\u062e',  # ARABIC LIGATURE FEH WITH KHAH ISOLATED FORM
+  0xFC30: '\u0641\u0645',  # ARABIC LIGATURE FEH WITH MEEM ISOLATED FORM
+  0xFC31: '\u0641\u0649',  # ARABIC LIGATURE FEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC32: '\u0641\u064a',  # ARABIC LIGATURE FEH WITH YEH ISOLATED FORM
+  0xFC33: '\u0642\u062d',  # ARABIC LIGATURE QAF WITH HAH ISOLATED FORM
+  0xFC34: '\u0642\u0645',  # ARABIC LIGATURE QAF WITH MEEM ISOLATED FORM
+  0xFC35: '\u0642\u0649',  # ARABIC LIGATURE QAF WITH ALEF MAKSURA ISOLATED FORM
+  0xFC36: '\u0642\u064a',  # ARABIC LIGATURE QAF WITH YEH ISOLATED FORM
+  0xFC37: '\u0643\u0627',  # ARABIC LIGATURE KAF WITH ALEF ISOLATED FORM
+  0xFC38: '\u0643\u062c',  # ARABIC LIGATURE KAF WITH JEEM ISOLATED FORM
+  0xFC39: '\u0643\u062d',  # ARABIC LIGATURE KAF WITH HAH ISOLATED FORM
+  0xFC3A: '\u0643\u062e',  # ARABIC LIGATURE KAF WITH KHAH ISOLATED FORM
+  0xFC3B: '\u0643\u0644',  # ARABIC LIGATURE KAF WITH LAM ISOLATED FORM
+  0xFC3C: '\u0643\u0645',  # ARABIC LIGATURE KAF WITH MEEM ISOLATED FORM
+  0xFC3D: '\u0643\u0649',  # ARABIC LIGATURE KAF WITH ALEF MAKSURA ISOLATED FORM
+  0xFC3E: '\u0643\u064a',  # ARABIC LIGATURE KAF WITH YEH ISOLATED FORM
+  0xFC3F: '\u0644\u062c',  # ARABIC LIGATURE LAM WITH JEEM ISOLATED FORM
+  0xFC40: '\u0644\u062d',  # ARABIC LIGATURE LAM WITH HAH ISOLATED FORM
+  0xFC41: '\u0644\u062e',  # ARABIC LIGATURE LAM WITH KHAH ISOLATED FORM
+  0xFC42: '\u0644\u0645',  # ARABIC LIGATURE LAM WITH MEEM ISOLATED FORM
+  0xFC43: '\u0644\u0649',  # ARABIC LIGATURE LAM WITH ALEF MAKSURA ISOLATED FORM
+  0xFC44: '\u0644\u064a',  # ARABIC LIGATURE LAM WITH YEH ISOLATED FORM
+  0xFC45: '\u0645\u062c',  # ARABIC LIGATURE MEEM WITH JEEM ISOLATED FORM
+  0xFC46: '\u0645\u062d',  # ARABIC LIGATURE MEEM WITH HAH ISOLATED FORM
+  0xFC47: '\u0645\u062e',  # ARABIC LIGATURE MEEM WITH KHAH ISOLATED FORM
+  0xFC48: '\u0645\u0645',  # ARABIC LIGATURE MEEM WITH MEEM ISOLATED FORM
+  0xFC49: '\u0645\u0649',  # ARABIC LIGATURE MEEM WITH ALEF MAKSURA ISOLATED FORM
+  0xFC4A: '\u0645\u064a',  # ARABIC LIGATURE MEEM WITH YEH ISOLATED FORM
+  0xFC4B: '\u0646\u062c',  # ARABIC LIGATURE NOON WITH JEEM ISOLATED FORM
+  0xFC4C: '\u0646\u062d',  # ARABIC LIGATURE NOON WITH HAH ISOLATED FORM
+  0xFC4D: '\u0646\u062e',  # ARABIC LIGATURE NOON WITH KHAH ISOLATED FORM
+  0xFC4E: '\u0646\u0645',  # ARABIC LIGATURE NOON WITH MEEM ISOLATED FORM
+  0xFC4F: '\u0646\u0649',  # ARABIC LIGATURE NOON WITH ALEF MAKSURA ISOLATED FORM
+  0xFC50: '\u0646\u064a',  # ARABIC LIGATURE NOON WITH YEH ISOLATED FORM
+  0xFC51: '\u0647\u062c',  # ARABIC LIGATURE HEH WITH JEEM ISOLATED FORM
+  0xFC52: '\u0647\u0645',  # ARABIC LIGATURE HEH WITH MEEM ISOLATED FORM
+  0xFC53: '\u0647\u0649',  # ARABIC LIGATURE HEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC54: '\u0647\u064a',  # ARABIC LIGATURE HEH WITH YEH ISOLATED FORM
+  0xFC55: '\u064a\u062c',  # ARABIC LIGATURE YEH WITH JEEM ISOLATED FORM
+  0xFC56: '\u064a\u062d',  # ARABIC LIGATURE YEH WITH HAH ISOLATED FORM
+  0xFC57: '\u064a\u062e',  # ARABIC LIGATURE YEH WITH KHAH ISOLATED FORM
+  0xFC58: '\u064a\u0645',  # ARABIC LIGATURE YEH WITH MEEM ISOLATED FORM
+  0xFC59: '\u064a\u0649',  # ARABIC LIGATURE YEH WITH ALEF MAKSURA ISOLATED FORM
+  0xFC5A: '\u064a\u064a',  # ARABIC LIGATURE YEH WITH YEH ISOLATED FORM
+  0xFC5B: '\u0630\u0670',  # ARABIC LIGATURE THAL WITH SUPERSCRIPT ALEF ISOLATED FORM
+  0xFC5C: '\u0631\u0670',  # ARABIC LIGATURE REH WITH SUPERSCRIPT ALEF ISOLATED FORM
+  0xFC5D: '\u0649\u0670',  # ARABIC LIGATURE ALEF MAKSURA WITH SUPERSCRIPT ALEF ISOLATED FORM
+  0xFC5E: ' \u064c\u0651',  # ARABIC LIGATURE SHADDA WITH DAMMATAN ISOLATED FORM
+  0xFC5F: ' \u064d\u0651',  # ARABIC LIGATURE SHADDA WITH KASRATAN ISOLATED FORM
+  0xFC60: ' \u064e\u0651',  # ARABIC LIGATURE SHADDA WITH FATHA ISOLATED FORM
+  0xFC61: ' \u064f\u0651',  # ARABIC LIGATURE SHADDA WITH DAMMA ISOLATED FORM
+  0xFC62: ' \u0650\u0651',  # ARABIC LIGATURE SHADDA WITH KASRA ISOLATED FORM
+  0xFC63: ' \u0651\u0670',  # ARABIC LIGATURE SHADDA WITH SUPERSCRIPT ALEF ISOLATED FORM
+  0xFC64: '\u0626\u0631',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH REH FINAL FORM
+  0xFC65: '\u0626\u0632',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH ZAIN FINAL FORM
+  0xFC66: '\u0626\u0645',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH MEEM FINAL FORM
+  0xFC67: '\u0626\u0646',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH NOON FINAL FORM
+  0xFC68: '\u0626\u0649',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH ALEF MAKSURA FINAL FORM
+  0xFC69: '\u0626\u064a',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH YEH FINAL FORM
+  0xFC6A: '\u0628\u0631',  # ARABIC LIGATURE BEH WITH REH FINAL FORM
+  0xFC6B: '\u0628\u0632',  # ARABIC LIGATURE BEH WITH ZAIN FINAL FORM
+  0xFC6C: '\u0628\u0645',  # ARABIC LIGATURE BEH WITH MEEM FINAL FORM
+  0xFC6D: '\u0628\u0646',  # ARABIC LIGATURE BEH WITH NOON FINAL FORM
+  0xFC6E: '\u0628\u0649',  # ARABIC LIGATURE BEH WITH ALEF MAKSURA FINAL FORM
+  0xFC6F: '\u0628\u064a',  # ARABIC LIGATURE BEH WITH YEH FINAL FORM
+  0xFC70: '\u062a\u0631',  # ARABIC LIGATURE TEH WITH REH FINAL FORM
+  0xFC71: '\u062a\u0632',  # ARABIC LIGATURE TEH WITH ZAIN FINAL FORM
+  0xFC72: '\u062a\u0645',  # ARABIC LIGATURE TEH WITH MEEM FINAL FORM
+  0xFC73: '\u062a\u0646',  # ARABIC LIGATURE TEH WITH NOON FINAL FORM
+  0xFC74: '\u062a\u0649',  # ARABIC LIGATURE TEH WITH ALEF MAKSURA FINAL FORM
+  0xFC75: '\u062a\u064a',  # ARABIC LIGATURE TEH WITH YEH FINAL FORM
+  0xFC76: '\u062b\u0631',  # ARABIC LIGATURE THEH WITH REH FINAL FORM
+  0xFC77: '\u062b\u0632',  # ARABIC LIGATURE THEH WITH ZAIN FINAL FORM
+  0xFC78: '\u062b\u0645',  # ARABIC LIGATURE THEH WITH MEEM FINAL FORM
+  0xFC79: '\u062b\u0646',  # ARABIC LIGATURE THEH WITH NOON FINAL FORM
+  0xFC7A: '\u062b\u0649',  # ARABIC LIGATURE THEH WITH ALEF MAKSURA FINAL FORM
+  0xFC7B: '\u062b\u064a',  # ARABIC LIGATURE THEH WITH YEH FINAL FORM
+  0xFC7C: '\u0641\u0649',  # ARABIC LIGATURE FEH WITH ALEF MAKSURA FINAL FORM
+  0xFC7D: '\u0641\u064a',  # ARABIC LIGATURE FEH WITH YEH FINAL FORM
+  0xFC7E: '\u0642\u0649',  # ARABIC LIGATURE QAF WITH ALEF MAKSURA FINAL FORM
+  0xFC7F: '\u0642\u064a',  # ARABIC LIGATURE QAF WITH YEH FINAL FORM
+  0xFC80: '\u0643\u0627',  # ARABIC LIGATURE KAF WITH ALEF FINAL FORM
+  0xFC81: '\u0643\u0644',  # ARABIC LIGATURE KAF WITH LAM FINAL FORM
+  0xFC82: '\u0643\u0645',  # ARABIC LIGATURE KAF WITH MEEM FINAL FORM
+  0xFC83: '\u0643\u0649',  # ARABIC LIGATURE KAF WITH ALEF MAKSURA FINAL FORM
+  0xFC84: '\u0643\u064a',  # ARABIC LIGATURE KAF WITH YEH FINAL FORM
+  0xFC85: '\u0644\u0645',  # ARABIC LIGATURE LAM WITH MEEM FINAL FORM
+  0xFC86: '\u0644\u0649',  # ARABIC LIGATURE LAM WITH ALEF MAKSURA FINAL FORM
+  0xFC87: '\u0644\u064a',  # ARABIC LIGATURE LAM WITH YEH FINAL FORM
+  0xFC88: '\u0645\u0627',  # ARABIC LIGATURE MEEM WITH ALEF FINAL FORM
+  0xFC89: '\u0645\u0645',  # ARABIC LIGATURE MEEM WITH MEEM FINAL FORM
+  0xFC8A: '\u0646\u0631',  # ARABIC LIGATURE NOON WITH REH FINAL FORM
+  0xFC8B: '\u0646\u0632',  # ARABIC LIGATURE NOON WITH ZAIN FINAL FORM
+  0xFC8C: '\u0646\u0645',  # ARABIC LIGATURE NOON WITH MEEM FINAL FORM
+  0xFC8D: '\u0646\u0646',  # ARABIC LIGATURE NOON WITH NOON FINAL FORM
+  0xFC8E: '\u0646\u0649',  # ARABIC LIGATURE NOON WITH ALEF MAKSURA FINAL FORM
+  0xFC8F: '\u0646\u064a',  # ARABIC LIGATURE NOON WITH YEH FINAL FORM
+  0xFC90: '\u0649\u0670',  # ARABIC LIGATURE ALEF MAKSURA WITH SUPERSCRIPT ALEF FINAL FORM
+  0xFC91: '\u064a\u0631',  # ARABIC LIGATURE YEH WITH REH FINAL FORM
+  0xFC92: '\u064a\u0632',  # ARABIC LIGATURE YEH WITH ZAIN FINAL FORM
+  0xFC93: '\u064a\u0645',  # ARABIC LIGATURE YEH WITH MEEM FINAL FORM
+  0xFC94: '\u064a\u0646',  # ARABIC LIGATURE YEH WITH NOON FINAL FORM
+  0xFC95: '\u064a\u0649',  # ARABIC LIGATURE YEH WITH ALEF MAKSURA FINAL FORM
+  0xFC96: '\u064a\u064a',  # ARABIC LIGATURE YEH WITH YEH FINAL FORM
+  0xFC97: '\u0626\u062c',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH JEEM INITIAL FORM
+  0xFC98: '\u0626\u062d',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH HAH INITIAL FORM
+  0xFC99: '\u0626\u062e',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH KHAH INITIAL FORM
+  0xFC9A: '\u0626\u0645',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH MEEM INITIAL FORM
+  0xFC9B: '\u0626\u0647',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH HEH INITIAL FORM
+  0xFC9C: '\u0628\u062c',  # ARABIC LIGATURE BEH WITH JEEM INITIAL FORM
+  0xFC9D: '\u0628\u062d',  # ARABIC LIGATURE BEH WITH HAH INITIAL FORM
+  0xFC9E: '\u0628\u062e',  # ARABIC LIGATURE BEH WITH KHAH INITIAL FORM
+  0xFC9F: '\u0628\u0645',  # ARABIC LIGATURE BEH WITH MEEM INITIAL FORM
+  0xFCA0: '\u0628\u0647',  # ARABIC LIGATURE BEH WITH HEH INITIAL FORM
+  0xFCA1: '\u062a\u062c',  # ARABIC LIGATURE TEH WITH JEEM INITIAL FORM
+  0xFCA2: '\u062a\u062d',  # ARABIC LIGATURE TEH WITH HAH INITIAL FORM
+  0xFCA3: '\u062a\u062e',  # ARABIC LIGATURE TEH WITH KHAH INITIAL FORM
+  0xFCA4: '\u062a\u0645',  # ARABIC LIGATURE TEH WITH MEEM INITIAL FORM
+  0xFCA5: '\u062a\u0647',  # ARABIC LIGATURE TEH WITH HEH INITIAL FORM
+  0xFCA6: '\u062b\u0645',  # ARABIC LIGATURE THEH WITH MEEM INITIAL FORM
+  0xFCA7: '\u062c\u062d',  # ARABIC LIGATURE JEEM WITH HAH INITIAL FORM
+  0xFCA8: '\u062c\u0645',  # ARABIC LIGATURE JEEM WITH MEEM INITIAL FORM
+  0xFCA9: '\u062d\u062c',  # ARABIC LIGATURE HAH WITH JEEM INITIAL FORM
+  0xFCAA: '\u062d\u0645',  # ARABIC LIGATURE HAH WITH MEEM INITIAL FORM
+  0xFCAB: '\u062e\u062c',  # ARABIC LIGATURE KHAH WITH JEEM INITIAL FORM
+  0xFCAC: '\u062e\u0645',  # ARABIC LIGATURE KHAH WITH MEEM INITIAL FORM
+  0xFCAD: '\u0633\u062c',  # ARABIC LIGATURE SEEN WITH JEEM INITIAL FORM
+  0xFCAE: '\u0633\u062d',  # ARABIC LIGATURE SEEN WITH HAH INITIAL FORM
+  0xFCAF: '\u0633\u062e',  # ARABIC LIGATURE SEEN WITH KHAH INITIAL FORM
+  0xFCB0: '\u0633\u0645',  # ARABIC LIGATURE SEEN WITH MEEM INITIAL FORM
+  0xFCB1: '\u0635\u062d',  # ARABIC LIGATURE SAD WITH HAH INITIAL FORM
+  0xFCB2: '\u0635\u062e',  # ARABIC LIGATURE SAD WITH KHAH INITIAL FORM
+  0xFCB3: '\u0635\u0645',  # ARABIC LIGATURE SAD WITH MEEM INITIAL FORM
+  0xFCB4: '\u0636\u062c',  # ARABIC LIGATURE DAD WITH JEEM INITIAL FORM
+  0xFCB5: '\u0636\u062d',  # ARABIC LIGATURE DAD WITH HAH INITIAL FORM
+  0xFCB6: '\u0636\u062e',  # ARABIC LIGATURE DAD WITH KHAH INITIAL FORM
+  0xFCB7: '\u0636\u0645',  # ARABIC LIGATURE DAD WITH MEEM INITIAL FORM
+  0xFCB8: '\u0637\u062d',  # ARABIC LIGATURE TAH WITH HAH INITIAL FORM
+  0xFCB9: '\u0638\u0645',  # ARABIC LIGATURE ZAH WITH MEEM INITIAL FORM
+  0xFCBA: '\u0639\u062c',  # ARABIC LIGATURE AIN WITH JEEM INITIAL FORM
+  0xFCBB: '\u0639\u0645',  # ARABIC LIGATURE AIN WITH MEEM INITIAL FORM
+  0xFCBC: '\u063a\u062c',  # ARABIC LIGATURE GHAIN WITH JEEM INITIAL FORM
+  0xFCBD: '\u063a\u0645',  # ARABIC LIGATURE GHAIN WITH MEEM INITIAL FORM
+  0xFCBE: '\u0641\u062c',  # ARABIC LIGATURE FEH WITH JEEM INITIAL FORM
+  0xFCBF: '\u0641\u062d',  # ARABIC LIGATURE FEH WITH HAH INITIAL FORM
+  0xFCC0: '\u0641\u062e',  # ARABIC LIGATURE FEH WITH KHAH INITIAL FORM
+  0xFCC1: '\u0641\u0645',  # ARABIC LIGATURE FEH WITH MEEM INITIAL FORM
+  0xFCC2: '\u0642\u062d',  # ARABIC LIGATURE QAF WITH HAH INITIAL FORM
+  0xFCC3: '\u0642\u0645',  # ARABIC LIGATURE QAF WITH MEEM INITIAL FORM
+  0xFCC4: '\u0643\u062c',  # ARABIC LIGATURE KAF WITH JEEM INITIAL FORM
+  0xFCC5: '\u0643\u062d',  # ARABIC LIGATURE KAF WITH HAH INITIAL FORM
+  0xFCC6: '\u0643\u062e',  # ARABIC LIGATURE KAF WITH KHAH INITIAL FORM
+  0xFCC7: '\u0643\u0644',  # ARABIC LIGATURE KAF WITH LAM INITIAL FORM
+  0xFCC8: '\u0643\u0645',  # ARABIC LIGATURE KAF WITH MEEM INITIAL FORM
+  0xFCC9: '\u0644\u062c',  # ARABIC LIGATURE LAM WITH JEEM INITIAL FORM
+  0xFCCA: '\u0644\u062d',  # ARABIC LIGATURE LAM WITH HAH INITIAL FORM
+  0xFCCB: '\u0644\u062e',  # ARABIC LIGATURE LAM WITH KHAH INITIAL FORM
+  0xFCCC: '\u0644\u0645',  # ARABIC LIGATURE LAM WITH MEEM INITIAL FORM
+  0xFCCD: '\u0644\u0647',  # ARABIC LIGATURE LAM WITH HEH INITIAL FORM
+  0xFCCE: '\u0645\u062c',  # ARABIC LIGATURE MEEM WITH JEEM INITIAL FORM
+  0xFCCF: '\u0645\u062d',  # ARABIC LIGATURE MEEM WITH HAH INITIAL FORM
+  0xFCD0: '\u0645\u062e',  # ARABIC LIGATURE MEEM WITH KHAH INITIAL FORM
+  0xFCD1: '\u0645\u0645',  # ARABIC LIGATURE MEEM WITH MEEM INITIAL FORM
+  0xFCD2: '\u0646\u062c',  # ARABIC LIGATURE NOON WITH JEEM INITIAL FORM
+  0xFCD3: '\u0646\u062d',  # ARABIC LIGATURE NOON WITH HAH INITIAL FORM
+  0xFCD4: '\u0646\u062e',  # ARABIC LIGATURE NOON WITH KHAH INITIAL FORM
+  0xFCD5: '\u0646\u0645',  # ARABIC LIGATURE NOON WITH MEEM INITIAL FORM
+  0xFCD6: '\u0646\u0647',  # ARABIC LIGATURE NOON WITH HEH INITIAL FORM
+  0xFCD7: '\u0647\u062c',  # ARABIC LIGATURE HEH WITH JEEM INITIAL FORM
+  0xFCD8: '\u0647\u0645',  # ARABIC LIGATURE HEH WITH MEEM INITIAL FORM
+  0xFCD9: '\u0647\u0670',  # ARABIC LIGATURE HEH WITH SUPERSCRIPT ALEF INITIAL FORM
+  0xFCDA: '\u064a\u062c',  # ARABIC LIGATURE YEH WITH JEEM INITIAL FORM
+  0xFCDB: '\u064a\u062d',  # ARABIC LIGATURE YEH WITH HAH INITIAL FORM
+  0xFCDC: '\u064a\u062e',  # ARABIC LIGATURE YEH WITH KHAH INITIAL FORM
+  0xFCDD: '\u064a\u0645',  # ARABIC LIGATURE YEH WITH MEEM INITIAL FORM
+  0xFCDE: '\u064a\u0647',  # ARABIC LIGATURE YEH WITH HEH INITIAL FORM
+  0xFCDF: '\u0626\u0645',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH MEEM MEDIAL FORM
+  0xFCE0: '\u0626\u0647',  # ARABIC LIGATURE YEH WITH HAMZA ABOVE WITH HEH MEDIAL FORM
+  0xFCE1: '\u0628\u0645',  # ARABIC LIGATURE BEH WITH MEEM MEDIAL FORM
+  0xFCE2: '\u0628\u0647',  # ARABIC LIGATURE BEH WITH HEH MEDIAL FORM
+  0xFCE3: '\u062a\u0645',  # ARABIC LIGATURE TEH WITH MEEM MEDIAL FORM
+  0xFCE4: '\u062a\u0647',  # ARABIC LIGATURE TEH WITH HEH MEDIAL FORM
+  0xFCE5: '\u062b\u0645',  # ARABIC LIGATURE THEH WITH MEEM MEDIAL FORM
+  0xFCE6: '\u062b\u0647',  # ARABIC LIGATURE THEH WITH HEH MEDIAL FORM
+  0xFCE7: '\u0633\u0645',  # ARABIC LIGATURE SEEN WITH MEEM MEDIAL FORM
+  0xFCE8: '\u0633\u0647',  # ARABIC LIGATURE SEEN WITH HEH MEDIAL FORM
+  0xFCE9: '\u0634\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM MEDIAL FORM
+  0xFCEA: '\u0634\u0647',  # ARABIC LIGATURE SHEEN WITH HEH MEDIAL FORM
+  0xFCEB: '\u0643\u0644',  # ARABIC LIGATURE KAF WITH LAM MEDIAL FORM
+  0xFCEC: '\u0643\u0645',  # ARABIC LIGATURE KAF WITH MEEM MEDIAL FORM
+  0xFCED: '\u0644\u0645',  # ARABIC LIGATURE LAM WITH MEEM MEDIAL FORM
+  0xFCEE: '\u0646\u0645',  # ARABIC LIGATURE NOON WITH MEEM MEDIAL FORM
+  0xFCEF: '\u0646\u0647',  # ARABIC LIGATURE NOON WITH HEH MEDIAL FORM
+  0xFCF0: '\u064a\u0645',  # ARABIC LIGATURE YEH WITH MEEM MEDIAL FORM
+  0xFCF1: '\u064a\u0647',  # ARABIC LIGATURE YEH WITH HEH MEDIAL FORM
+  0xFCF2: '\u0640\u064e\u0651',  # ARABIC LIGATURE SHADDA WITH FATHA MEDIAL FORM
+  0xFCF3: '\u0640\u064f\u0651',  # ARABIC LIGATURE SHADDA WITH DAMMA MEDIAL FORM
+  0xFCF4: '\u0640\u0650\u0651',  # ARABIC LIGATURE SHADDA WITH KASRA MEDIAL FORM
+  0xFCF5: '\u0637\u0649',  # ARABIC LIGATURE TAH WITH ALEF MAKSURA ISOLATED FORM
+  0xFCF6: '\u0637\u064a',  # ARABIC LIGATURE TAH WITH YEH ISOLATED FORM
+  0xFCF7: '\u0639\u0649',  # ARABIC LIGATURE AIN WITH ALEF MAKSURA ISOLATED FORM
+  0xFCF8: '\u0639\u064a',  # ARABIC LIGATURE AIN WITH YEH ISOLATED FORM
+  0xFCF9: '\u063a\u0649',  # ARABIC LIGATURE GHAIN WITH ALEF MAKSURA ISOLATED FORM
+  0xFCFA: '\u063a\u064a',  # ARABIC LIGATURE GHAIN WITH YEH ISOLATED FORM
+  0xFCFB: '\u0633\u0649',  # ARABIC LIGATURE SEEN WITH ALEF MAKSURA ISOLATED FORM
+  0xFCFC: '\u0633\u064a',  # ARABIC LIGATURE SEEN WITH YEH ISOLATED FORM
+  0xFCFD: '\u0634\u0649',  # ARABIC LIGATURE SHEEN WITH ALEF MAKSURA ISOLATED FORM
+  0xFCFE: '\u0634\u064a',  # ARABIC LIGATURE SHEEN WITH YEH ISOLATED FORM
+  0xFCFF: '\u062d\u0649',  # ARABIC LIGATURE HAH WITH ALEF MAKSURA ISOLATED FORM
+  0xFD00: '\u062d\u064a',  # ARABIC LIGATURE HAH WITH YEH ISOLATED FORM
+  0xFD01: '\u062c\u0649',  # ARABIC LIGATURE JEEM WITH ALEF MAKSURA ISOLATED FORM
+  0xFD02: '\u062c\u064a',  # ARABIC LIGATURE JEEM WITH YEH ISOLATED FORM
+  0xFD03: '\u062e\u0649',  # ARABIC LIGATURE KHAH WITH ALEF MAKSURA ISOLATED FORM
+  0xFD04: '\u062e\u064a',  # ARABIC LIGATURE KHAH WITH YEH ISOLATED FORM
+  0xFD05: '\u0635\u0649',  # ARABIC LIGATURE SAD WITH ALEF MAKSURA ISOLATED FORM
+  0xFD06: '\u0635\u064a',  # ARABIC LIGATURE SAD WITH YEH ISOLATED FORM
+  0xFD07: '\u0636\u0649',  # ARABIC LIGATURE DAD WITH ALEF MAKSURA ISOLATED FORM
+  0xFD08: '\u0636\u064a',  # ARABIC LIGATURE DAD WITH YEH ISOLATED FORM
+  0xFD09: '\u0634\u062c',  # ARABIC LIGATURE SHEEN WITH JEEM ISOLATED FORM
+  0xFD0A: '\u0634\u062d',  # ARABIC LIGATURE SHEEN WITH HAH ISOLATED FORM
+  0xFD0B: '\u0634\u062e',  # ARABIC LIGATURE SHEEN WITH KHAH ISOLATED FORM
+  0xFD0C: '\u0634\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM ISOLATED FORM
+  0xFD0D: '\u0634\u0631',  # ARABIC LIGATURE SHEEN WITH REH ISOLATED FORM
+  0xFD0E: '\u0633\u0631',  # ARABIC LIGATURE SEEN WITH REH ISOLATED FORM
+  0xFD0F: '\u0635\u0631',  # ARABIC LIGATURE SAD WITH REH ISOLATED FORM
+  0xFD10: '\u0636\u0631',  # ARABIC LIGATURE DAD WITH REH ISOLATED FORM
+  0xFD11: '\u0637\u0649',  # ARABIC LIGATURE TAH WITH ALEF MAKSURA FINAL FORM
+  0xFD12: '\u0637\u064a',  # ARABIC LIGATURE TAH WITH YEH FINAL FORM
+  0xFD13: '\u0639\u0649',  # ARABIC LIGATURE AIN WITH ALEF MAKSURA FINAL FORM
+  0xFD14: '\u0639\u064a',  # ARABIC LIGATURE AIN WITH YEH FINAL FORM
+  0xFD15: '\u063a\u0649',  # ARABIC LIGATURE GHAIN WITH ALEF MAKSURA FINAL FORM
+  0xFD16: '\u063a\u064a',  # ARABIC LIGATURE GHAIN WITH YEH FINAL FORM
+  0xFD17: '\u0633\u0649',  # ARABIC LIGATURE SEEN WITH ALEF MAKSURA FINAL FORM
+  0xFD18: '\u0633\u064a',  # ARABIC LIGATURE SEEN WITH YEH FINAL FORM
+  0xFD19: '\u0634\u0649',  # ARABIC LIGATURE SHEEN WITH ALEF MAKSURA FINAL FORM
+  0xFD1A: '\u0634\u064a',  # ARABIC LIGATURE SHEEN WITH YEH FINAL FORM
+  0xFD1B: '\u062d\u0649',  # ARABIC LIGATURE HAH WITH ALEF MAKSURA FINAL FORM
+  0xFD1C: '\u062d\u064a',  # ARABIC LIGATURE HAH WITH YEH FINAL FORM
+  0xFD1D: '\u062c\u0649',  # ARABIC LIGATURE JEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD1E: '\u062c\u064a',  # ARABIC LIGATURE JEEM WITH YEH FINAL FORM
+  0xFD1F: '\u062e\u0649',  # ARABIC LIGATURE KHAH WITH ALEF MAKSURA FINAL FORM
+  0xFD20: '\u062e\u064a',  # ARABIC LIGATURE KHAH WITH YEH FINAL FORM
+  0xFD21: '\u0635\u0649',  # ARABIC LIGATURE SAD WITH ALEF MAKSURA FINAL FORM
+  0xFD22: '\u0635\u064a',  # ARABIC LIGATURE SAD WITH YEH FINAL FORM
+  0xFD23: '\u0636\u0649',  # ARABIC LIGATURE DAD WITH ALEF MAKSURA FINAL FORM
+  0xFD24: '\u0636\u064a',  # ARABIC LIGATURE DAD WITH YEH FINAL FORM
+  0xFD25: '\u0634\u062c',  # ARABIC LIGATURE SHEEN WITH JEEM FINAL FORM
+  0xFD26: '\u0634\u062d',  # ARABIC LIGATURE SHEEN WITH HAH FINAL FORM
+  0xFD27: '\u0634\u062e',  # ARABIC LIGATURE SHEEN WITH KHAH FINAL FORM
+  0xFD28: '\u0634\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM FINAL FORM
+  0xFD29: '\u0634\u0631',  # ARABIC LIGATURE SHEEN WITH REH FINAL FORM
+  0xFD2A: '\u0633\u0631',  # ARABIC LIGATURE SEEN WITH REH FINAL FORM
+  0xFD2B: '\u0635\u0631',  # ARABIC LIGATURE SAD WITH REH FINAL FORM
+  0xFD2C: '\u0636\u0631',  # ARABIC LIGATURE DAD WITH REH FINAL FORM
+  0xFD2D: '\u0634\u062c',  # ARABIC LIGATURE SHEEN WITH JEEM INITIAL FORM
+  0xFD2E: '\u0634\u062d',  # ARABIC LIGATURE SHEEN WITH HAH INITIAL FORM
+  0xFD2F: '\u0634\u062e',  # ARABIC LIGATURE SHEEN WITH KHAH INITIAL FORM
+  0xFD30: '\u0634\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM INITIAL FORM
+  0xFD31: '\u0633\u0647',  # ARABIC LIGATURE SEEN WITH HEH INITIAL FORM
+  0xFD32: '\u0634\u0647',  # ARABIC LIGATURE SHEEN WITH HEH INITIAL FORM
+  0xFD33: '\u0637\u0645',  # ARABIC LIGATURE TAH WITH MEEM INITIAL FORM
+  0xFD34: '\u0633\u062c',  # ARABIC LIGATURE SEEN WITH JEEM MEDIAL FORM
+  0xFD35: '\u0633\u062d',  # ARABIC LIGATURE SEEN WITH HAH MEDIAL FORM
+  0xFD36: '\u0633\u062e',  # ARABIC LIGATURE SEEN WITH KHAH MEDIAL FORM
+  0xFD37: '\u0634\u062c',  # ARABIC LIGATURE SHEEN WITH JEEM MEDIAL FORM
+  0xFD38: '\u0634\u062d',  # ARABIC LIGATURE SHEEN WITH HAH MEDIAL FORM
+  0xFD39: '\u0634\u062e',  # ARABIC LIGATURE SHEEN WITH KHAH MEDIAL FORM
+  0xFD3A: '\u0637\u0645',  # ARABIC LIGATURE TAH WITH MEEM MEDIAL FORM
+  0xFD3B: '\u0638\u0645',  # ARABIC LIGATURE ZAH WITH MEEM MEDIAL FORM
+  0xFD3C: '\u0627\u064b',  # ARABIC LIGATURE ALEF WITH FATHATAN FINAL FORM
+  0xFD3D: '\u0627\u064b',  # ARABIC LIGATURE ALEF WITH FATHATAN ISOLATED FORM
+  0xFD50: '\u062a\u062c\u0645',  # ARABIC LIGATURE TEH WITH JEEM WITH MEEM INITIAL FORM
+  0xFD51: '\u062a\u062d\u062c',  # ARABIC LIGATURE TEH WITH HAH WITH JEEM FINAL FORM
+  0xFD52: '\u062a\u062d\u062c',  # ARABIC LIGATURE TEH WITH HAH WITH JEEM INITIAL FORM
+  0xFD53: '\u062a\u062d\u0645',  # ARABIC LIGATURE TEH WITH HAH WITH MEEM INITIAL FORM
+  0xFD54: '\u062a\u062e\u0645',  # ARABIC LIGATURE TEH WITH KHAH WITH MEEM INITIAL FORM
+  0xFD55: '\u062a\u0645\u062c',  # ARABIC LIGATURE TEH WITH MEEM WITH JEEM INITIAL FORM
+  0xFD56: '\u062a\u0645\u062d',  # ARABIC LIGATURE TEH WITH MEEM WITH HAH INITIAL FORM
+  0xFD57: '\u062a\u0645\u062e',  # ARABIC LIGATURE TEH WITH MEEM WITH KHAH INITIAL FORM
+  0xFD58: '\u062c\u0645\u062d',  # ARABIC LIGATURE JEEM WITH MEEM WITH HAH FINAL FORM
+  0xFD59: '\u062c\u0645\u062d',  # ARABIC LIGATURE JEEM WITH MEEM WITH HAH INITIAL FORM
+  0xFD5A: '\u062d\u0645\u064a',  # ARABIC LIGATURE HAH WITH MEEM WITH YEH FINAL FORM
+  0xFD5B: '\u062d\u0645\u0649',  # ARABIC LIGATURE HAH WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD5C: '\u0633\u062d\u062c',  # ARABIC LIGATURE SEEN WITH HAH WITH JEEM INITIAL FORM
+  0xFD5D: '\u0633\u062c\u062d',  # ARABIC LIGATURE SEEN WITH JEEM WITH HAH INITIAL FORM
+  0xFD5E: '\u0633\u062c\u0649',  # ARABIC LIGATURE SEEN WITH JEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD5F: '\u0633\u0645\u062d',  # ARABIC LIGATURE SEEN WITH MEEM WITH HAH FINAL FORM
+  0xFD60: '\u0633\u0645\u062d',  # ARABIC LIGATURE SEEN WITH MEEM WITH HAH INITIAL FORM
+  0xFD61: '\u0633\u0645\u062c',  # ARABIC LIGATURE SEEN WITH MEEM WITH JEEM INITIAL FORM
+  0xFD62: '\u0633\u0645\u0645',  # ARABIC LIGATURE SEEN WITH MEEM WITH MEEM FINAL FORM
+  0xFD63: '\u0633\u0645\u0645',  # ARABIC LIGATURE SEEN WITH MEEM WITH MEEM INITIAL FORM
+  0xFD64: '\u0635\u062d\u062d',  # ARABIC LIGATURE SAD WITH HAH WITH HAH FINAL FORM
+  0xFD65: '\u0635\u062d\u062d',  # ARABIC LIGATURE SAD WITH HAH WITH HAH INITIAL FORM
+  0xFD66: '\u0635\u0645\u0645',  # ARABIC LIGATURE SAD WITH MEEM WITH MEEM FINAL FORM
+  0xFD67: '\u0634\u062d\u0645',  # ARABIC LIGATURE SHEEN WITH HAH WITH MEEM FINAL FORM
+  0xFD68: '\u0634\u062d\u0645',  # ARABIC LIGATURE SHEEN WITH HAH WITH MEEM INITIAL FORM
+  0xFD69: '\u0634\u062c\u064a',  # ARABIC LIGATURE SHEEN WITH JEEM WITH YEH FINAL FORM
+  0xFD6A: '\u0634\u0645\u062e',  # ARABIC LIGATURE SHEEN WITH MEEM WITH KHAH FINAL FORM
+  0xFD6B: '\u0634\u0645\u062e',  # ARABIC LIGATURE SHEEN WITH MEEM WITH KHAH INITIAL FORM
+  0xFD6C: '\u0634\u0645\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM WITH MEEM FINAL FORM
+  0xFD6D: '\u0634\u0645\u0645',  # ARABIC LIGATURE SHEEN WITH MEEM WITH MEEM INITIAL FORM
+  0xFD6E: '\u0636\u062d\u0649',  # ARABIC LIGATURE DAD WITH HAH WITH ALEF MAKSURA FINAL FORM
+  0xFD6F: '\u0636\u062e\u0645',  # ARABIC LIGATURE DAD WITH KHAH WITH MEEM FINAL FORM
+  0xFD70: '\u0636\u062e\u0645',  # ARABIC LIGATURE DAD WITH KHAH WITH MEEM INITIAL FORM
+  0xFD71: '\u0637\u0645\u062d',  # ARABIC LIGATURE TAH WITH MEEM WITH HAH FINAL FORM
+  0xFD72: '\u0637\u0645\u062d',  # ARABIC LIGATURE TAH WITH MEEM WITH HAH INITIAL FORM
+  0xFD73: '\u0637\u0645\u0645',  # ARABIC LIGATURE TAH WITH MEEM WITH MEEM INITIAL FORM
+  0xFD74: '\u0637\u0645\u064a',  # ARABIC LIGATURE TAH WITH MEEM WITH YEH FINAL FORM
+  0xFD75: '\u0639\u062c\u0645',  # ARABIC LIGATURE AIN WITH JEEM WITH MEEM FINAL FORM
+  0xFD76: '\u0639\u0645\u0645',  # ARABIC LIGATURE AIN WITH MEEM WITH MEEM FINAL FORM
+  0xFD77: '\u0639\u0645\u0645',  # ARABIC LIGATURE AIN WITH MEEM WITH MEEM INITIAL FORM
+  0xFD78: '\u0639\u0645\u0649',  # ARABIC LIGATURE AIN WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD79: '\u063a\u0645\u0645',  # ARABIC LIGATURE GHAIN WITH MEEM WITH MEEM FINAL FORM
+  0xFD7A: '\u063a\u0645\u064a',  # ARABIC LIGATURE GHAIN WITH MEEM WITH YEH FINAL FORM
+  0xFD7B: '\u063a\u0645\u0649',  # ARABIC LIGATURE GHAIN WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD7C: '\u0641\u062e\u0645',  # ARABIC LIGATURE FEH WITH KHAH WITH MEEM FINAL FORM
+  0xFD7D: '\u0641\u062e\u0645',  # ARABIC LIGATURE FEH WITH KHAH WITH MEEM INITIAL FORM
+  0xFD7E: '\u0642\u0645\u062d',  # ARABIC LIGATURE QAF WITH MEEM WITH HAH FINAL FORM
+  0xFD7F: '\u0642\u0645\u0645',  # ARABIC LIGATURE QAF WITH MEEM WITH MEEM FINAL FORM
+  0xFD80: '\u0644\u062d\u0645',  # ARABIC LIGATURE LAM WITH HAH WITH MEEM FINAL FORM
+  0xFD81: '\u0644\u062d\u064a',  # ARABIC LIGATURE LAM WITH HAH WITH YEH FINAL FORM
+  0xFD82: '\u0644\u062d\u0649',  # ARABIC LIGATURE LAM WITH HAH WITH ALEF MAKSURA FINAL FORM
+  0xFD83: '\u0644\u062c\u062c',  # ARABIC LIGATURE LAM WITH JEEM WITH JEEM INITIAL FORM
+  0xFD84: '\u0644\u062c\u062c',  # ARABIC LIGATURE LAM WITH JEEM WITH JEEM FINAL FORM
+  0xFD85: '\u0644\u062e\u0645',  # ARABIC LIGATURE LAM WITH KHAH WITH MEEM FINAL FORM
+  0xFD86: '\u0644\u062e\u0645',  # ARABIC LIGATURE LAM WITH KHAH WITH MEEM INITIAL FORM
+  0xFD87: '\u0644\u0645\u062d',  # ARABIC LIGATURE LAM WITH MEEM WITH HAH FINAL FORM
+  0xFD88: '\u0644\u0645\u062d',  # ARABIC LIGATURE LAM WITH MEEM WITH HAH INITIAL FORM
+  0xFD89: '\u0645\u062d\u062c',  # ARABIC LIGATURE MEEM WITH HAH WITH JEEM INITIAL FORM
+  0xFD8A: '\u0645\u062d\u0645',  # ARABIC LIGATURE MEEM WITH HAH WITH MEEM INITIAL FORM
+  0xFD8B: '\u0645\u062d\u064a',  # ARABIC LIGATURE MEEM WITH HAH WITH YEH FINAL FORM
+  0xFD8C: '\u0645\u062c\u062d',  # ARABIC LIGATURE MEEM WITH JEEM WITH HAH INITIAL FORM
+  0xFD8D: '\u0645\u062c\u0645',  # ARABIC LIGATURE MEEM WITH JEEM WITH MEEM INITIAL FORM
+  0xFD8E: '\u0645\u062e\u062c',  # ARABIC LIGATURE MEEM WITH KHAH WITH JEEM INITIAL FORM
+  0xFD8F: '\u0645\u062e\u0645',  # ARABIC LIGATURE MEEM WITH KHAH WITH MEEM INITIAL FORM
+  0xFD92: '\u0645\u062c\u062e',  # ARABIC LIGATURE MEEM WITH JEEM WITH KHAH INITIAL FORM
+  0xFD93: '\u0647\u0645\u062c',  # ARABIC LIGATURE HEH WITH MEEM WITH JEEM INITIAL FORM
+  0xFD94: '\u0647\u0645\u0645',  # ARABIC LIGATURE HEH WITH MEEM WITH MEEM INITIAL FORM
+  0xFD95: '\u0646\u062d\u0645',  # ARABIC LIGATURE NOON WITH HAH WITH MEEM INITIAL FORM
+  0xFD96: '\u0646\u062d\u0649',  # ARABIC LIGATURE NOON WITH HAH WITH ALEF MAKSURA FINAL FORM
+  0xFD97: '\u0646\u062c\u0645',  # ARABIC LIGATURE NOON WITH JEEM WITH MEEM FINAL FORM
+  0xFD98: '\u0646\u062c\u0645',  # ARABIC LIGATURE NOON WITH JEEM WITH MEEM INITIAL FORM
+  0xFD99: '\u0646\u062c\u0649',  # ARABIC LIGATURE NOON WITH JEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD9A: '\u0646\u0645\u064a',  # ARABIC LIGATURE NOON WITH MEEM WITH YEH FINAL FORM
+  0xFD9B: '\u0646\u0645\u0649',  # ARABIC LIGATURE NOON WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFD9C: '\u064a\u0645\u0645',  # ARABIC LIGATURE YEH WITH MEEM WITH MEEM FINAL FORM
+  0xFD9D: '\u064a\u0645\u0645',  # ARABIC LIGATURE YEH WITH MEEM WITH MEEM INITIAL FORM
+  0xFD9E: '\u0628\u062e\u064a',  # ARABIC LIGATURE BEH WITH KHAH WITH YEH FINAL FORM
+  0xFD9F: '\u062a\u062c\u064a',  # ARABIC LIGATURE TEH WITH JEEM WITH YEH FINAL FORM
+  0xFDA0: '\u062a\u062c\u0649',  # ARABIC LIGATURE TEH WITH JEEM WITH ALEF MAKSURA FINAL FORM
+  0xFDA1: '\u062a\u062e\u064a',  # ARABIC LIGATURE TEH WITH KHAH WITH YEH FINAL FORM
+  0xFDA2: '\u062a\u062e\u0649',  # ARABIC LIGATURE TEH WITH KHAH WITH ALEF MAKSURA FINAL FORM
+  0xFDA3: '\u062a\u0645\u064a',  # ARABIC LIGATURE TEH WITH MEEM WITH YEH FINAL FORM
+  0xFDA4: '\u062a\u0645\u0649',  # ARABIC LIGATURE TEH WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFDA5: '\u062c\u0645\u064a',  # ARABIC LIGATURE JEEM WITH MEEM WITH YEH FINAL FORM
+  0xFDA6: '\u062c\u062d\u0649',  # ARABIC LIGATURE JEEM WITH HAH WITH ALEF MAKSURA FINAL FORM
+  0xFDA7: '\u062c\u0645\u0649',  # ARABIC LIGATURE JEEM WITH MEEM WITH ALEF MAKSURA FINAL FORM
+  0xFDA8: '\u0633\u062e\u0649',  # ARABIC LIGATURE SEEN WITH KHAH WITH ALEF MAKSURA FINAL FORM
+  0xFDA9: '\u0635\u062d\u064a',  # ARABIC LIGATURE SAD WITH HAH WITH YEH FINAL FORM
+  0xFDAA: '\u0634\u062d\u064a',  # ARABIC LIGATURE SHEEN WITH HAH WITH YEH FINAL FORM
+  0xFDAB: '\u0636\u062d\u064a',  # ARABIC LIGATURE DAD WITH HAH WITH YEH FINAL FORM
+  0xFDAC: '\u0644\u062c\u064a',  # ARABIC LIGATURE LAM WITH JEEM WITH YEH FINAL FORM
+  0xFDAD: '\u0644\u0645\u064a',  # ARABIC LIGATURE LAM WITH MEEM WITH YEH FINAL FORM
+  0xFDAE: '\u064a\u062d\u064a',  # ARABIC LIGATURE YEH WITH HAH WITH YEH FINAL FORM
+  0xFDAF: '\u064a\u062c\u064a',  # ARABIC LIGATURE YEH WITH JEEM WITH YEH FINAL FORM
+  0xFDB0: '\u064a\u0645\u064a',  # ARABIC LIGATURE YEH WITH MEEM WITH YEH FINAL FORM
+  0xFDB1: '\u0645\u0645\u064a',  # ARABIC LIGATURE MEEM WITH MEEM WITH YEH FINAL FORM
+  0xFDB2: '\u0642\u0645\u064a',  # ARABIC LIGATURE QAF WITH MEEM WITH YEH FINAL FORM
+  0xFDB3: '\u0646\u062d\u064a',  # ARABIC LIGATURE NOON WITH HAH WITH YEH FINAL FORM
+  0xFDB4: '\u0642\u0645\u062d',  # ARABIC LIGATURE QAF WITH MEEM WITH HAH INITIAL FORM
+  0xFDB5: '\u0644\u062d\u0645',  # ARABIC LIGATURE LAM WITH HAH WITH MEEM INITIAL FORM
+  0xFDB6: '\u0639\u0645\u064a',  # ARABIC LIGATURE AIN WITH MEEM WITH YEH FINAL FORM
+  0xFDB7: '\u0643\u0645\u064a',  # ARABIC LIGATURE KAF WITH MEEM WITH YEH FINAL FORM
+  0xFDB8: '\u0646\u062c\u062d',  # ARABIC LIGATURE NOON WITH JEEM WITH HAH INITIAL FORM
+  0xFDB9: '\u0645\u062e\u064a',  # ARABIC LIGATURE MEEM WITH KHAH WITH YEH FINAL FORM
+  0xFDBA: '\u0644\u062c\u0645',  # ARABIC LIGATURE LAM WITH JEEM WITH MEEM INITIAL FORM
+  0xFDBB: '\u0643\u0645\u0645',  # ARABIC LIGATURE KAF WITH MEEM WITH MEEM FINAL FORM
+  0xFDBC: '\u0644\u062c\u0645',  # ARABIC LIGATURE LAM WITH JEEM WITH MEEM FINAL FORM
+  0xFDBD: '\u0646\u062c\u062d',  # ARABIC LIGATURE NOON WITH JEEM WITH HAH FINAL FORM
+  0xFDBE: '\u062c\u062d\u064a',  # ARABIC LIGATURE JEEM WITH HAH WITH YEH FINAL FORM
+  0xFDBF: '\u062d\u062c\u064a',  # ARABIC LIGATURE HAH WITH JEEM WITH YEH FINAL FORM
+  0xFDC0: '\u0645\u062c\u064a',  # ARABIC LIGATURE MEEM WITH JEEM WITH YEH FINAL FORM
+  0xFDC1: '\u0641\u0645\u064a',  # ARABIC LIGATURE FEH WITH MEEM WITH YEH FINAL FORM
+  0xFDC2: '\u0628\u062d\u064a',  # ARABIC LIGATURE BEH WITH HAH WITH YEH FINAL FORM
+  0xFDC3: '\u0643\u0645\u0645',  # ARABIC LIGATURE KAF WITH MEEM WITH MEEM INITIAL FORM
+  0xFDC4: '\u0639\u062c\u0645',  # ARABIC LIGATURE AIN WITH JEEM WITH MEEM INITIAL FORM
+  0xFDC5: '\u0635\u0645\u0645',  # ARABIC LIGATURE SAD WITH MEEM WITH MEEM INITIAL FORM
+  0xFDC6: '\u0633\u062e\u064a',  # ARABIC LIGATURE SEEN WITH KHAH WITH YEH FINAL FORM
+  0xFDC7: '\u0646\u062c\u064a',  # ARABIC LIGATURE NOON WITH JEEM WITH YEH FINAL FORM
+  0xFDF0: '\u0635\u0644\u06d2',  # ARABIC LIGATURE SALLA USED AS KORANIC STOP SIGN ISOLATED FORM
+  0xFDF1: '\u0642\u0644\u06d2',  # ARABIC LIGATURE QALA USED AS KORANIC STOP SIGN ISOLATED FORM
+  0xFDF2: '\u0627\u0644\u0644\u0647',  # ARABIC LIGATURE ALLAH ISOLATED FORM
+  0xFDF3: '\u0627\u0643\u0628\u0631',  # ARABIC LIGATURE AKBAR ISOLATED FORM
+  0xFDF4: '\u0645\u062d\u0645\u062f',  # ARABIC LIGATURE MOHAMMAD ISOLATED FORM
+  0xFDF5: '\u0635\u0644\u0639\u0645',  # ARABIC LIGATURE SALAM ISOLATED FORM
+  0xFDF6: '\u0631\u0633\u0648\u0644',  # ARABIC LIGATURE RASOUL ISOLATED FORM
+  0xFDF7: '\u0639\u0644\u064a\u0647',  # ARABIC LIGATURE ALAYHE ISOLATED FORM
+  0xFDF8: '\u0648\u0633\u0644\u0645',  # ARABIC LIGATURE WASALLAM ISOLATED FORM
+  0xFDF9: '\u0635\u0644\u0649',  # ARABIC LIGATURE SALLA ISOLATED FORM
+  0xFDFA: '\u0635\u0644\u0649 \u0627\u0644\u0644\u0647 \u0639\u0644\u064a\u0647 \u0648\u0633\u0644\u0645',  # ARABIC LIGATURE SALLALLAHOU ALAYHE WASALLAM
+  0xFDFB: '\u062c\u0644 \u062c\u0644\u0627\u0644\u0647',  # ARABIC LIGATURE JALLAJALALOUHOU
+  0xFDFC: '\u0631\u06cc\u0627\u0644',  # RIAL SIGN
+  0xFE70: ' \u064b',  # ARABIC FATHATAN ISOLATED FORM
+  0xFE71: '\u0640\u064b',  # ARABIC TATWEEL WITH FATHATAN ABOVE
+  0xFE72: ' \u064c',  # ARABIC DAMMATAN ISOLATED FORM
+  0xFE74: ' \u064d',  # ARABIC KASRATAN ISOLATED FORM
+  0xFE76: ' \u064e',  # ARABIC FATHA ISOLATED FORM
+  0xFE77: '\u0640\u064e',  # ARABIC FATHA MEDIAL FORM
+  0xFE78: ' \u064f',  # ARABIC DAMMA ISOLATED FORM
+  0xFE79: '\u0640\u064f',  # ARABIC DAMMA MEDIAL FORM
+  0xFE7A: ' \u0650',  # ARABIC KASRA ISOLATED FORM
+  0xFE7B: '\u0640\u0650',  # ARABIC KASRA MEDIAL FORM
+  0xFE7C: ' \u0651',  # ARABIC SHADDA ISOLATED FORM
+  0xFE7D: '\u0640\u0651',  # ARABIC SHADDA MEDIAL FORM
+  0xFE7E: ' \u0652',  # ARABIC SUKUN ISOLATED FORM
+  0xFE7F: '\u0640\u0652',  # ARABIC SUKUN MEDIAL FORM
+  0xFE80: '\u0621',  # ARABIC LETTER HAMZA ISOLATED FORM
+  0xFE81: '\u0622',  # ARABIC LETTER ALEF WITH MADDA ABOVE ISOLATED FORM
+  0xFE82: '\u0622',  # ARABIC LETTER ALEF WITH MADDA ABOVE FINAL FORM
+  0xFE83: '\u0623',  # ARABIC LETTER ALEF WITH HAMZA ABOVE ISOLATED FORM
+  0xFE84: '\u0623',  # ARABIC LETTER ALEF WITH HAMZA ABOVE FINAL FORM
+  0xFE85: '\u0624',  # ARABIC LETTER WAW WITH HAMZA ABOVE ISOLATED FORM
+  0xFE86: '\u0624',  # ARABIC LETTER WAW WITH HAMZA ABOVE FINAL FORM
+  0xFE87: '\u0625',  # ARABIC LETTER ALEF WITH HAMZA BELOW ISOLATED FORM
+  0xFE88: '\u0625',  # ARABIC LETTER ALEF WITH HAMZA BELOW FINAL FORM
+  0xFE89: '\u0626',  # ARABIC LETTER YEH WITH HAMZA ABOVE ISOLATED FORM
+  0xFE8A: '\u0626',  # ARABIC LETTER YEH WITH HAMZA ABOVE FINAL FORM
+  0xFE8B: '\u0626',  # ARABIC LETTER YEH WITH HAMZA ABOVE INITIAL FORM
+  0xFE8C: '\u0626',  # ARABIC LETTER YEH WITH HAMZA ABOVE MEDIAL FORM
+  0xFE8D: '\u0627',  # ARABIC LETTER ALEF ISOLATED FORM
+  0xFE8E: '\u0627',  # ARABIC LETTER ALEF FINAL FORM
+  0xFE8F: '\u0628',  # ARABIC LETTER BEH ISOLATED FORM
+  0xFE90: '\u0628',  # ARABIC LETTER BEH FINAL FORM
+  0xFE91: '\u0628',  # ARABIC LETTER BEH INITIAL FORM
+  0xFE92: '\u0628',  # ARABIC LETTER BEH MEDIAL FORM
+  0xFE93: '\u0629',  # ARABIC LETTER TEH MARBUTA ISOLATED FORM
+  0xFE94: '\u0629',  # ARABIC LETTER TEH MARBUTA FINAL FORM
+  0xFE95: '\u062a',  # ARABIC LETTER TEH ISOLATED FORM
+  0xFE96: '\u062a',  # ARABIC LETTER TEH FINAL FORM
+  0xFE97: '\u062a',  # ARABIC LETTER TEH INITIAL FORM
+  0xFE98: '\u062a',  # ARABIC LETTER TEH MEDIAL FORM
+  0xFE99: '\u062b',  # ARABIC LETTER THEH ISOLATED FORM
+  0xFE9A: '\u062b',  # ARABIC LETTER THEH FINAL FORM
+  0xFE9B: '\u062b',  # ARABIC LETTER THEH INITIAL FORM
+  0xFE9C: '\u062b',  # ARABIC LETTER THEH MEDIAL FORM
+  0xFE9D: '\u062c',  # ARABIC LETTER JEEM ISOLATED FORM
+  0xFE9E: '\u062c',  # ARABIC LETTER JEEM FINAL FORM
+  0xFE9F: '\u062c',  # ARABIC LETTER JEEM INITIAL FORM
+  0xFEA0: '\u062c',  # ARABIC LETTER JEEM MEDIAL FORM
+  0xFEA1: '\u062d',  # ARABIC LETTER HAH ISOLATED FORM
+  0xFEA2: '\u062d',  # ARABIC LETTER HAH FINAL FORM
+  0xFEA3: '\u062d',  # ARABIC LETTER HAH INITIAL FORM
+  0xFEA4: '\u062d',  # ARABIC LETTER HAH MEDIAL FORM
+  0xFEA5: '\u062e',  # ARABIC LETTER KHAH ISOLATED FORM
+  0xFEA6: '\u062e',  # ARABIC LETTER KHAH FINAL FORM
+  0xFEA7: '\u062e',  # ARABIC LETTER KHAH INITIAL FORM
+  0xFEA8: '\u062e',  # ARABIC LETTER KHAH MEDIAL FORM
+  0xFEA9: '\u062f',  # ARABIC LETTER DAL ISOLATED FORM
+  0xFEAA: '\u062f',  # ARABIC LETTER DAL FINAL FORM
+  0xFEAB: '\u0630',  # ARABIC LETTER THAL ISOLATED FORM
+  0xFEAC: '\u0630',  # ARABIC LETTER THAL FINAL FORM
+  0xFEAD: '\u0631',  # ARABIC LETTER REH ISOLATED FORM
+  0xFEAE: '\u0631',  # ARABIC LETTER REH FINAL FORM
+  0xFEAF: '\u0632',  # ARABIC LETTER ZAIN ISOLATED FORM
+  0xFEB0: '\u0632',  # ARABIC LETTER ZAIN FINAL FORM
+  0xFEB1: '\u0633',  # ARABIC LETTER SEEN ISOLATED FORM
+  0xFEB2: '\u0633',  # ARABIC LETTER SEEN FINAL FORM
+  0xFEB3: '\u0633',  # ARABIC LETTER SEEN INITIAL FORM
+  0xFEB4: '\u0633',  # ARABIC LETTER SEEN MEDIAL FORM
+  0xFEB5: '\u0634',  # ARABIC LETTER SHEEN ISOLATED FORM
+  0xFEB6: '\u0634',  # ARABIC LETTER SHEEN FINAL FORM
+  0xFEB7: '\u0634',  # ARABIC LETTER SHEEN INITIAL FORM
+  0xFEB8: '\u0634',  # ARABIC LETTER SHEEN MEDIAL FORM
+  0xFEB9: '\u0635',  # ARABIC LETTER SAD ISOLATED FORM
+  0xFEBA: '\u0635',  # ARABIC LETTER SAD FINAL FORM
+  0xFEBB: '\u0635',  # ARABIC LETTER SAD INITIAL FORM
+  0xFEBC: '\u0635',  # ARABIC LETTER SAD MEDIAL FORM
+  0xFEBD: '\u0636',  # ARABIC LETTER DAD ISOLATED FORM
+  0xFEBE: '\u0636',  # ARABIC LETTER DAD FINAL FORM
+  0xFEBF: '\u0636',  # ARABIC LETTER DAD INITIAL FORM
+  0xFEC0: '\u0636',  # ARABIC LETTER DAD MEDIAL FORM
+  0xFEC1: '\u0637',  # ARABIC LETTER TAH ISOLATED FORM
+  0xFEC2: '\u0637',  # ARABIC LETTER TAH FINAL FORM
+  0xFEC3: '\u0637',  # ARABIC LETTER TAH INITIAL FORM
+  0xFEC4: '\u0637',  # ARABIC LETTER TAH MEDIAL FORM
+  0xFEC5: '\u0638',  # ARABIC LETTER ZAH ISOLATED FORM
+  0xFEC6: '\u0638',  # ARABIC LETTER ZAH FINAL FORM
+  0xFEC7: '\u0638',  # ARABIC LETTER ZAH INITIAL FORM
+  0xFEC8: '\u0638',  # ARABIC LETTER ZAH MEDIAL FORM
+  0xFEC9: '\u0639',  # ARABIC LETTER AIN ISOLATED FORM
+  0xFECA: '\u0639',  # ARABIC LETTER AIN FINAL FORM
+  0xFECB: '\u0639',  # ARABIC LETTER AIN INITIAL FORM
+  0xFECC: '\u0639',  # ARABIC LETTER AIN MEDIAL FORM
+  0xFECD: '\u063a',  # ARABIC LETTER GHAIN ISOLATED FORM
+  0xFECE: '\u063a',  # ARABIC LETTER GHAIN FINAL FORM
+  0xFECF: '\u063a',  # ARABIC LETTER GHAIN INITIAL FORM
+  0xFED0: '\u063a',  # ARABIC LETTER GHAIN MEDIAL FORM
+  0xFED1: '\u0641',  # ARABIC LETTER FEH ISOLATED FORM
+  0xFED2: '\u0641',  # ARABIC LETTER FEH FINAL FORM
+  0xFED3: '\u0641',  # ARABIC LETTER FEH INITIAL FORM
+  0xFED4: '\u0641',  # ARABIC LETTER FEH MEDIAL FORM
+  0xFED5: '\u0642',  # ARABIC LETTER QAF ISOLATED FORM
+  0xFED6: '\u0642',  # ARABIC LETTER QAF FINAL FORM
+  0xFED7: '\u0642',  # ARABIC LETTER QAF INITIAL FORM
+  0xFED8: '\u0642',  # ARABIC LETTER QAF MEDIAL FORM
+  0xFED9: '\u0643',  # ARABIC LETTER KAF ISOLATED FORM
+  0xFEDA: '\u0643',  # ARABIC LETTER KAF FINAL FORM
+  0xFEDB: '\u0643',  # ARABIC LETTER KAF INITIAL FORM
+  0xFEDC: '\u0643',  # ARABIC LETTER KAF MEDIAL FORM
+  0xFEDD: '\u0644',  # ARABIC LETTER LAM ISOLATED FORM
+  0xFEDE: '\u0644',  # ARABIC LETTER LAM FINAL FORM
+  0xFEDF: '\u0644',  # ARABIC LETTER LAM INITIAL FORM
+  0xFEE0: '\u0644',  # ARABIC LETTER LAM MEDIAL FORM
+  0xFEE1: '\u0645',  # ARABIC LETTER MEEM ISOLATED FORM
+  0xFEE2: '\u0645',  # ARABIC LETTER MEEM FINAL FORM
+  0xFEE3: '\u0645',  # ARABIC LETTER MEEM INITIAL FORM
+  0xFEE4: '\u0645',  # ARABIC LETTER MEEM MEDIAL FORM
+  0xFEE5: '\u0646',  # ARABIC LETTER NOON ISOLATED FORM
+  0xFEE6: '\u0646',  # ARABIC LETTER NOON FINAL FORM
+  0xFEE7: '\u0646',  # ARABIC LETTER NOON INITIAL FORM
+  0xFEE8: '\u0646',  # ARABIC LETTER NOON MEDIAL FORM
+  0xFEE9: '\u0647',  # ARABIC LETTER HEH ISOLATED FORM
+  0xFEEA: '\u0647',  # ARABIC LETTER HEH FINAL FORM
+  0xFEEB: '\u0647',  # ARABIC LETTER HEH INITIAL FORM
+  0xFEEC: '\u0647',  # ARABIC LETTER HEH MEDIAL FORM
+  0xFEED: '\u0648',  # ARABIC LETTER WAW ISOLATED FORM
+  0xFEEE: '\u0648',  # ARABIC LETTER WAW FINAL FORM
+  0xFEEF: '\u0649',  # ARABIC LETTER ALEF MAKSURA ISOLATED FORM
+  0xFEF0: '\u0649',  # ARABIC LETTER ALEF MAKSURA FINAL FORM
+  0xFEF1: '\u064a',  # ARABIC LETTER YEH ISOLATED FORM
+  0xFEF2: '\u064a',  # ARABIC LETTER YEH FINAL FORM
+  0xFEF3: '\u064a',  # ARABIC LETTER YEH INITIAL FORM
+  0xFEF4: '\u064a',  # ARABIC LETTER YEH MEDIAL FORM
+  0xFEF5: '\u0644\u0622',  # ARABIC LIGATURE LAM WITH ALEF WITH MADDA ABOVE ISOLATED FORM
+  0xFEF6: '\u0644\u0622',  # ARABIC LIGATURE LAM WITH ALEF WITH MADDA ABOVE FINAL FORM
+  0xFEF7: '\u0644\u0623',  # ARABIC LIGATURE LAM WITH ALEF WITH HAMZA ABOVE ISOLATED FORM
+  0xFEF8: '\u0644\u0623',  # ARABIC LIGATURE LAM WITH ALEF WITH HAMZA ABOVE FINAL FORM
+  0xFEF9: '\u0644\u0625',  # ARABIC LIGATURE LAM WITH ALEF WITH HAMZA BELOW ISOLATED FORM
+  0xFEFA: '\u0644\u0625',  # ARABIC LIGATURE LAM WITH ALEF WITH HAMZA BELOW FINAL FORM
+  0xFEFB: '\u0644\u0627',  # ARABIC LIGATURE LAM WITH ALEF ISOLATED FORM
+  0xFEFC: '\u0644\u0627',  # ARABIC LIGATURE LAM WITH ALEF FINAL FORM
+}
+
+UNKNOWN_REGEX = '[^\x00-\u02ff\u034f\u0370-\u0482\u0488-\u0590\u05be\u05c0\u05c3\u05c6\u05c8-\u060f\u061b-\u064a\u0660-\u066f\u0671-\u06d5\u06dd-\u06de\u06e5-\u06e6\u06e9\u06ee-\u06ff\u2000-\u206f\ufb50-\ufdff\ufe70-\ufeff\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e4\u06e7-\u06e8\u06ea-\u06ed]'
+REORDER_REGEX = '[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e4\u06e7-\u06e8\u06ea-\u06ed\xc0-\xc5\xc7-\xcf\xd1-\xd6\xd9-\xdd\xe0-\xe5\xe7-\xef\xf1-\xf6\xf9-\xfd\xff-\u010f\u0112-\u0125\u0128-\u0130\u0134-\u0137\u0139-\u013e\u0143-\u0148\u014c-\u0151\u0154-\u0165\u0168-\u017e\u01a0-\u01a1\u01af-\u01b0\u01cd-\u01dc\u01de-\u01e3\u01e6-\u01f0\u01f4-\u01f5\u01f8-\u021b\u021e-\u021f\u0226-\u0233\u0386\u0388-\u038a\u038c\u038e-\u0390\u03aa-\u03b0\u03ca-\u03ce\u0400-\u0401\u0403\u0407\u040c-\u040e\u0419\u0439\u0450-\u0451\u0453\u0457\u045c-\u045e\u0476-\u0477\u04c1-\u04c2\u04d0-\u04d3\u04d6-\u04d7\u04da-\u04df\u04e2-\u04e7\u04ea-\u04f5\u04f8-\u04f9\u0622-\u0626\u06c0\u06c2\u06d3][\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e4\u06e7-\u06e8\u06ea-\u06ed]'
@@ -1,8 +1,33 @@
+import contextlib
+import io
+import json
+import os
+import pathlib
+import pickle
+import re
+import subprocess
+import sys
+import tempfile
 import unittest
 import unicodedata
 
-from contextual_forms import contextualize, decontextualize, \
-     end_letters, iso_d, beg_d, mid_d, end_d, tails_d
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import contextual_forms
+from contextual_forms import contextualize, decontextualize, normalize, \
+     contextualize_text, decontextualize_text, contextualize_stream, \
+     decontextualize_chunks, decontextualize_stream, \
+     contextualize_iter, decontextualize_iter, convert_files, \
+     contextualize_many, decontextualize_many, make_block_cache, \
+     make_token_cache, LineCache, Shaper, \
+     load_profile, \
+     contextualize_file, decontextualize_file, \
+     end_letters, iso_d, beg_d, mid_d, end_d, tails_d, tails_regex, \
+     normalize_d, compile_decontext_table, default_decontext_table, \
+     build_tables_module, _decontext_checksum
 
 class TestContextualize(unittest.TestCase):
     def test_isolated_character(self):
@@ -29,6 +54,127 @@ class TestContextualize(unittest.TestCase):
         res = "ﺳ" + "ﺎ" + "ٔ" + "ﻝ"
         self.assertEqual(contextualize(inp), res)
 
+    def test_lam_alif(self):
+        self.assertEqual(contextualize("لا"), "ﻻ")
+        self.assertEqual(contextualize("كلا"), "ﻛﻼ")
+        self.assertEqual(contextualize("لَا"), "ﻟَﺎ")
+
+    def test_lam_alif_hamza(self):
+        tests = [("لأ", "ﻷ"), ("سلأ", "ﺳﻸ"), ("لإ", "ﻹ"), ("سلإ", "ﺳﻺ"),
+                 ("لآ", "ﻵ"), ("سلآ", "ﺳﻶ"), ("لأب", "ﻷﺏ"),
+                 ("لأَ", "ﻷَ"), ("لأَب", "ﻷَﺏ"),
+                 # not a ligature:
+                 ("لَأ", "ﻟَﺎٔ"), ("بأ", "ﺑﺎٔ")]
+        modes = ["fsm", "regex"] + (["numpy"] if numpy else [])
+        for inp, res in tests:
+            for mode in modes:
+                self.assertEqual(contextualize_text(inp, mode=mode), res)
+            self.assertEqual(decontextualize_text(res),
+                             unicodedata.normalize("NFC", inp))
+        # the other diacritics after the alif (before the hamza
+        # in NFKD order) are ordered as if there was no hamza:
+        for inp in ["سلأَّ", "سلأَّ ب", "سلأَّب", "لأَّلأَّ", "لأًّ!"]:
+            res = contextualize_text(inp.replace("أ", "ا")).replace("ﻼ", "ﻸ")
+            res = res.replace("ﻻ", "ﻷ")
+            for mode in modes:
+                self.assertEqual(contextualize_text(inp, mode=mode), res)
+
+    def test_lam_alif_chain(self):
+        """long chains of fused ligatures without spaces"""
+        for inp in ["بلأ" * 1000, ("لأَّ" + "ب") * 2000]:
+            res = contextualize_text(inp)
+            self.assertEqual(contextualize_text(inp, mode="regex"), res)
+            if numpy:
+                self.assertEqual(contextualize_text(inp, mode="numpy"), res)
+            self.assertEqual(Shaper(mode="regex").shape(inp), res)
+            self.assertEqual(contextualize_many([inp], mode="regex"), [res])
+
+    def test_custom_dictionaries(self):
+        inp = "ببب"
+        res = "ﺑ" + "ﺑ" + "ﺐ"
+        self.assertEqual(contextualize_text(inp, mid_d=beg_d), res)
+
+    def test_file_unchanged(self):
+        """check that the contextualized test file is reproduced exactly"""
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp, mode="r", encoding="utf-8") as file:
+            text = file.read()
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        for mode in ["fsm", "regex"]:
+            self.assertEqual(contextualize_text(text, mode=mode), res)
+        self.assertEqual(contextualize_text(text, workers=2), res)
+
+    def test_file_objects(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        self.assertEqual(contextualize_file(pathlib.Path(infp)), res)
+        self.assertEqual(contextualize(pathlib.Path(infp)), res)
+        with open(infp, mode="r", encoding="utf-8") as file:
+            out = io.StringIO()
+            contextualize_file(file, out)
+        self.assertEqual(out.getvalue(), res)
+        out = io.StringIO()
+        decontextualize_file(io.StringIO(res), out)
+        self.assertEqual(out.getvalue(), decontextualize_text(res))
+
+    def test_echo(self):
+        for echo, res in [(False, ""), (True, "ﺏ\n")]:
+            with contextlib.redirect_stdout(io.StringIO()) as f:
+                contextualize("ب", echo=echo)
+                decontextualize("ﺏ", echo=echo)
+            self.assertEqual(f.getvalue(), res + res.replace("ﺏ", "ب"))
+
+    def test_stream(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            outfp = os.path.join(tmp, "out.txt")
+            for chunk_size in [1, 1000, 2**20]:
+                contextualize_stream(infp, outfp, chunk_size=chunk_size)
+                with open(outfp, mode="r", encoding="utf-8") as file:
+                    self.assertEqual(file.read(), res)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_mode(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp, mode="r", encoding="utf-8") as file:
+            text = file.read()
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        self.assertEqual(contextualize_text(text, mode="numpy"), res)
+        for inp in ["", "ب", "لا", "كلا", "لَا", "بَّ ", "َب", "دَّ ب", "😀بب"]:
+            self.assertEqual(contextualize_text(inp, mode="numpy"),
+                             contextualize_text(inp))
+        # letter forms that are not a single character:
+        inp = "ببب"
+        mid = dict(mid_d, **{"ب": "ﺒـ"})
+        self.assertEqual(contextualize_text(inp, mid_d=mid, mode="numpy"),
+                         contextualize_text(inp, mid_d=mid))
+
+    def test_block_cache(self):
+        default_cache = contextual_forms.block_cache
+        try:
+            cache = make_block_cache(maxsize=1)
+            contextual_forms.block_cache = cache
+            inp = "بب بب بب و"
+            self.assertEqual(contextualize_text(inp, mode="regex"),
+                             contextualize_text(inp))
+            info = cache.cache_info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 1))
+        finally:
+            contextual_forms.block_cache = default_cache
+        inp = "ببب ببب"
+        res = "ﺑﺑﺐ ﺑﺑﺐ"
+        self.assertEqual(contextualize_text(inp, mid_d=beg_d, mode="regex"),
+                         res)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            contextualize_text("ب", mode="loop")
+
 
 class TestDecontextualize(unittest.TestCase):
     def test_isolated_character(self):
@@ -56,6 +202,61 @@ class TestDecontextualize(unittest.TestCase):
             #print("res:", res)
             self.assertEqual(decontextualize(inp), res)
 
+    def test_composition(self):
+        inp = "ﺳ" + "ﺎ" + "ٔ" + "ﻝ"
+        res = "سأل"
+        self.assertEqual(decontextualize_text(inp), res)
+
+    def test_nfkc_fallback(self):
+        for inp in ["ﷲ", "ﺑﺮ" + "ِّ", "ﬁ ﺏ", "ﺏ\u3000ﺏ", "\u0622\u0655"]:
+            res = unicodedata.normalize("NFKC", inp)
+            self.assertEqual(decontextualize_text(inp), res)
+
+    def test_token_cache(self):
+        default_cache = contextual_forms.token_cache
+        try:
+            cache = make_token_cache(maxsize=2)
+            contextual_forms.token_cache = cache
+            inp = "ﺑﺐ ﺑﺐ ﺑﺐ\nﻭ ﻻ"
+            self.assertEqual(decontextualize(inp, cache=True),
+                             decontextualize(inp))
+            info = cache.cache_info()
+            self.assertEqual((info.hits, info.misses, info.currsize), (1, 3, 2))
+        finally:
+            contextual_forms.token_cache = default_cache
+        inp = "ﺏﺑﺐ ﺏﺑﺐ"
+        self.assertEqual(decontextualize_text(inp, tails_regex="(x)", cache=True),
+                         "ببب ببب")
+
+    def test_chunks(self):
+        """tail letter and its diacritics in a different chunk
+        than the next letter"""
+        inp = contextualize("ولا تردي") + "ّ" + contextualize("به")
+        res = decontextualize_text(inp)
+        for i in range(len(inp)+1):
+            chunks = [inp[:i], inp[i:]]
+            self.assertEqual("".join(decontextualize_chunks(chunks)), res)
+
+    def test_stream(self):
+        fp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1.contextualized"
+        with open(fp, mode="r", encoding="utf-8") as file:
+            res = decontextualize_text(file.read())
+        with tempfile.TemporaryDirectory() as tmp:
+            outfp = os.path.join(tmp, "out.txt")
+            for chunk_size in [7, 2**20]:
+                decontextualize_stream(fp, outfp, chunk_size=chunk_size)
+                with open(outfp, mode="r", encoding="utf-8") as file:
+                    self.assertEqual(file.read(), res)
+
+    def test_file_nfkc(self):
+        """check that the translate table gives the same result
+        as NFKC normalization of the whole text"""
+        fp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1.contextualized"
+        with open(fp, mode="r", encoding="utf-8") as file:
+            text = file.read()
+        res = unicodedata.normalize("NFKC", re.sub(tails_regex, r"\1 ", text))
+        self.assertEqual(decontextualize_text(text), res)
+
 class TestDouble(unittest.TestCase):
     def test_1(self):
         inp = "ولا تردد به"
@@ -93,6 +294,21 @@ class TestDouble(unittest.TestCase):
         inp = "ســـأل"
         self.assertEqual(decontextualize(contextualize(inp)), inp)
 
+    def test_iter(self):
+        lines = ["ولا تردد به\n", "ولا تردي به\n", "شيء"]
+        new = contextualize_iter(iter(lines))
+        self.assertEqual(next(new), contextualize(lines[0]))
+        self.assertEqual(list(decontextualize_iter(contextualize_iter(lines))),
+                         lines)
+
+    def test_many(self):
+        lines = ["ولا تردد به", "", "ولا تردي\nبه", "شيء\x1e", "\x00بب"]
+        for strings in [lines[:2], lines[:3], lines[:4], lines]:
+            new = contextualize_many(strings)
+            self.assertEqual(new, [contextualize(x) for x in strings])
+            self.assertEqual(decontextualize_many(new), strings)
+        self.assertEqual(contextualize_many([]), [])
+
 ##    def test_lam(self):
 ##        inp = "ســـأل ســـأل"
 ##        print("context:", contextualize(inp))
@@ -164,6 +380,51 @@ class Test_dictionaries(unittest.TestCase):
         for k, v in tails_d.items():
             self.assertTrue(_form_ok(v, k, "FORM")) # context forms in keys!
 
+    def test_tables_module(self):
+        """the generated tables module should be up to date
+        with the dictionaries"""
+        import contextual_forms_tables
+        self.assertEqual(contextual_forms_tables.CHECKSUM,
+                         _decontext_checksum())
+        if unicodedata.unidata_version not in \
+           contextual_forms_tables.UNIDATA_VERSIONS:
+            self.skipTest("tables module not verified for Unicode {}".format(
+                unicodedata.unidata_version))
+        compiled = compile_decontext_table()
+        for k in ["unknown_regex", "reorder_regex"]:
+            self.assertEqual(default_decontext_table[k].pattern,
+                             compiled[k].pattern)
+        self.assertEqual(default_decontext_table["table"], compiled["table"])
+
+    def test_build_tables_module(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "tables.py")
+            with open(fp, mode="w", encoding="utf-8") as file:
+                file.write("CHECKSUM = 0\nUNIDATA_VERSIONS = ['1.0.0']\n")
+            build_tables_module(fp)
+            generated = {}
+            with open(fp, mode="r", encoding="utf-8") as file:
+                exec(file.read(), generated)
+            self.assertEqual(generated["UNIDATA_VERSIONS"],
+                             [unicodedata.unidata_version])
+            # a table that is verified for other Unicode versions
+            # keeps those versions:
+            with open(fp, mode="r", encoding="utf-8") as file:
+                text = file.read()
+            with open(fp, mode="w", encoding="utf-8") as file:
+                file.write(text.replace("UNIDATA_VERSIONS = [",
+                                        "UNIDATA_VERSIONS = ['1.0.0', "))
+            build_tables_module(fp)
+            generated = {}
+            with open(fp, mode="r", encoding="utf-8") as file:
+                exec(file.read(), generated)
+            self.assertEqual(generated["UNIDATA_VERSIONS"],
+                             ["1.0.0", unicodedata.unidata_version])
+            compiled = compile_decontext_table()
+            self.assertEqual(generated["MAPPINGS"],
+                             {cp: n for cp, n in enumerate(compiled["table"])
+                              if n != cp})
+
 ##    def test_decontext_d(self):
 ##        print("decontext_d")
 ##        for k, v in decontext_d.items():
@@ -194,6 +455,218 @@ class Test_dictionaries(unittest.TestCase):
                     print("character count changed:", c, chars[c], "no name")
             self.assertEqual(chars[c][0], chars[c][1])
 
+class TestConvertFiles(unittest.TestCase):
+    def test_convert_folder(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            for workers in [1, 2]:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    converted = convert_files("test/*-ara1", tmp,
+                                              workers=workers, force=True)
+                self.assertEqual(len(converted), 1)
+                with open(converted[0], mode="r", encoding="utf-8") as file:
+                    self.assertEqual(file.read(), res)
+            # output files that are up to date are skipped:
+            with contextlib.redirect_stdout(io.StringIO()):
+                converted = convert_files("test/*-ara1", tmp)
+            self.assertEqual(converted, [])
+
+    def test_hidden_and_binary_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            infolder = os.path.join(tmp, "in")
+            outfolder = os.path.join(tmp, "out")
+            os.makedirs(os.path.join(infolder, ".git"))
+            for fn, content in [("a.txt", "ب".encode("utf-8")),
+                                ("b.bin", b"\xff\xfe\x00\x81"),
+                                (".hidden", b"x"),
+                                (os.path.join(".git", "config"), b"x")]:
+                with open(os.path.join(infolder, fn), mode="wb") as file:
+                    file.write(content)
+            for workers in [1, 2]:
+                with contextlib.redirect_stdout(io.StringIO()) as f:
+                    converted = convert_files(infolder, outfolder,
+                                              workers=workers, force=True)
+                self.assertEqual(converted, [os.path.join(outfolder, "a.txt")])
+                self.assertEqual(os.listdir(outfolder), ["a.txt"])
+                self.assertIn("b.bin: ERROR: UnicodeDecodeError", f.getvalue())
+
+    def test_manifest(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp, mode="r", encoding="utf-8") as file:
+            text = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            infolder = os.path.join(tmp, "in")
+            outfolder = os.path.join(tmp, "out")
+            manifest = os.path.join(infolder, "manifest.json")
+            os.makedirs(infolder)
+            fp = os.path.join(infolder, "a.txt")
+            with open(fp, mode="w", encoding="utf-8") as file:
+                file.write(text)
+            def convert():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return convert_files(infolder, outfolder, workers=1,
+                                         manifest=manifest)
+            self.assertEqual(len(convert()), 1)
+            self.assertEqual(convert(), [])
+            # a new modification time does not make a file stale:
+            os.utime(fp, ns=(0, 0))
+            self.assertEqual(convert(), [])
+            # new content, a changed output file or new tables do:
+            with open(fp, mode="a", encoding="utf-8") as file:
+                file.write("ب")
+            self.assertEqual(len(convert()), 1)
+            outfp = os.path.join(outfolder, "a.txt")
+            with open(outfp, mode="a", encoding="utf-8") as file:
+                file.write("ب")
+            self.assertEqual(len(convert()), 1)
+            self.assertEqual(convert(), [])
+            version = contextual_forms.CACHE_VERSION
+            try:
+                contextual_forms.CACHE_VERSION = version + 1
+                self.assertEqual(len(convert()), 1)
+            finally:
+                contextual_forms.CACHE_VERSION = version
+            with open(outfp, mode="r", encoding="utf-8") as file:
+                self.assertEqual(file.read(), contextualize(text + "ب"))
+
+
+class TestLineCache(unittest.TestCase):
+    def test_line_cache(self):
+        text = "بسم الله\nالرحمن الرحيم\n\nبسم الله"
+        res = contextualize(text)
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "cache.sqlite")
+            with LineCache(fp) as cache:
+                self.assertEqual(contextualize(text, line_cache=cache), res)
+                self.assertEqual(cache.cache_info().currsize, 3)
+                self.assertEqual(decontextualize(res, line_cache=cache),
+                                 decontextualize(res))
+                self.assertEqual(cache.cache_info().currsize, 6)
+            # all lines are found in the cache in the next session:
+            with LineCache(fp) as cache:
+                self.assertEqual(contextualize(text, line_cache=cache), res)
+                self.assertEqual(cache.cache_info()[:2], (4, 0))
+            # lines converted with other tables are invalidated:
+            iso = dict(iso_d, **{"ب": "ب"})
+            with LineCache(fp) as cache:
+                self.assertEqual(contextualize("ب", iso_d=iso, line_cache=fp),
+                                 "ب")
+                self.assertEqual(contextualize("ب", iso_d=iso,
+                                               line_cache=cache), "ب")
+                self.assertEqual(cache.cache_info().currsize, 4)
+            # least recently used lines are deleted:
+            with LineCache(fp, max_lines=2) as cache:
+                contextualize(text, line_cache=cache)
+                self.assertEqual(cache.cache_info().currsize, 1)
+                n = cache.db.execute("SELECT COUNT(*) FROM lines").fetchone()
+                self.assertEqual(n[0], 1)
+
+    def test_alternate_tables(self):
+        iso = dict(iso_d, **{"ب": "X"})
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "cache.sqlite")
+            with LineCache(fp) as cache:
+                for i in range(2):
+                    self.assertEqual(contextualize("ب", line_cache=cache), "ﺏ")
+                    self.assertEqual(contextualize("ب", iso_d=iso,
+                                                   line_cache=cache), "X")
+
+    def test_convert_folder(self):
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp + ".contextualized", mode="r", encoding="utf-8") as file:
+            res = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "cache.sqlite")
+            outfolder = os.path.join(tmp, "out")
+            for i in range(2):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    converted = convert_files("test/*-ara1", outfolder,
+                                              workers=1, force=True,
+                                              line_cache=fp)
+                with open(converted[0], mode="r", encoding="utf-8") as file:
+                    self.assertEqual(file.read(), res)
+
+
+class TestShaper(unittest.TestCase):
+    def test_shaper(self):
+        text = "بسم الله الرحمن الرحيم\nلا إله إلا الله"
+        res = contextualize_text(text)
+        for mode in ["fsm", "regex"]:
+            shaper = Shaper(mode=mode)
+            self.assertIs(shaper.tables, contextual_forms.default_tables)
+            self.assertEqual(shaper.shape(text), res)
+            self.assertEqual(shaper.unshape(res), decontextualize_text(res))
+            self.assertEqual(shaper.shape_many(text.split("\n")),
+                             res.split("\n"))
+            self.assertEqual(shaper.unshape_many(res.split("\n")),
+                             decontextualize_text(res).split("\n"))
+        self.assertEqual(Shaper(cache=True).unshape(res),
+                         decontextualize_text(res))
+        with self.assertRaises(ValueError):
+            Shaper(mode="unknown")
+        with self.assertRaises(TypeError):
+            Shaper(iso=iso_d)
+
+    def test_custom_profile(self):
+        iso = dict(iso_d, **{"ب": "ب"})
+        for mode in ["fsm", "regex"]:
+            shaper = Shaper(iso_d=iso, mode=mode)
+            self.assertEqual(shaper.shape("ب ببب"),
+                             contextualize_text("ب ببب", iso_d=iso))
+
+    def test_pickle(self):
+        shaper = pickle.loads(pickle.dumps(Shaper()))
+        self.assertIs(shaper.tables, contextual_forms.default_tables)
+        self.assertLess(len(pickle.dumps(Shaper())), 100)
+        iso = dict(iso_d, **{"ب": "ب"})
+        shaper = pickle.loads(pickle.dumps(Shaper(iso_d=iso, mode="regex")))
+        self.assertEqual(shaper.profile["iso_d"], iso)
+        self.assertEqual(shaper.shape("ب"), "ب")
+
+    def test_load_profile(self):
+        iso = dict(iso_d, **{"ب": "ب"})
+        decontext = dict(contextual_forms.decontext_d, **{"ﺏ": "x"})
+        with tempfile.TemporaryDirectory() as tmp:
+            fp = os.path.join(tmp, "profile.json")
+            with open(fp, mode="w", encoding="utf-8") as file:
+                json.dump({"iso_d": iso, "decontext_d": decontext,
+                           "normalize": False}, file)
+            cache_folder = os.path.join(tmp, "cache")
+            for i in range(2):
+                shaper = load_profile(fp, cache_folder, mode="regex")
+                self.assertEqual(len(os.listdir(cache_folder)), 1)
+                self.assertEqual(shaper.profile["mode"], "regex")
+                self.assertIsNone(shaper.profile["normalize_func"])
+                self.assertIs(shaper.profile["end_d"], end_d)
+                self.assertEqual(shaper.shape("ب بب"), "ب ﺑﺐ")
+                self.assertEqual(shaper.unshape("ﺏ ﺑﺐ"), "x بب")
+                self.assertEqual(shaper.decontext_table,
+                                 compile_decontext_table(decontext))
+            # processes that compile the profile at the same time:
+            from concurrent.futures import ProcessPoolExecutor
+            cache_folder = os.path.join(tmp, "cache2")
+            with ProcessPoolExecutor(max_workers=4) as executor:
+                shapers = list(executor.map(load_profile, [fp] * 8,
+                                            [cache_folder] * 8))
+            self.assertEqual(os.listdir(cache_folder),
+                             os.listdir(os.path.join(tmp, "cache")))
+            self.assertEqual(shapers[-1].unshape("ﺏ"), "x")
+            # a decontext_d argument overrides the one in the file:
+            decontext2 = dict(contextual_forms.decontext_d, **{"ﺏ": "y"})
+            shaper = load_profile(fp, cache_folder, decontext_d=decontext2)
+            self.assertEqual(shaper.unshape("ﺏ"), "y")
+            self.assertEqual(len(os.listdir(cache_folder)), 2)
+            for folder in [None, cache_folder]:
+                with self.assertRaises(TypeError):
+                    load_profile(fp, folder, moed="regex")
+            with open(fp, mode="w", encoding="utf-8") as file:
+                json.dump({"iso": iso}, file)
+            with self.assertRaises(ValueError):
+                load_profile(fp)
+
+
 class Test_normalization(unittest.TestCase):
     def test_AE(self):
         inp = "بعدە" # \u06d5 ARABIC LETTER AE
@@ -209,6 +682,30 @@ class Test_normalization(unittest.TestCase):
         inp = "ݣ" # ARABIC LETTER KEHEH WITH THREE DOTS ABOVE
         comp = "ڭ" # \u06AD ARABIC LETTER NG
         self.assertEqual(contextualize(inp), contextualize(comp))
+
+    def test_normalized_unchanged(self):
+        """already normalized text should not be copied"""
+        infp = "test/0851IbnQadiShuhba.TabaqatShaficiyya.JK000195-ara1"
+        with open(infp, mode="r", encoding="utf-8") as file:
+            text = unicodedata.normalize("NFKD", file.read())
+        self.assertIs(normalize(text), text)
+
+    def test_mappings(self):
+        inp = "کتاب"  # \u06a9 ARABIC LETTER KEHEH
+        comp = "كتاب" # \u0643 ARABIC LETTER KAF
+        mappings = dict(normalize_d, **{"ک": "ك"})
+        self.assertEqual(normalize(inp), inp)
+        self.assertEqual(normalize(inp, mappings=mappings), comp)
+
+    def test_no_heavy_imports(self):
+        """importing the module should not load openiti
+        or the multiprocessing machinery"""
+        code = ("import sys, contextual_forms; "
+                "print('openiti' in sys.modules, "
+                "'concurrent.futures' in sys.modules)")
+        out = subprocess.run([sys.executable, "-c", code],
+                             capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ["False", "False"])
   
 
 